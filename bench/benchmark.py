@@ -0,0 +1,234 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench.fakes import CAPTCHA_ANSWER, FakeGateway, FakePfr, make_document, write_fake_java
+from bench.synth import SyntheticDocuments
+from logging_excel.log import current_workbook
+from logsetup.logsetup import setup_logging
+from metrics import metrics
+from multiregion.context import current_region
+from pfrchecksnils.crome import configure_pfr
+from pipeline.pipeline import format_report, get_pipeline_config, run_pipeline
+
+logger = logging.getLogger(__name__)
+
+BENCH_REGION = "Bench"
+DEFAULT_SIZES = [100, 1000]
+
+
+def bench_config(gateway_endpoint: str, java_path: str, workers: Optional[Dict[str, int]] = None) -> dict:
+    """
+    Конфигурация с одним регионом `Bench`, который выгружает документы из заглушки шлюза
+    и подписывает их заглушкой подписи. Интервал между запросами выгрузки отключен.
+
+    :param gateway_endpoint: Адрес `api_endpoint` заглушки шлюза.
+    :param java_path: Путь к заглушке `java` (см. `write_fake_java`).
+    :param workers: Количество потоков стадий; по умолчанию — как в конвейере.
+    :return: Конфигурационный словарь.
+    """
+    return {
+        "regions": {
+            BENCH_REGION: {
+                "region_id": "00000000-0000-0000-0000-000000000000",
+                "properties": "JCP.properties_Bench",
+                "api_endpoint": gateway_endpoint,
+                "adress_url_curl": "http://127.0.0.1/resource",
+            }
+        },
+        "signing": {"java_path": java_path, "jar_path": "fake-sign.jar"},
+        "pipeline": {"fetch_interval": 0, "workers": workers or {}},
+        "profiling": {"enabled": False},
+    }
+
+
+def stage_throughput(report: dict, workers: Dict[str, int]) -> Dict[str, dict]:
+    """
+    Пропускная способность стадий по отчету конвейера.
+
+    `effective` — сколько элементов стадия обработала за секунду запуска; `capacity` — сколько
+    смогла бы обработать при полной загрузке своих потоков (потоки / среднее время). Стадия
+    с наименьшей `capacity` ограничивает весь конвейер.
+
+    :param report: Отчет `Pipeline.run`.
+    :param workers: Количество потоков стадий.
+    :return: Словарь «стадия → {effective, capacity}» в UID/с.
+    """
+    elapsed = report["elapsed"] or 1e-9
+    result = {}
+    for name, stats in report["stages"].items():
+        mean = stats["mean"]
+        result[name] = {
+            "effective": stats["count"] / elapsed,
+            "capacity": workers.get(name, 1) / mean if mean else 0.0,
+        }
+    return result
+
+
+def run_batch(size: int, gateway: FakeGateway, pfr: FakePfr, java_path: str, workspace: str,
+              workers: Optional[Dict[str, int]] = None, uid_prefix: str = "bench") -> dict:
+    """
+    Прогоняет через конвейер пакет из `size` UID.
+
+    Каждый пакет работает в собственном каталоге и под собственным именем региона, поэтому
+    реестр СНИЛС и Excel-лог предыдущих пакетов не влияют на результат.
+
+    :return: Итоги пакета: отчет конвейера, пропускная способность стадий и таблица замеров операций.
+    """
+    region_key = f"{BENCH_REGION}-{size}-{time.monotonic_ns()}"
+    os.makedirs(workspace, exist_ok=True)
+    config = bench_config(gateway.api_endpoint, java_path, workers)
+    stage_workers = get_pipeline_config(config, BENCH_REGION)["workers"]
+    local_uids = [f"{uid_prefix}-{size}-{number:08d}" for number in range(size)]
+    gateway_requests, pfr_requests, captchas = gateway.requests, pfr.requests, pfr.captchas
+
+    def run():
+        current_region.set(region_key)
+        current_workbook.set(os.path.join(workspace, "log_results.xlsx"))
+        since = metrics.snapshot()
+        report = run_pipeline(
+            config, BENCH_REGION, local_uids, None, total=size, workspace=workspace,
+            curl_file=os.path.join(workspace, "curl_commands.txt"),
+        )
+        return report, metrics.format_summary(since)
+
+    report, operations = contextvars.copy_context().run(run)
+    return {
+        "size": size,
+        "report": report,
+        "stages": stage_throughput(report, stage_workers),
+        "operations": operations,
+        "requests": {
+            "gateway": gateway.requests - gateway_requests,
+            "pfr": pfr.requests - pfr_requests,
+            "captchas": pfr.captchas - captchas,
+        },
+    }
+
+
+def format_batch(result: dict) -> str:
+    """
+    Форматирует итоги пакета: отчет конвейера, пропускную способность стадий и замеры операций.
+    """
+    report = result["report"]
+    requests = result["requests"]
+    lines = [
+        f"Пакет {result['size']} UID: подписано {report['completed']}, "
+        f"{report['throughput']:.1f} UID/с, задержка p50 {report['latency']['p50']:.3f} с, "
+        f"p95 {report['latency']['p95']:.3f} с",
+        f"Запросы: шлюз {requests['gateway']}, ПФР {requests['pfr']}, капч {requests['captchas']}",
+        format_report(report),
+        "",
+        f"{'Стадия':<10}{'факт, UID/с':>14}{'предел, UID/с':>16}",
+    ]
+    for name, throughput in result["stages"].items():
+        lines.append(f"{name:<10}{throughput['effective']:>14.1f}{throughput['capacity']:>16.1f}")
+    lines.extend(["", result["operations"]])
+    return '\n'.join(lines)
+
+
+def run_benchmark(sizes: List[int], gateway_latency: float = 0.0, pfr_latency: float = 0.0,
+                  signer_delay: float = 0.0, captcha_every: int = 0, gateway_error_rate: float = 0.0,
+                  antispam_rate: float = 0.0, workers: Optional[Dict[str, int]] = None, seed: int = 0,
+                  document_factory: Callable[[str], dict] = make_document, directory: Optional[str] = None,
+                  on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Запускает конвейер на локальных заглушках шлюза, ПФР и подписи для каждого размера пакета.
+
+    Сеть, капча и JVM заменяются заглушками с настраиваемыми задержками, поэтому результаты
+    воспроизводимы и не зависят от внешних сервисов.
+
+    :param sizes: Размеры пакетов.
+    :param gateway_latency: Задержка ответа шлюза, секунды.
+    :param pfr_latency: Задержка ответа ПФР, секунды.
+    :param signer_delay: Длительность одной подписи, секунды.
+    :param captcha_every: ПФР требует капчу после стольких проверок (0 — один раз за сессию).
+    :param gateway_error_rate: Доля ответов 500 от шлюза.
+    :param antispam_rate: Доля ответов 9107 от ПФР.
+    :param workers: Количество потоков стадий.
+    :param seed: Зерно генераторов заглушек.
+    :param document_factory: Функция `local_uid -> dict`, формирующая документы шлюза.
+    :param directory: Каталог для рабочих файлов (по умолчанию временный, удаляется после запуска).
+    :param on_result: Функция, вызываемая с итогами каждого пакета сразу после его завершения.
+    :return: Список итогов пакетов (см. `run_batch`).
+    """
+    gateway = FakeGateway(document_factory, gateway_latency, gateway_error_rate, seed)
+    pfr = FakePfr(pfr_latency, captcha_every, antispam_rate, seed)
+    temporary = None if directory else tempfile.TemporaryDirectory(prefix="bench-")
+    base_directory = directory or temporary.name
+    results = []
+    try:
+        java_path = write_fake_java(base_directory, signer_delay)
+        configure_pfr(pfr.url, os.path.join(base_directory, "session.pkl"), lambda image: CAPTCHA_ANSWER)
+        for size in sizes:
+            logger.info("Пакет %s UID", size)
+            result = run_batch(size, gateway, pfr, java_path, os.path.join(base_directory, f"batch-{size}"), workers)
+            results.append(result)
+            if on_result:
+                on_result(result)
+    finally:
+        configure_pfr()
+        gateway.close()
+        pfr.close()
+        if temporary:
+            temporary.cleanup()
+    return results
+
+
+def main(argv=None):
+    """
+    Стенд производительности конвейера на локальных заглушках.
+
+    Пример::
+
+        python -m bench.benchmark --sizes 100 1000 --pfr-latency 0.05 --signer-delay 0.3 --workers sign=4
+    """
+    parser = argparse.ArgumentParser(description="Замер пропускной способности и задержек конвейера на заглушках")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Размеры пакетов")
+    parser.add_argument("--gateway-latency", type=float, default=0.0, help="Задержка ответа шлюза, с")
+    parser.add_argument("--pfr-latency", type=float, default=0.0, help="Задержка ответа ПФР, с")
+    parser.add_argument("--signer-delay", type=float, default=0.0, help="Длительность одной подписи, с")
+    parser.add_argument("--captcha-every", type=int, default=0, help="Требовать капчу после стольких проверок ПФР")
+    parser.add_argument("--gateway-error-rate", type=float, default=0.0, help="Доля ответов 500 от шлюза")
+    parser.add_argument("--antispam-rate", type=float, default=0.0, help="Доля ответов 9107 от ПФР")
+    parser.add_argument("--workers", nargs="*", default=[], metavar="STAGE=N", help="Потоки стадий, например fetch=8")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно генераторов заглушек")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Отдавать из шлюза синтетические документы с дубликатами, ошибками и разными размерами (bench.synth)")
+    parser.add_argument("--directory", help="Каталог рабочих файлов (по умолчанию временный)")
+    parser.add_argument("--output", help="Сохранить итоги в JSON")
+    parser.add_argument("--log", default="", help="Файл лога (по умолчанию вывод предупреждений в stderr)")
+    args = parser.parse_args(argv)
+
+    try:
+        workers = {name: int(count) for name, count in (item.split("=", 1) for item in args.workers)}
+    except ValueError:
+        parser.error("--workers ожидает значения вида STAGE=N")
+    setup_logging({"level": "INFO" if args.log else "WARNING", "rollover_on_start": False}, args.log)
+
+    document_factory = SyntheticDocuments(args.seed).document_for_uid if args.synthetic else make_document
+    results = run_benchmark(
+        args.sizes, args.gateway_latency, args.pfr_latency, args.signer_delay, args.captcha_every,
+        args.gateway_error_rate, args.antispam_rate, workers, args.seed, document_factory, args.directory,
+        on_result=lambda result: print(format_batch(result) + "\n", flush=True),
+    )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump([{key: value for key, value in result.items() if key != "operations"} for result in results],
+                      f, ensure_ascii=False, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Заглушка подписи XML с тем же интерфейсом командной строки, что и xmlfile-sign:
+
+    <java> -Dfile.encoding=UTF-8 -DpropsFile=<props> -jar <jar> SOAP12 <props> <входной файл> <выходной файл>
+
+Копирует входной файл в выходной, добавляя элемент подписи, и печатает `Signature valid`.
+Переменная окружения `FAKE_SIGNER_DELAY` задает искусственную длительность в секундах.
+"""
+import os
+import sys
+import time
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        position = argv.index("SOAP12")
+        _, source, target = argv[position + 1:position + 4]
+    except ValueError:
+        print("Usage: ... SOAP12 <props> <in> <out>", file=sys.stderr)
+        return 2
+
+    delay = float(os.environ.get("FAKE_SIGNER_DELAY") or 0)
+    if delay:
+        time.sleep(delay)
+
+    try:
+        with open(source, "r", encoding="utf-8") as f:
+            content = f.read()
+    except OSError as e:
+        print(f"Cannot read {source}: {e}", file=sys.stderr)
+        return 1
+
+    signature = "<ds:Signature xmlns:ds=\"http://www.w3.org/2000/09/xmldsig#\">fake</ds:Signature>"
+    marker = "<soap:Header>"
+    content = content.replace(marker, marker + signature, 1) if marker in content else content + signature
+    with open(target, "w", encoding="utf-8") as f:
+        f.write(content)
+    print("Signature valid")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+import base64
+import json
+import os
+import random
+import secrets
+import stat
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FAKE_SIGNER = os.path.join(BENCH_DIRECTORY, "fake_signer.py")
+
+CHECK_PAGE = "<html><body><h1>Проверка СНИЛС</h1></body></html>"
+USER_CHECK_PAGE = "<html><body><h1>Проверка пользователя</h1><img src=\"/api/captcha/img\"></body></html>"
+CAPTCHA_ANSWER = "1234"
+# Минимальный корректный PNG 1x1, чтобы PIL мог открыть «капчу».
+CAPTCHA_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+SURNAMES = [("Иванов", "Иванова"), ("Петров", "Петрова"), ("Смирнов", "Смирнова"), ("Кузнецов", "Кузнецова")]
+NAMES = [("Иван", "1"), ("Сергей", "1"), ("Анна", "2"), ("Мария", "2")]
+PATRONYMICS = [("Иванович", "Ивановна"), ("Петрович", "Петровна"), ("Сергеевич", "Сергеевна")]
+
+
+def snils_checksum(digits: str) -> str:
+    """
+    Контрольное число СНИЛС по первым девяти цифрам.
+    """
+    total = sum(int(digit) * (9 - position) for position, digit in enumerate(digits))
+    if total > 101:
+        total %= 101
+    return "00" if total in (100, 101) else f"{total:02d}"
+
+
+def make_document(local_uid: str) -> dict:
+    """
+    Простой документ в формате ответа шлюза: корректный пациент с ошибкой PATIENT_MPI_MISMATCH
+    и организацией. Данные детерминированы по `local_uid`.
+    """
+    rng = random.Random(local_uid)
+    name, gender = rng.choice(NAMES)
+    surname = rng.choice(SURNAMES)[0 if gender == "1" else 1]
+    patronymic = rng.choice(PATRONYMICS)[0 if gender == "1" else 1]
+    digits = f"{rng.randrange(1000000, 999999999):09d}"
+    cda = (
+        "<ClinicalDocument><author><assignedAuthor><representedOrganization/></assignedAuthor></author>"
+        "<providerOrganization><id root=\"1.2.643.5.1.13.13.12.2.77.7777\"/><name>ГБУЗ Тестовая больница</name>"
+        "</providerOrganization></ClinicalDocument>"
+    )
+    return {
+        "localId": local_uid,
+        "patient": {
+            "localId": local_uid,
+            "surname": surname,
+            "name": name,
+            "patrName": patronymic,
+            "birthDate": f"{rng.randint(1940, 2010)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "snils": digits + snils_checksum(digits),
+            "gender": {"code": gender},
+        },
+        "errors": [{"code": "PATIENT_MPI_MISMATCH", "message": "Имя пациента не совпадает с данными МПИ"}],
+        "organization": {"code": "1.2.643.5.1.13.13.12.2.77.7777", "displayName": "ГБУЗ Тестовая больница"},
+        "docContent": {"data": base64.b64encode(cda.encode("utf-8")).decode("ascii")},
+    }
+
+
+class FakeServer:
+    """
+    Локальный HTTP-сервер в фоновом потоке на свободном порту 127.0.0.1.
+
+    :param handler_class: Класс обработчика запросов; получает сервер через `self.server.fake`.
+    :param latency: Задержка ответа на каждый запрос, секунды.
+    """
+
+    def __init__(self, handler_class, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def hit(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, status: int, body, content_type: str, headers: Optional[dict] = None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, data):
+        self.send_body(status, json.dumps(data, ensure_ascii=False), "application/json; charset=utf-8")
+
+    def read_form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        return {key: values[-1] for key, values in form.items()}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _GatewayHandler(_Handler):
+    def do_GET(self):
+        fake = self.server.fake
+        fake.hit()
+        prefix = "/api/v1/documents/"
+        if not self.path.startswith(prefix):
+            self.send_json(404, {"error": "not found"})
+            return
+        local_uid = self.path[len(prefix):]
+        if local_uid.startswith("missing") or fake.should_fail():
+            self.send_json(404 if local_uid.startswith("missing") else 500, {"error": "document unavailable"})
+            return
+        self.send_json(200, fake.document_factory(local_uid))
+
+
+class FakeGateway(FakeServer):
+    """
+    Заглушка spring-cloud-gateway: `GET /api/v1/documents/<local_uid>` возвращает документ.
+
+    UID, начинающиеся с `missing`, дают 404; `error_rate` — доля ответов 500.
+
+    :param document_factory: Функция `local_uid -> dict` (по умолчанию `make_document`).
+    :param latency: Задержка ответа, секунды.
+    :param error_rate: Доля случайных ошибок сервера.
+    :param seed: Зерно генератора ошибок.
+    """
+
+    def __init__(self, document_factory: Callable[[str], dict] = make_document, latency: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.document_factory = document_factory
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        super().__init__(_GatewayHandler, latency)
+
+    @property
+    def api_endpoint(self) -> str:
+        return f"{self.url}/api/v1/documents/"
+
+    def should_fail(self) -> bool:
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+
+class _PfrHandler(_Handler):
+    def _token(self) -> Optional[str]:
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "session":
+                return value
+        return None
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.hit()
+        token = self._token()
+        if self.path == "/checkSnils":
+            if fake.is_verified(token):
+                self.send_body(200, CHECK_PAGE, "text/html; charset=utf-8")
+            else:
+                token = fake.new_token()
+                self.send_body(200, USER_CHECK_PAGE, "text/html; charset=utf-8",
+                               {"Set-Cookie": f"session={token}; Path=/"})
+        elif self.path.startswith("/api/captcha/img"):
+            self.send_body(200, CAPTCHA_PNG, "image/png")
+        else:
+            self.send_body(404, "not found", "text/plain")
+
+    def do_POST(self):
+        fake = self.server.fake
+        fake.hit()
+        token = self._token()
+        form = self.read_form()
+        if self.path == "/checkSnils":
+            if form.get("captcha-response") == CAPTCHA_ANSWER and token:
+                fake.verify(token)
+                self.send_body(200, CHECK_PAGE, "text/html; charset=utf-8")
+            else:
+                self.send_body(200, USER_CHECK_PAGE, "text/html; charset=utf-8")
+        elif self.path == "/api/service_checkSnils":
+            self.send_json(200, fake.check_snils(token, form))
+        else:
+            self.send_body(404, "not found", "text/plain")
+
+
+class FakePfr(FakeServer):
+    """
+    Заглушка сервиса проверки СНИЛС ПФР.
+
+    - `GET /checkSnils` — страница «Проверка пользователя» для непроверенной сессии (и новая cookie);
+    - `GET /api/captcha/img` — изображение капчи, верный ответ `CAPTCHA_ANSWER`;
+    - `POST /checkSnils` — проверка ответа на капчу;
+    - `POST /api/service_checkSnils` — `{"error": 9107}` (антиспам), `{"error": 5624}` (некорректный СНИЛС)
+      или `{"data": {"isValid": true, "personFIO": {...}}}`.
+
+    :param latency: Задержка ответа, секунды.
+    :param captcha_every: Сессия требует новую капчу после стольких проверок (0 — никогда).
+    :param antispam_rate: Доля ответов 9107 для проверенной сессии.
+    :param seed: Зерно генератора.
+    """
+
+    def __init__(self, latency: float = 0.0, captcha_every: int = 0, antispam_rate: float = 0.0, seed: int = 0):
+        self.captcha_every = captcha_every
+        self.antispam_rate = antispam_rate
+        self.captchas = 0
+        self._verified = {}
+        self._rng = random.Random(seed)
+        self._state_lock = threading.Lock()
+        super().__init__(_PfrHandler, latency)
+
+    def new_token(self) -> str:
+        return secrets.token_hex(8)
+
+    def is_verified(self, token) -> bool:
+        with self._state_lock:
+            return token in self._verified
+
+    def verify(self, token):
+        with self._state_lock:
+            self._verified[token] = 0
+            self.captchas += 1
+
+    def check_snils(self, token, form: dict) -> dict:
+        with self._state_lock:
+            if token not in self._verified:
+                return {"error": 9107}
+            self._verified[token] += 1
+            if self.captcha_every and self._verified[token] >= self.captcha_every:
+                del self._verified[token]
+            antispam = self._rng.random() < self.antispam_rate
+        if antispam:
+            return {"error": 9107}
+
+        snils = "".join(ch for ch in form.get("userData[snils]", "") if ch.isdigit())
+        if len(snils) != 11 or snils_checksum(snils[:9]) != snils[9:]:
+            return {"error": 5624}
+        return {"data": {"isValid": True, "personFIO": {
+            "lastName": form.get("userData[nameLast]"),
+            "firstName": form.get("userData[nameFirst]"),
+            "patronymic": form.get("userData[patronymic]") or None,
+        }}}
+
+
+def write_fake_java(directory: str, delay: float = 0.0) -> str:
+    """
+    Создает исполняемый файл, который вызывается вместо `java` и запускает `fake_signer.py`.
+
+    Путь к JAR при этом передается, но не используется.
+
+    :param directory: Каталог для файла.
+    :param delay: Искусственная длительность подписи, секунды (имитация запуска JVM).
+    :return: Путь к файлу для `signing.java_path`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if os.name == "nt":
+        path = os.path.join(directory, "fake-java.cmd")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f'@set FAKE_SIGNER_DELAY={delay}\r\n@"{sys.executable}" "{FAKE_SIGNER}" %*\r\n')
+    else:
+        path = os.path.join(directory, "fake-java")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f'#!/bin/sh\nFAKE_SIGNER_DELAY={delay} exec "{sys.executable}" "{FAKE_SIGNER}" "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
@@ -0,0 +1,102 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_TARGETS = [
+    "main",
+    "tpdoc.tpdoc",
+    "tp.check_patient",
+    "samplexml.xml",
+    "signature.sign",
+    "pipeline.pipeline",
+]
+
+
+def measure_import(module_name: str, python: str = sys.executable) -> List[Tuple[int, int, str]]:
+    """
+    Импортирует модуль в отдельном процессе с `-X importtime` и разбирает отчет интерпретатора.
+
+    Процесс запускается во временном каталоге, чтобы побочные файлы (например, `main.log`)
+    не попадали в рабочую папку.
+
+    :param module_name: Имя импортируемого модуля.
+    :param python: Интерпретатор для замера.
+    :return: Список кортежей (собственное время, суммарное время в мкс, имя модуля) в порядке отчета.
+    """
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    with tempfile.TemporaryDirectory() as work_directory:
+        result = subprocess.run(
+            [python, "-X", "importtime", "-c", f"import {module_name}"],
+            capture_output=True, text=True, cwd=work_directory, env=env,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {module_name} завершился ошибкой:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return entries
+
+
+def top_level_packages(entries: List[Tuple[int, int, str]]) -> Dict[str, int]:
+    """
+    Суммирует собственное время импорта по пакетам верхнего уровня (openpyxl, PIL, pymorphy3...).
+    """
+    totals = {}
+    for self_us, _, name in entries:
+        package = name.strip().split(".", 1)[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return totals
+
+
+def format_import_report(module_name: str, entries: List[Tuple[int, int, str]], top: int = 10) -> str:
+    """
+    Форматирует отчет о времени импорта модуля.
+
+    :param module_name: Имя модуля.
+    :param entries: Результат `measure_import`.
+    :param top: Количество самых тяжелых пакетов в отчете.
+    :return: Текст отчета.
+    """
+    total_us = sum(self_us for self_us, _, _ in entries)
+    lines = [f"{module_name}: {total_us / 1000:.0f} мс, модулей {len(entries)}"]
+    packages = sorted(top_level_packages(entries).items(), key=lambda item: item[1], reverse=True)
+    for package, package_us in packages[:top]:
+        lines.append(f"    {package:<24} {package_us / 1000:8.1f} мс")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Отчет о времени импорта модулей программы (аналог `python -X importtime`).
+
+    Пример::
+
+        python -m bench.importtime
+        python -m bench.importtime main tp.check_patient --top 5
+    """
+    parser = argparse.ArgumentParser(description="Время импорта модулей программы")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_TARGETS, help="Модули для замера")
+    parser.add_argument("--top", type=int, default=10, help="Количество самых тяжелых пакетов в отчете")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество замеров; выводится лучший")
+    args = parser.parse_args(argv)
+
+    for module_name in args.modules:
+        best = None
+        for _ in range(max(1, args.repeat)):
+            entries = measure_import(module_name)
+            if best is None or sum(e[0] for e in entries) < sum(e[0] for e in best):
+                best = entries
+        print(format_import_report(module_name, best, args.top))
+
+
+if __name__ == "__main__":
+    main()
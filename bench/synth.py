@@ -0,0 +1,352 @@
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench.fakes import snils_checksum
+from docstore.docstore import get_store
+
+DEFAULT_PREFIX = "synth-"
+DEFAULT_MIX = {
+    "duplicate_rate": 0.05,
+    "whitespace_rate": 0.02,
+    "missing_organization_rate": 0.1,
+    "missing_provider_rate": 0.2,
+    "gender_mismatch_rate": 0.03,
+    "no_mismatch_rate": 0.05,
+    "missing_patronymic_rate": 0.02,
+    "sizes": [[2000, 0.8], [10000, 0.18], [100000, 0.02]],
+}
+
+# (фамилия муж., фамилия жен.)
+SURNAMES = [
+    ("Иванов", "Иванова"), ("Петров", "Петрова"), ("Смирнов", "Смирнова"), ("Кузнецов", "Кузнецова"),
+    ("Попов", "Попова"), ("Васильев", "Васильева"), ("Соколов", "Соколова"), ("Михайлов", "Михайлова"),
+    ("Новиков", "Новикова"), ("Федоров", "Федорова"), ("Морозов", "Морозова"), ("Волков", "Волкова"),
+    ("Алексеев", "Алексеева"), ("Лебедев", "Лебедева"), ("Семенов", "Семенова"), ("Егоров", "Егорова"),
+]
+MALE_NAMES = ["Александр", "Сергей", "Дмитрий", "Андрей", "Алексей", "Иван", "Михаил", "Николай", "Павел", "Владимир"]
+FEMALE_NAMES = ["Елена", "Ольга", "Наталья", "Татьяна", "Ирина", "Анна", "Мария", "Светлана", "Екатерина", "Юлия"]
+# (отчество муж., отчество жен.)
+PATRONYMICS = [
+    ("Александрович", "Александровна"), ("Сергеевич", "Сергеевна"), ("Иванович", "Ивановна"),
+    ("Петрович", "Петровна"), ("Николаевич", "Николаевна"), ("Владимирович", "Владимировна"),
+]
+
+MISMATCH_MESSAGES = [
+    "Имя пациента не совпадает с данными МПИ",
+    "Дата рождения пациента не совпадает с данными МПИ",
+    "СНИЛС пациента не совпадает с данными МПИ",
+]
+GENDER_MESSAGE = "Пол пациента не совпадает с данными МПИ"
+# Ошибки, которые проверка не учитывает: документ попадет на лист «PATIENT_MPI_MISMATCH нет».
+IRRELEVANT_ERRORS = [
+    {"code": "PATIENT_MPI_MISMATCH", "message": "Адрес пациента не совпадает с данными МПИ"},
+    {"code": "DOCUMENT_VALIDATION", "message": "Не заполнено необязательное поле"},
+]
+
+ORGANIZATIONS = 32
+# Множитель взаимно прост с 10**9, поэтому разные номера документов дают разные СНИЛС.
+_SNILS_MULTIPLIER = 387420489
+
+_FILLER = "<component><section><text>Синтетическое содержимое документа для нагрузочного тестирования.</text></section></component>"
+
+
+def organization(number: int) -> Tuple[str, str]:
+    """
+    :return: OID и название синтетической организации с номером `number`.
+    """
+    return f"1.2.643.5.1.13.13.12.2.77.{7000 + number}", f"ГБУЗ Городская больница № {number + 1}"
+
+
+def make_cda(number: int, size: int, with_provider: bool = True) -> str:
+    """
+    Формирует тело CDA-документа примерно заданного размера.
+
+    :param number: Номер организации.
+    :param size: Желаемый размер тела в байтах.
+    :param with_provider: Включать ли блок `<providerOrganization>` с OID и названием организации.
+    :return: Текст документа.
+    """
+    oid, name = organization(number)
+    provider = (
+        f'<providerOrganization>\n<id root="{oid}"/>\n<name>{name}</name>\n</providerOrganization>'
+        if with_provider else ""
+    )
+    head = f'<ClinicalDocument xmlns="urn:hl7-org:v3"><author><assignedAuthor>{provider}</assignedAuthor></author>'
+    tail = "</ClinicalDocument>"
+    filler_size = len(_FILLER.encode("utf-8"))
+    padding = max(0, size - len(head.encode("utf-8")) - len(tail)) // filler_size
+    return head + _FILLER * padding + tail
+
+
+class SyntheticDocuments:
+    """
+    Воспроизводимый генератор документов в формате ответа spring-cloud-gateway (`data/<local_uid>.json`).
+
+    Документ с номером `index` зависит только от `seed`, `index` и состава `mix`, поэтому любой
+    документ можно получить отдельно (например, в заглушке шлюза), а большой набор — генерировать
+    параллельно по диапазонам номеров.
+
+    Состав набора задается долями в `mix` (см. `DEFAULT_MIX`):
+
+    - `duplicate_rate` — СНИЛС совпадает со СНИЛС одного из предыдущих документов;
+    - `whitespace_rate` — пробел в начале или конце фамилии, имени или отчества;
+    - `missing_organization_rate` — нет раздела `organization`, организация берется из тела документа;
+    - `missing_provider_rate` — доля таких документов, в теле которых нет и `<providerOrganization>`;
+    - `gender_mismatch_rate` — ошибка «Пол пациента» и пол, не соответствующий ФИО;
+    - `no_mismatch_rate` — нет учитываемых ошибок PATIENT_MPI_MISMATCH;
+    - `missing_patronymic_rate` — нет поля `patrName`;
+    - `sizes` — список пар «размер тела в байтах, вес».
+
+    :param seed: Зерно генератора.
+    :param mix: Доли вариантов; недостающие значения берутся из `DEFAULT_MIX`.
+    :param prefix: Префикс локальных UID (`<prefix><номер из 8 цифр>`).
+    """
+
+    def __init__(self, seed: int = 0, mix: Optional[dict] = None, prefix: str = DEFAULT_PREFIX):
+        self.seed = seed
+        self.mix = {**DEFAULT_MIX, **(mix or {})}
+        self.prefix = prefix
+        self._sizes = [int(size) for size, _ in self.mix["sizes"]]
+        self._size_weights = [float(weight) for _, weight in self.mix["sizes"]]
+        self._content = {}
+        self._content_lock = threading.Lock()
+
+    def local_uid(self, index: int) -> str:
+        return f"{self.prefix}{index:08d}"
+
+    def snils(self, index: int) -> str:
+        """
+        :return: Уникальный для номера документа СНИЛС с верным контрольным числом.
+        """
+        digits = f"{(index * _SNILS_MULTIPLIER + self.seed * 7919 + 1001999) % 10**9:09d}"
+        return digits + snils_checksum(digits)
+
+    def _doc_content(self, number: int, size: int, with_provider: bool) -> str:
+        key = (number, size, with_provider)
+        content = self._content.get(key)
+        if content is None:
+            content = base64.b64encode(make_cda(number, size, with_provider).encode("utf-8")).decode("ascii")
+            with self._content_lock:
+                self._content[key] = content
+        return content
+
+    def document(self, index: int) -> dict:
+        """
+        Формирует документ с номером `index`.
+
+        :param index: Номер документа (от нуля).
+        :return: Документ в формате ответа шлюза.
+        """
+        mix = self.mix
+        rng = random.Random(self.seed * 1000003 + index)
+        local_uid = self.local_uid(index)
+
+        male = rng.random() < 0.5
+        surname = rng.choice(SURNAMES)[0 if male else 1]
+        name = rng.choice(MALE_NAMES if male else FEMALE_NAMES)
+        patronymic = rng.choice(PATRONYMICS)[0 if male else 1]
+        gender = "1" if male else "2"
+
+        snils_index = index
+        if index and rng.random() < mix["duplicate_rate"]:
+            snils_index = rng.randrange(index)
+
+        errors = []
+        if rng.random() < mix["no_mismatch_rate"]:
+            errors.append(dict(rng.choice(IRRELEVANT_ERRORS)))
+        else:
+            errors.append({"code": "PATIENT_MPI_MISMATCH", "message": rng.choice(MISMATCH_MESSAGES)})
+            if rng.random() < mix["gender_mismatch_rate"]:
+                errors.append({"code": "PATIENT_MPI_MISMATCH", "message": GENDER_MESSAGE})
+                gender = "2" if male else "1"
+
+        if rng.random() < mix["whitespace_rate"]:
+            field = rng.randrange(3)
+            if field == 0:
+                surname = surname + " "
+            elif field == 1:
+                name = " " + name
+            else:
+                patronymic = patronymic + " "
+
+        patient = {
+            "localId": local_uid,
+            "surname": surname,
+            "name": name,
+            "birthDate": f"{rng.randint(1940, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "snils": self.snils(snils_index),
+            "gender": {"code": gender, "displayName": "Мужской" if gender == "1" else "Женский"},
+        }
+        if rng.random() >= mix["missing_patronymic_rate"]:
+            patient["patrName"] = patronymic
+
+        number = rng.randrange(ORGANIZATIONS)
+        size = rng.choices(self._sizes, self._size_weights)[0]
+        document = {"localId": local_uid, "patient": patient, "errors": errors}
+        with_provider = True
+        if rng.random() < mix["missing_organization_rate"]:
+            with_provider = rng.random() >= mix["missing_provider_rate"]
+        else:
+            oid, display_name = organization(number)
+            document["organization"] = {"code": oid, "displayName": display_name}
+        document["docContent"] = {"mimeType": "text/xml", "data": self._doc_content(number, size, with_provider)}
+        return document
+
+    def document_for_uid(self, local_uid: str) -> dict:
+        """
+        Документ для произвольного UID: номер берется из цифр после последнего `-`,
+        а если их нет — из контрольной суммы UID. Подходит как `document_factory` заглушки шлюза.
+        """
+        tail = local_uid.rsplit("-", 1)[-1]
+        index = int(tail) if tail.isdigit() else zlib.crc32(local_uid.encode("utf-8"))
+        document = self.document(index)
+        document["localId"] = document["patient"]["localId"] = local_uid
+        return document
+
+    def documents(self, count: int, start: int = 0) -> Iterator[Tuple[str, dict]]:
+        """
+        :return: Пары (local_uid, документ) для номеров `start ... start + count - 1`.
+        """
+        for index in range(start, start + count):
+            yield self.local_uid(index), self.document(index)
+
+
+def write_documents(generator: SyntheticDocuments, data_directory: str, count: int, start: int = 0,
+                    indent: Optional[int] = None, store: bool = False) -> int:
+    """
+    Записывает документы в `data_directory/<local_uid>.json` или в хранилище документов этой папки.
+
+    :param generator: Генератор документов.
+    :param data_directory: Папка для документов.
+    :param count: Количество документов.
+    :param start: Номер первого документа.
+    :param indent: Отступ JSON (`None` — компактная запись, быстрее и меньше на диске).
+    :param store: Сохранять в хранилище (`docstore`), как это делает выгрузка, а не отдельными файлами.
+    :return: Суммарный размер записанных файлов в байтах (для хранилища — 0, см. `DocumentStore.stats`).
+    """
+    os.makedirs(data_directory, exist_ok=True)
+    if store:
+        document_store = get_store(data_directory)
+        for local_uid, document in generator.documents(count, start):
+            document_store.put(local_uid, document)
+        return 0
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=indent)
+    written = 0
+    for local_uid, document in generator.documents(count, start):
+        content = encoder.encode(document).encode("utf-8")
+        with open(os.path.join(data_directory, f"{local_uid}.json"), "wb") as f:
+            f.write(content)
+        written += len(content)
+    return written
+
+
+def _write_chunk(seed, mix, prefix, data_directory, count, start, indent, store):
+    return write_documents(SyntheticDocuments(seed, mix, prefix), data_directory, count, start, indent, store)
+
+
+def generate(data_directory: str, count: int, seed: int = 0, mix: Optional[dict] = None,
+             prefix: str = DEFAULT_PREFIX, jobs: int = 1, indent: Optional[int] = None,
+             uid_file: Optional[str] = None, chunk_size: int = 10000, store: bool = False) -> Dict[str, float]:
+    """
+    Генерирует набор из `count` документов, при `jobs > 1` — в нескольких процессах.
+
+    Результат не зависит от количества процессов: документ определяется только зерном и номером.
+
+    :param data_directory: Папка для документов (`data`).
+    :param count: Количество документов.
+    :param seed: Зерно генератора.
+    :param mix: Доли вариантов (см. `SyntheticDocuments`).
+    :param prefix: Префикс локальных UID.
+    :param jobs: Количество процессов.
+    :param indent: Отступ JSON.
+    :param uid_file: Файл, в который записывается список UID по порядку (вход для программы и `bench.benchmark`).
+    :param chunk_size: Количество документов в одном задании процесса.
+    :param store: Сохранять в хранилище документов (`docstore`).
+    :return: Итоги: количество документов, байты, время и скорость.
+    """
+    started = time.perf_counter()
+    chunks = [(start, min(chunk_size, count - start)) for start in range(0, count, chunk_size)]
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(_write_chunk, seed, mix, prefix, data_directory, size, start, indent, store)
+                       for start, size in chunks]
+            written = sum(future.result() for future in futures)
+    else:
+        generator = SyntheticDocuments(seed, mix, prefix)
+        written = sum(write_documents(generator, data_directory, size, start, indent, store) for start, size in chunks)
+
+    if store:
+        written = get_store(data_directory).stats()["stored_bytes"]
+
+    if uid_file:
+        generator = SyntheticDocuments(seed, mix, prefix)
+        with open(uid_file, "w", encoding="utf-8") as f:
+            f.writelines(generator.local_uid(index) + "\n" for index in range(count))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": count,
+        "bytes": written,
+        "elapsed": elapsed,
+        "rate": count / elapsed if elapsed else 0.0,
+    }
+
+
+def _parse_sizes(values: List[str]) -> List[List[float]]:
+    sizes = []
+    for value in values:
+        size, _, weight = value.partition(":")
+        sizes.append([int(size), float(weight or 1)])
+    return sizes
+
+
+def main(argv=None):
+    """
+    Генератор синтетических документов для нагрузочного тестирования.
+
+    Пример::
+
+        python -m bench.synth 1000000 --data data --uids uids.txt --jobs 8 --seed 42 --duplicate-rate 0.1
+    """
+    parser = argparse.ArgumentParser(description="Генерация синтетических документов data/<uid>.json")
+    parser.add_argument("count", type=int, help="Количество документов")
+    parser.add_argument("--data", default="data", help="Папка для документов")
+    parser.add_argument("--uids", help="Файл со списком UID")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно генератора")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Префикс локальных UID")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Количество процессов")
+    parser.add_argument("--indent", type=int, help="Отступ JSON (по умолчанию компактная запись)")
+    parser.add_argument("--store", action="store_true", help="Сохранять в хранилище документов (docstore)")
+    for key in DEFAULT_MIX:
+        if key != "sizes":
+            parser.add_argument("--" + key.replace("_", "-"), type=float, default=DEFAULT_MIX[key], dest=key)
+    parser.add_argument("--size", action="append", metavar="BYTES[:WEIGHT]",
+                        help="Размер тела документа и его вес; можно указать несколько раз")
+    args = parser.parse_args(argv)
+
+    mix = {key: getattr(args, key) for key in DEFAULT_MIX if key != "sizes"}
+    if args.size:
+        mix["sizes"] = _parse_sizes(args.size)
+
+    summary = generate(args.data, args.count, args.seed, mix, args.prefix, args.jobs, args.indent, args.uids,
+                       store=args.store)
+    print(f"Документов: {summary['documents']}, {summary['bytes'] / 2**20:.1f} МБ, "
+          f"{summary['elapsed']:.1f} с, {summary['rate']:.0f} док/с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
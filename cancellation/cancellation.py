@@ -0,0 +1,173 @@
+import contextvars
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Тайм-ауты в секундах: `connect` — установка соединения, `gateway`/`pfr` — ожидание ответа шлюза
+# и ПФР, `sign` — один запуск JVM подписи, `batch_deadline` — весь запуск (0 — без ограничения).
+DEFAULT_TIMEOUTS = {
+    "connect": 10,
+    "gateway": 60,
+    "pfr": 30,
+    "sign": 300,
+    "batch_deadline": 0,
+}
+
+# Нижняя граница тайм-аута: requests и subprocess не принимают нулевые значения, а вызов, начатый
+# перед самым сроком запуска, должен завершиться ошибкой тайм-аута, а не исключением о параметрах.
+MIN_TIMEOUT = 0.5
+
+CANCEL_USER = "user"
+CANCEL_DEADLINE = "deadline"
+
+CANCEL_REASONS = {
+    CANCEL_USER: "отменено пользователем",
+    CANCEL_DEADLINE: "истек срок запуска",
+}
+
+_timeouts = dict(DEFAULT_TIMEOUTS)
+# Временная ошибка последнего вызова в этом потоке (см. `report_transient_error`).
+_transient = threading.local()
+
+
+class CancelToken:
+    """
+    Признак отмены одного запуска (пакета).
+
+    Отмену устанавливает пользователь (`cancel`) или срок запуска: после `deadline` секунд
+    признак считается установленным сам. Стадии проверяют признак перед каждым элементом
+    и не начинают новую работу; уже начатые вызовы завершаются в пределах своих тайм-аутов.
+
+    :param deadline: Срок запуска в секундах; 0 — без ограничения.
+    """
+
+    def __init__(self, deadline: float = 0):
+        self._event = threading.Event()
+        self._deadline = time.monotonic() + deadline if deadline and deadline > 0 else None
+        self.reason = None
+
+    def cancel(self, reason: str = CANCEL_USER):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            logger.warning("Запуск остановлен: %s", CANCEL_REASONS.get(reason, reason))
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self.cancel(CANCEL_DEADLINE)
+            return True
+        return False
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: Секунды до срока запуска или `None`, если срок не задан.
+        """
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def wait(self, seconds: float) -> bool:
+        """
+        Пауза, которую прерывает отмена.
+
+        :return: `True`, если запуск отменен.
+        """
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._event.wait(seconds)
+        return self.cancelled
+
+
+# Признак отмены текущего запуска; рабочие потоки конвейера наследуют его через copy_context.
+current_token = contextvars.ContextVar("current_token", default=None)
+
+
+def configure_timeouts(timeouts_config: Optional[dict] = None):
+    """
+    Задает тайм-ауты по разделу `timeouts` конфигурации (см. `DEFAULT_TIMEOUTS`).
+    """
+    _timeouts.clear()
+    _timeouts.update({**DEFAULT_TIMEOUTS, **(timeouts_config or {})})
+
+
+def new_batch_token(config=None) -> CancelToken:
+    """
+    Создает признак отмены запуска со сроком `timeouts.batch_deadline` из конфигурации.
+    """
+    timeouts_config = (config or {}).get("timeouts", {})
+    return CancelToken(timeouts_config.get("batch_deadline", _timeouts["batch_deadline"]))
+
+
+def cancel_requested() -> bool:
+    """
+    :return: `True`, если текущий запуск отменен пользователем или истек его срок.
+    """
+    token = current_token.get()
+    return token is not None and token.cancelled
+
+
+def pause(seconds: float) -> bool:
+    """
+    `time.sleep`, которую прерывает отмена текущего запуска.
+
+    :return: `True`, если запуск отменен.
+    """
+    token = current_token.get()
+    if token is None:
+        time.sleep(seconds)
+        return False
+    return token.wait(seconds)
+
+
+def call_timeout(kind: str) -> Optional[float]:
+    """
+    Тайм-аут одного вызова с учетом срока текущего запуска.
+
+    :param kind: Вид вызова: `gateway`, `pfr` или `sign`.
+    :return: Секунды или `None`, если тайм-аут отключен (0) и срок запуска не задан.
+    """
+    timeout = _timeouts.get(kind) or None
+    token = current_token.get()
+    remaining = token.remaining() if token is not None else None
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return None if timeout is None else max(timeout, MIN_TIMEOUT)
+
+
+def request_timeout(kind: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    :return: Тайм-аут для requests: (установка соединения, ожидание ответа).
+    """
+    read_timeout = call_timeout(kind)
+    connect_timeout = _timeouts.get("connect") or None
+    if read_timeout is not None and connect_timeout is not None:
+        connect_timeout = min(connect_timeout, read_timeout)
+    return connect_timeout, read_timeout
+
+
+def report_transient_error(reason: str):
+    """
+    Отмечает, что вызов в текущем потоке не удался из-за временной ошибки (сеть, тайм-аут, антиспам ПФР),
+    так что повтор может пройти. Конвейер забирает отметку после каждой стадии (`take_transient_error`).
+
+    :param reason: Краткое описание ошибки для лога.
+    """
+    _transient.reason = reason
+
+
+def take_transient_error() -> Optional[str]:
+    """
+    Возвращает и сбрасывает отметку `report_transient_error` текущего потока.
+
+    :return: Описание временной ошибки или `None`, если ее не было.
+    """
+    reason = getattr(_transient, "reason", None)
+    _transient.reason = None
+    return reason
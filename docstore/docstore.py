@@ -0,0 +1,292 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIRECTORY = 'blobs'
+INDEX_FILE = 'index.tsv'
+BLOB_SUFFIX = '.json.gz'
+COMPRESS_LEVEL = 6
+
+_stores_lock = threading.Lock()
+_stores: Dict[str, "DocumentStore"] = {}
+
+
+class CorruptDocumentError(ValueError):
+    """Сохраненный документ не удалось распаковать или разобрать."""
+
+
+def encode_document(data) -> bytes:
+    """
+    :return: Компактное JSON-представление документа; по нему вычисляется хеш содержимого.
+    """
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class DocumentStore:
+    """
+    Хранилище выгруженных документов в папке `data`.
+
+    Документ хранится один раз на содержимое: `blobs/<ab>/<sha256>.json.gz` (сжатый компактный
+    JSON), а индекс `index.tsv` связывает local_uid с хешем документа и СНИЛС пациента. Одинаковые
+    документы разных UID занимают место один раз, в одной папке не оказывается сотен тысяч файлов,
+    а поиск документа по UID — обращение к словарю в памяти.
+
+    Индекс только дописывается (при повторной выгрузке UID действует последняя строка), поэтому
+    несколько потоков и процессов могут сохранять документы в одну папку. Документы старого
+    формата `<local_uid>.json` в той же папке по-прежнему читаются.
+
+    :param directory: Папка хранилища (обычно `data`).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blobs_directory = os.path.join(directory, BLOBS_DIRECTORY)
+        self.index_file = os.path.join(directory, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[str, str]] = {}
+        self._index_offset = 0
+        self._index_state = None
+        self._index_output = None
+        self._refresh_index()
+
+    def _refresh_index(self):
+        """Дочитывает строки индекса, добавленные с прошлого чтения (в том числе другими процессами)."""
+        try:
+            with open(self.index_file, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size < self._index_offset:
+                    # Индекс пересоздан: читается заново.
+                    self._index.clear()
+                    self._index_offset = 0
+                f.seek(self._index_offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        self._index_state = (stat.st_size, stat.st_mtime_ns)
+        # Незавершенная последняя строка дочитывается в следующий раз.
+        complete = chunk.rfind(b'\n') + 1
+        for line in chunk[:complete].decode('utf-8').splitlines():
+            parts = line.split('\t')
+            if len(parts) == 3:
+                self._index[parts[0]] = (parts[1], parts[2])
+        self._index_offset += complete
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_directory, digest[:2], digest + BLOB_SUFFIX)
+
+    def legacy_path(self, local_uid: str) -> str:
+        return os.path.join(self.directory, f"{local_uid}.json")
+
+    def put(self, local_uid: str, data) -> str:
+        """
+        Сохраняет документ UID.
+
+        Если документ с таким содержимым уже есть, повторно он не записывается.
+
+        :param local_uid: Локальный UID документа.
+        :param data: Документ (ответ шлюза).
+        :return: Хеш содержимого документа.
+        """
+        content = encode_document(data)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(gzip.compress(content, COMPRESS_LEVEL, mtime=0))
+            os.replace(temp_file, path)
+
+        patient = data.get('patient') if isinstance(data, dict) else None
+        snils = str((patient or {}).get('snils') or '').replace('\t', ' ')
+        line = f"{local_uid}\t{digest}\t{snils}\n".encode('utf-8')
+        with self._lock:
+            if self._index_output is None:
+                # Без буферизации: каждая строка уходит в файл одной записью и не перемешивается
+                # со строками других процессов.
+                self._index_output = open(self.index_file, 'ab', buffering=0)
+            self._index_output.write(line)
+            self._index[local_uid] = (digest, snils)
+        return digest
+
+    def _index_changed(self) -> bool:
+        try:
+            stat = os.stat(self.index_file)
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) != self._index_state
+
+    def lookup(self, local_uid: str) -> Optional[str]:
+        """
+        Индекс дочитывается, если с прошлого чтения изменились его размер или время изменения, поэтому
+        документ, заново выгруженный другим процессом, находится по новому хешу.
+
+        :return: Хеш документа UID или `None`, если документа нет в индексе.
+        """
+        with self._lock:
+            if self._index_changed():
+                self._refresh_index()
+            entry = self._index.get(local_uid)
+        return entry[0] if entry else None
+
+    def get(self, local_uid: str):
+        """
+        Читает документ UID.
+
+        :param local_uid: Локальный UID документа.
+        :return: Документ.
+        :raises FileNotFoundError: Документ не выгружен.
+        :raises CorruptDocumentError: Документ поврежден.
+        """
+        digest = self.lookup(local_uid)
+        if digest is None:
+            with open(self.legacy_path(local_uid), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        try:
+            with open(self.blob_path(digest), 'rb') as f:
+                return json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            raise
+        except (OSError, EOFError, zlib.error, ValueError) as e:
+            raise CorruptDocumentError(f"Документ {local_uid} ({digest}) поврежден: {e}") from e
+
+    def __contains__(self, local_uid: str) -> bool:
+        return self.lookup(local_uid) is not None or os.path.exists(self.legacy_path(local_uid))
+
+    def snils_by_uid(self) -> Dict[str, str]:
+        """
+        :return: Словарь «local_uid → СНИЛС» по индексу, без чтения самих документов.
+        """
+        with self._lock:
+            self._refresh_index()
+            return {local_uid: snils for local_uid, (_, snils) in self._index.items() if snils}
+
+    def stats(self) -> dict:
+        """
+        :return: Количество UID и уникальных документов, размер документов на диске и в распакованном виде.
+        """
+        with self._lock:
+            self._refresh_index()
+            digests = {digest for digest, _ in self._index.values()}
+        stored = raw = 0
+        for digest in digests:
+            path = self.blob_path(digest)
+            try:
+                stored += os.path.getsize(path)
+                with open(path, 'rb') as f:
+                    f.seek(-4, os.SEEK_END)
+                    # Последние 4 байта gzip — размер исходных данных.
+                    raw += int.from_bytes(f.read(4), 'little')
+            except OSError:
+                continue
+        return {"uids": len(self._index), "documents": len(digests), "stored_bytes": stored, "raw_bytes": raw}
+
+
+def get_store(directory: Optional[str] = None) -> DocumentStore:
+    """
+    Возвращает общее для процесса хранилище папки `directory` (по умолчанию `data` в текущем каталоге).
+    """
+    directory = os.path.abspath(directory or os.path.join(os.getcwd(), 'data'))
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            os.makedirs(directory, exist_ok=True)
+            store = _stores[directory] = DocumentStore(directory)
+    return store
+
+
+def split_document_path(json_filename: str) -> Tuple[str, str]:
+    """
+    Разбирает путь вида `data/<local_uid>.json` на папку хранилища и UID.
+    """
+    directory, filename = os.path.split(json_filename)
+    local_uid = filename[:-len('.json')] if filename.endswith('.json') else filename
+    return directory or os.getcwd(), local_uid
+
+
+def load_document(json_filename: str):
+    """
+    Читает документ по привычному пути `data/<local_uid>.json` — из хранилища или из файла старого формата.
+
+    :raises FileNotFoundError: Документ не выгружен.
+    :raises ValueError: Документ поврежден.
+    """
+    directory, local_uid = split_document_path(json_filename)
+    return get_store(directory).get(local_uid)
+
+
+def migrate(directory: str, remove: bool = False) -> int:
+    """
+    Переносит документы старого формата `<local_uid>.json` из папки в хранилище.
+
+    :param directory: Папка `data`.
+    :param remove: Удалять ли перенесенные файлы.
+    :return: Количество перенесенных документов.
+    """
+    store = get_store(directory)
+    moved = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось прочитать %s: %s", entry.name, e)
+                continue
+            store.put(entry.name[:-len('.json')], data)
+            if remove:
+                os.remove(entry.path)
+            moved += 1
+    return moved
+
+
+def main(argv=None):
+    """
+    Обслуживание хранилища документов.
+
+    Пример::
+
+        python -m docstore.docstore migrate data --remove
+        python -m docstore.docstore stats data
+        python -m docstore.docstore show data <local_uid>
+    """
+    parser = argparse.ArgumentParser(description="Хранилище выгруженных документов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Перенести файлы <uid>.json в хранилище")
+    migrate_parser.add_argument("directory")
+    migrate_parser.add_argument("--remove", action="store_true", help="Удалить перенесенные файлы")
+    stats_parser = commands.add_parser("stats", help="Размер хранилища")
+    stats_parser.add_argument("directory")
+    show_parser = commands.add_parser("show", help="Вывести документ UID")
+    show_parser.add_argument("directory")
+    show_parser.add_argument("local_uid")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        print(f"Перенесено документов: {migrate(args.directory, args.remove)}")
+    elif args.command == "stats":
+        stats = get_store(args.directory).stats()
+        print(f"UID: {stats['uids']}, документов: {stats['documents']}, "
+              f"на диске {stats['stored_bytes'] / 2**20:.1f} МБ (без сжатия {stats['raw_bytes'] / 2**20:.1f} МБ)")
+    else:
+        try:
+            print(json.dumps(get_store(args.directory).get(args.local_uid), ensure_ascii=False, indent=4))
+        except (OSError, ValueError) as e:
+            print(f"Документ {args.local_uid} не прочитан: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
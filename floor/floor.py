@@ -1,10 +1,29 @@
-from pymorphy3 import MorphAnalyzer
 import logging
+import threading
+from metrics.metrics import timed
 
 logger = logging.getLogger(__name__)
 
-morph = MorphAnalyzer()
+_morph = None
+_morph_lock = threading.Lock()
 
+
+def get_morph():
+    """
+    Возвращает общий экземпляр `MorphAnalyzer`, создавая его при первом вызове.
+
+    Загрузка словарей Pymorphy3 занимает заметное время, поэтому она откладывается
+    до первой проверки пола, а не выполняется при импорте модуля.
+    """
+    global _morph
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                from pymorphy3 import MorphAnalyzer
+                _morph = MorphAnalyzer()
+    return _morph
+
+@timed("classify_gender", "Определение пола по ФИО")
 def classify_gender(last_name, first_name, patronymic=None):
     """
     Определяет пол по ФИО с использованием библиотеки Pymorphy3.
@@ -22,6 +41,7 @@ def classify_gender(last_name, first_name, patronymic=None):
         основываясь на большинстве.
     """
     genders = {'masc': 0, 'femn': 0, 'neut': 0}
+    morph = get_morph()
 
     if patronymic:
         patronymic_parse = morph.parse(patronymic)[0]
@@ -0,0 +1,495 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import tkinter as tk
+from typing import Iterable, List, Optional, Tuple
+from uidinput.uidinput import UidDeduplicator, normalize_uid
+from tp.check_patient import shared_snils_registry
+from logsetup.logsetup import setup_logging
+from metrics import metrics
+from replay.replay import configure_replay
+from cancellation.cancellation import configure_timeouts, current_token, new_batch_token, pause
+from profiling.profiling import profile_run
+from pipeline.pipeline import Pipeline, build_stages, format_report, get_pipeline_config, DEFAULT_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE_BATCH = 10
+DEFAULT_POLL_INTERVAL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    region TEXT NOT NULL,
+    local_uid TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    stage TEXT,
+    output TEXT,
+    updated REAL,
+    UNIQUE (batch, local_uid)
+);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (region, status, lease_until);
+CREATE TABLE IF NOT EXISTS snils (
+    region TEXT NOT NULL,
+    snils TEXT NOT NULL,
+    local_uid TEXT NOT NULL,
+    sheet TEXT,
+    message TEXT,
+    PRIMARY KEY (region, snils)
+);
+"""
+
+
+class JobQueue:
+    """
+    Очередь заданий в файле SQLite, общая для нескольких процессов-обработчиков.
+
+    Задание — один local_uid. Обработчик берет задания в аренду (`lease`) на `lease_seconds` секунд;
+    если обработчик завис или завершился, аренда истекает и задание выдается повторно, но не более
+    `max_attempts` раз. Файл базы можно разместить на общем сетевом диске; используется журнал
+    в режиме DELETE, так как WAL не работает на сетевых файловых системах.
+
+    :param db_path: Путь к файлу базы данных.
+    :param lease_seconds: Длительность аренды задания в секундах.
+    :param max_attempts: Максимальное количество выдач одного задания.
+    """
+
+    def __init__(self, db_path: str, lease_seconds: int = DEFAULT_LEASE_SECONDS, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA busy_timeout = 30000")
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, batch: str, region: str, local_uids: Iterable[str]) -> int:
+        """
+        Добавляет local_uid в очередь. Повторно добавленные в тот же пакет UID игнорируются.
+
+        :param batch: Имя пакета.
+        :param region: Имя региона из конфигурации.
+        :param local_uids: Итерируемый набор локальных UID.
+        :return: Количество добавленных заданий.
+        """
+        connection = self._connect()
+        now = time.time()
+        rows = ((batch, region, normalize_uid(local_uid), now) for local_uid in local_uids if normalize_uid(local_uid))
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (batch, region, local_uid, updated) VALUES (?, ?, ?, ?)", rows
+            )
+            added = connection.total_changes - before
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        logger.info("В пакет %s добавлено заданий: %s", batch, added)
+        return added
+
+    def lease(self, worker: str, region: str, limit: int = 1) -> List[Tuple[int, str]]:
+        """
+        Берет в аренду до `limit` заданий региона: ожидающие или с истекшей арендой.
+
+        Задания с истекшей арендой, исчерпавшие количество попыток, помечаются как `failed`.
+
+        :param worker: Идентификатор обработчика.
+        :param region: Имя региона.
+        :param limit: Максимальное количество заданий.
+        :return: Список пар (id задания, local_uid).
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'lease', worker = NULL, updated = ? "
+                "WHERE region = ? AND status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, region, now, self.max_attempts),
+            )
+            jobs = connection.execute(
+                "SELECT id, local_uid FROM jobs WHERE region = ? AND "
+                "(status = 'pending' OR (status = 'leased' AND lease_until < ?)) ORDER BY id LIMIT ?",
+                (region, now, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? "
+                "WHERE id = ?",
+                [(worker, now + self.lease_seconds, now, job_id) for job_id, _ in jobs],
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return jobs
+
+    def next_lease_expiry(self, region: str) -> Optional[float]:
+        """
+        :return: Время (`time.time()`) ближайшего окончания аренды заданий региона или `None`,
+                 если в регионе нет заданий в аренде.
+        """
+        return self._connect().execute(
+            "SELECT MIN(lease_until) FROM jobs WHERE region = ? AND status = 'leased'", (region,)
+        ).fetchone()[0]
+
+    def renew(self, worker: str):
+        """
+        Продлевает аренду всех заданий, взятых обработчиком.
+
+        :param worker: Идентификатор обработчика.
+        """
+        self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, worker),
+        )
+
+    def complete(self, job_id: int, worker: str, success: bool, stage: Optional[str] = None, output: Optional[str] = None) -> bool:
+        """
+        Записывает результат задания. Результат принимается, только если аренда все еще принадлежит обработчику.
+
+        :param job_id: Идентификатор задания.
+        :param worker: Идентификатор обработчика.
+        :param success: `True`, если задание прошло все стадии.
+        :param stage: Стадия, на которой задание было отсеяно.
+        :param output: Путь к итоговому файлу.
+        :return: `True`, если результат записан.
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, stage = ?, output = ?, worker = NULL, lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            ("done" if success else "failed", stage, output, time.time(), job_id, worker),
+        )
+        if cursor.rowcount == 0:
+            logger.warning("Аренда задания %s уже истекла, результат обработчика %s отброшен", job_id, worker)
+        return cursor.rowcount > 0
+
+    def claim_snils(self, region: str, snils: str, local_uid: str) -> Tuple[bool, Optional[tuple]]:
+        """
+        Занимает СНИЛС региона для документа `local_uid`, если его еще не занял другой документ.
+
+        Повторная проверка того же `local_uid` (например, после истечения аренды) дубликатом не считается.
+
+        :return: Кортеж (дубликат ли документ, (лист Excel, сообщение) оригинала или `None`, если итог еще неизвестен).
+        """
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR IGNORE INTO snils (region, snils, local_uid) VALUES (?, ?, ?)", (region, snils, local_uid)
+            )
+            owner, sheet, message = connection.execute(
+                "SELECT local_uid, sheet, message FROM snils WHERE region = ? AND snils = ?", (region, snils)
+            ).fetchone()
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        if owner == local_uid:
+            return False, None
+        return True, (sheet, message) if sheet else None
+
+    def record_snils(self, region: str, snils: str, sheet: str, message: str):
+        """
+        Записывает итог проверки СНИЛС, который получат его дубликаты у всех обработчиков.
+        """
+        self._connect().execute(
+            "UPDATE snils SET sheet = ?, message = ? WHERE region = ? AND snils = ?", (sheet, message, region, snils)
+        )
+
+    def snils_claimed(self, region: str, snils: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM snils WHERE region = ? AND snils = ?", (region, snils)
+        ).fetchone() is not None
+
+    def progress(self, batch: Optional[str] = None) -> dict:
+        """
+        Возвращает сводку по состоянию заданий.
+
+        :param batch: Имя пакета; если не указано — по всем пакетам.
+        :return: Словарь со счетчиками по статусам (`by_status`), по стадиям отсева (`by_stage`)
+                 и количеством заданий в аренде по обработчикам (`by_worker`).
+        """
+        connection = self._connect()
+        where, params = ("WHERE batch = ?", (batch,)) if batch else ("", ())
+        by_status = dict(connection.execute(f"SELECT status, COUNT(*) FROM jobs {where} GROUP BY status", params))
+        by_stage = dict(connection.execute(
+            f"SELECT stage, COUNT(*) FROM jobs {where} {'AND' if where else 'WHERE'} status = 'failed' GROUP BY stage", params
+        ))
+        by_worker = dict(connection.execute(
+            f"SELECT worker, COUNT(*) FROM jobs {where} {'AND' if where else 'WHERE'} status = 'leased' GROUP BY worker", params
+        ))
+        return {"by_status": by_status, "by_stage": by_stage, "by_worker": by_worker}
+
+
+class SharedSnilsRegistry:
+    """
+    Реестр проверенных СНИЛС региона в базе очереди заданий, общий для всех обработчиков.
+
+    Заменяет реестр процесса (`tp.check_patient.SnilsRegistry`) через `shared_snils_registry`,
+    чтобы дубликат по СНИЛС не подписывался дважды, если его документы достались разным обработчикам.
+
+    :param job_queue: Очередь заданий.
+    :param region: Имя региона.
+    """
+
+    def __init__(self, job_queue: JobQueue, region: str):
+        self.job_queue = job_queue
+        self.region = region
+
+    def __contains__(self, snils) -> bool:
+        return self.job_queue.snils_claimed(self.region, snils)
+
+    def claim(self, snils: str, local_uid: str) -> Tuple[bool, Optional[tuple]]:
+        return self.job_queue.claim_snils(self.region, snils, local_uid)
+
+    def record(self, snils: str, sheet_name: str, message: str):
+        self.job_queue.record_snils(self.region, snils, sheet_name, message)
+
+
+def format_progress(progress: dict) -> str:
+    """
+    Форматирует сводку `JobQueue.progress` для вывода в консоль.
+    """
+    by_status = progress["by_status"]
+    total = sum(by_status.values())
+    finished = by_status.get("done", 0) + by_status.get("failed", 0)
+    lines = [f"Всего: {total}, завершено: {finished} ({100 * finished / total if total else 0:.1f}%)"]
+    for status in ("pending", "leased", "done", "failed"):
+        lines.append(f"  {status:<8}{by_status.get(status, 0):>10}")
+    if progress["by_stage"]:
+        lines.append("Отсеяно по стадиям:")
+        lines.extend(f"  {stage or '-':<8}{count:>10}" for stage, count in progress["by_stage"].items())
+    if progress["by_worker"]:
+        lines.append("В работе у обработчиков:")
+        lines.extend(f"  {worker:<30}{count:>6}" for worker, count in progress["by_worker"].items())
+    return '\n'.join(lines)
+
+
+def run_worker(config, job_queue: JobQueue, region_name: str, root, worker: Optional[str] = None,
+               mpi_mismatch_errors: bool = True, lease_batch: int = DEFAULT_LEASE_BATCH,
+               max_leased: Optional[int] = None, poll_interval: float = DEFAULT_POLL_INTERVAL) -> dict:
+    """
+    Обрабатывает задания региона из очереди, пока они не закончатся.
+
+    Задания пропускаются через те же стадии, что и потоковый конвейер (`pipeline.build_stages`).
+    Пока обработчик работает, аренда его заданий периодически продлевается.
+
+    Обработчик держит в аренде не больше `max_leased` заданий: новое задание берется, только когда
+    завершено одно из взятых, поэтому остальные задания достаются другим обработчикам. Повторы UID
+    отсеивает очередь, а дубликаты по СНИЛС — общий реестр в ее базе (`SharedSnilsRegistry`).
+
+    Если свободных заданий нет, но в регионе остались задания в аренде (возможно, у завершившегося
+    аварийно обработчика), обработчик ждет окончания ближайшей аренды (но не дольше `poll_interval`)
+    и снова пробует взять задания. Работа заканчивается, когда в регионе не осталось ни ожидающих
+    заданий, ни заданий в аренде.
+
+    :param config: Конфигурационный словарь.
+    :param job_queue: Очередь заданий.
+    :param region_name: Имя региона.
+    :param root: Корневое окно Tkinter для окна капчи.
+    :param worker: Идентификатор обработчика; по умолчанию `<hostname>:<pid>`.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :param lease_batch: Сколько заданий брать в аренду за одно обращение к базе (не больше свободных мест).
+    :param max_leased: Сколько заданий держать в аренде одновременно; по умолчанию — общее количество
+                       потоков стадий, то есть сколько заданий обработчик действительно может вести сразу.
+    :param poll_interval: Наибольшая пауза (с) между попытками взять задания, пока другие задания в аренде.
+    :return: Отчет конвейера.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+    curl_lock = threading.Lock()
+    curl_output = open(f"curl_commands_{worker.replace(':', '_')}.txt", 'a', encoding='utf-8')
+    stopped = threading.Event()
+    deduplicator = UidDeduplicator(track_repeats=False)
+    workers = get_pipeline_config(config, region_name)["workers"]
+    max_leased = max(1, max_leased or sum(workers.values()))
+    free_slots = threading.Semaphore(max_leased)
+
+    def leased_uids():
+        while True:
+            free_slots.acquire()
+            slots = 1
+            while slots < lease_batch and free_slots.acquire(blocking=False):
+                slots += 1
+            jobs = job_queue.lease(worker, region_name, slots)
+            for _ in range(slots - len(jobs)):
+                free_slots.release()
+            if not jobs:
+                expiry = job_queue.next_lease_expiry(region_name)
+                if expiry is None:
+                    return
+                # Задания брошенного обработчика выдаются снова, когда истечет их аренда.
+                if pause(min(max(expiry - time.time(), 0.0) + 0.1, poll_interval)):
+                    return
+                continue
+            for job_id, local_uid in jobs:
+                with in_flight_lock:
+                    in_flight.setdefault(local_uid, []).append(job_id)
+                yield local_uid
+
+    def take_job(item) -> Optional[int]:
+        with in_flight_lock:
+            job_ids = in_flight.get(item.local_uid)
+            if not job_ids:
+                return None
+            job_id = job_ids.pop(0)
+            if not job_ids:
+                del in_flight[item.local_uid]
+        free_slots.release()
+        return job_id
+
+    def on_item_done(item):
+        job_id = take_job(item)
+        if job_id is None:
+            return
+        if item.curl_command:
+            with curl_lock:
+                curl_output.write(item.curl_command + '\n')
+        job_queue.complete(job_id, worker, item.failed_stage is None, item.failed_stage, item.signed_file or item.xml_file)
+
+    def heartbeat():
+        while not stopped.wait(job_queue.lease_seconds / 3):
+            job_queue.renew(worker)
+
+    logger.info("Обработчик %s запущен для региона %s, заданий в аренде не больше %s", worker, region_name, max_leased)
+    threading.Thread(target=heartbeat, daemon=True).start()
+    registry_reset = shared_snils_registry.set(SharedSnilsRegistry(job_queue, region_name))
+    try:
+        with profile_run(config, f"worker-{worker}") as session:
+            stages = build_stages(config, region_name, root, mpi_mismatch_errors, deduplicator=deduplicator)
+            if session:
+                session.wrap_stages(stages)
+            pipeline = Pipeline(
+                stages,
+                queue_size=get_pipeline_config(config, region_name).get("queue_size", DEFAULT_QUEUE_SIZE),
+                on_item_done=on_item_done,
+                # Взятое, но не начатое задание вернется в очередь по истечении аренды.
+                on_item_cancelled=take_job,
+            )
+            report = pipeline.run(leased_uids())
+    finally:
+        shared_snils_registry.reset(registry_reset)
+        stopped.set()
+        curl_output.close()
+        deduplicator.flush()
+
+    logger.info("Обработчик %s завершен:\n%s", worker, format_report(report))
+    return report
+
+
+def _load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    """
+    Командная строка очереди заданий.
+
+    Примеры::
+
+        python -m jobqueue.jobqueue --db jobs.sqlite enqueue --batch b1 --region Region_1 uids.txt
+        python -m jobqueue.jobqueue --db jobs.sqlite work --region Region_1 --workdir worker1
+        python -m jobqueue.jobqueue --db jobs.sqlite progress --batch b1
+
+    Каждому обработчику на одном компьютере следует указывать свой `--workdir`,
+    чтобы файлы `data/`, `work/` и `log_results.xlsx` не пересекались.
+
+    Остановка обработчика — Ctrl+C или срок `timeouts.batch_deadline`: начатые задания завершаются,
+    а взятые в аренду, но не начатые возвращаются в очередь по истечении аренды.
+    """
+    parser = argparse.ArgumentParser(description="Общая очередь заданий local_uid в SQLite")
+    parser.add_argument("--db", default="jobs.sqlite", help="Путь к файлу базы очереди")
+    parser.add_argument("--config", default="config.json", help="Путь к файлу конфигурации")
+    parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS, help="Длительность аренды, с")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Максимум выдач задания")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Добавить UID из файла в очередь")
+    enqueue_parser.add_argument("--batch", required=True)
+    enqueue_parser.add_argument("--region", required=True)
+    enqueue_parser.add_argument("uid_file")
+
+    work_parser = commands.add_parser("work", help="Обрабатывать задания региона")
+    work_parser.add_argument("--region", required=True)
+    work_parser.add_argument("--worker", default=None)
+    work_parser.add_argument("--workdir", default=None)
+    work_parser.add_argument("--no-mpi-check", action="store_true", help="Не требовать ошибок PATIENT_MPI_MISMATCH")
+    work_parser.add_argument("--profile", action="store_true", help="Профилировать работу (cProfile и tracemalloc)")
+    work_parser.add_argument("--replay", choices=["record", "replay"],
+                             help="Записывать ответы шлюза и ПФР в архив или воспроизводить их из архива (раздел replay)")
+
+    progress_parser = commands.add_parser("progress", help="Показать состояние очереди")
+    progress_parser.add_argument("--batch", default=None)
+
+    args = parser.parse_args(argv)
+    db_path = os.path.abspath(args.db)
+    config_path = os.path.abspath(args.config)
+
+    if args.command == "work" and args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        os.chdir(args.workdir)
+
+    config = _load_config(config_path) if args.command == "work" else {}
+    setup_logging(config.get("logging"), filename='worker.log' if args.command == "work" else '')
+    job_queue = JobQueue(db_path, args.lease, args.max_attempts)
+
+    if args.command == "enqueue":
+        with open(args.uid_file, 'r', encoding='utf-8') as f:
+            added = job_queue.enqueue(args.batch, args.region, f)
+        print(f"Добавлено заданий: {added}")
+    elif args.command == "progress":
+        print(format_progress(job_queue.progress(args.batch)))
+    else:
+        metrics.configure_metrics(config.get("metrics"))
+        configure_replay(config.get("replay"), args.replay)
+        configure_timeouts(config.get("timeouts"))
+        if args.profile:
+            config.setdefault("profiling", {})["enabled"] = True
+        root = tk.Tk()
+        root.withdraw()
+        result = {}
+        token = new_batch_token(config)
+
+        def work():
+            current_token.set(token)
+            try:
+                result["report"] = run_worker(config, job_queue, args.region, root, args.worker, not args.no_mpi_check)
+            finally:
+                root.after(0, root.quit)
+
+        threading.Thread(target=work, daemon=True).start()
+        try:
+            root.mainloop()
+        except KeyboardInterrupt:
+            logger.info("Получен сигнал остановки, завершаю начатые задания")
+            token.cancel()
+            root.mainloop()
+        if "report" in result:
+            print(format_report(result["report"]))
+        print(metrics.format_summary())
+        metrics.write_textfile()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import importlib
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_import_lock = threading.RLock()
+_timings: Dict[str, float] = {}
+
+
+def _load(module_name: str):
+    """
+    Импортирует модуль и запоминает, сколько занял первый импорт.
+    """
+    with _import_lock:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        if module_name not in _timings:
+            _timings[module_name] = time.perf_counter() - started
+            logger.debug("Модуль %s загружен за %.0f мс", module_name, _timings[module_name] * 1000)
+        return module
+
+
+class LazyModule:
+    """
+    Заместитель модуля, который импортирует его при первом обращении к атрибуту.
+
+    Позволяет объявить тяжелую зависимость на уровне модуля (`Image = lazy_import("PIL.Image")`)
+    и не платить за ее загрузку, пока она не понадобится. Импорт выполняется под блокировкой,
+    поэтому одновременное первое обращение из нескольких потоков безопасно.
+
+    :param module_name: Полное имя модуля.
+    """
+
+    def __init__(self, module_name: str):
+        self.__dict__["_module_name"] = module_name
+        self.__dict__["_module"] = None
+
+    def _resolve(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = _load(self.__dict__["_module_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __repr__(self):
+        state = "загружен" if self.__dict__["_module"] is not None else "не загружен"
+        return f"<LazyModule {self.__dict__['_module_name']} ({state})>"
+
+
+def lazy_import(module_name: str) -> LazyModule:
+    """
+    Возвращает ленивый заместитель модуля `module_name`.
+
+    :param module_name: Полное имя модуля, например `"openpyxl"` или `"PIL.ImageTk"`.
+    :return: Объект, импортирующий модуль при первом обращении к атрибуту.
+    """
+    return LazyModule(module_name)
+
+
+def lazy_callable(module_name: str, name: str) -> Callable:
+    """
+    Возвращает функцию-обертку, которая импортирует модуль только при первом вызове.
+
+    Удобна для обработчиков кнопок: `xml_create = lazy_callable("samplexml.xml", "xml_create")`
+    сохраняет место вызова без изменений, а стоимость импорта стадии переносится на ее первый запуск.
+
+    :param module_name: Полное имя модуля.
+    :param name: Имя функции в модуле.
+    :return: Функция с той же сигнатурой.
+    """
+    module = LazyModule(module_name)
+
+    def call(*args, **kwargs):
+        return getattr(module, name)(*args, **kwargs)
+
+    call.__name__ = name
+    call.__qualname__ = name
+    call.__doc__ = f"Ленивая обертка над {module_name}.{name}."
+    return call
+
+
+def import_timings() -> Dict[str, float]:
+    """
+    :return: Время первого импорта (в секундах) для каждого модуля, загруженного через `lazy_import`.
+    """
+    with _import_lock:
+        return dict(_timings)
@@ -1,6 +1,34 @@
-import openpyxl
-from openpyxl import Workbook
+import contextvars
+import logging
+import threading
+from collections import defaultdict
+from lazyimport.lazyimport import lazy_import
+from metrics.metrics import timed
 
+# openpyxl загружается при первой записи в лог, а не при запуске программы.
+openpyxl = lazy_import("openpyxl")
+
+logger = logging.getLogger(__name__)
+
+current_workbook = contextvars.ContextVar("current_workbook", default='log_results.xlsx')
+# Номера UID во входном списке: словарь «local_uid или путь XML-файла → номер». Задается конвейером
+# на время запуска (рабочие потоки наследуют его через copy_context) и заполняет колонку 'Index',
+# потому что строки на листы попадают в порядке обработки, а не ввода.
+input_positions = contextvars.ContextVar("input_positions", default=None)
+_workbook_locks = defaultdict(threading.Lock)
+_workbook_locks_guard = threading.Lock()
+_listeners = []
+
+def add_listener(listener):
+    """
+    Подписывает функцию на все записи Excel-лога.
+
+    :param listener: Функция `listener(sheet_name, data)`, вызываемая в потоке, который пишет в лог.
+                     Должна работать быстро и не обращаться к виджетам Tk напрямую.
+    """
+    _listeners.append(listener)
+
+@timed("excel_log", "Запись в Excel-лог", track_result=False)
 def log_message_to_excel(sheet_name, data, save_interval=1000):
     """
     Записывает сообщения на указанный лист в файле Excel.
@@ -9,12 +37,33 @@ def log_message_to_excel(sheet_name, data, save_interval=1000):
     :param data: Список кортежей, где первый элемент — это имя файла (filename), а второй — сообщение (message).
                  Для листа 'Созданные файлы' filename может быть None.
     :param save_interval: Количество записей, после которого производится сохранение файла.
+
+    Файл задается контекстной переменной `current_workbook` (по умолчанию 'log_results.xlsx'),
+    поэтому потоки разных регионов пишут каждый в свою книгу. Если задана `input_positions`, в колонку
+    'Index' записывается номер UID во входном списке.
+    """
+    for listener in _listeners:
+        try:
+            listener(sheet_name, data)
+        except Exception:
+            logger.exception("Ошибка обработчика листа %s", sheet_name)
+
+    workbook_path = current_workbook.get()
+    positions = input_positions.get()
+    with _workbook_locks_guard:
+        workbook_lock = _workbook_locks[workbook_path]
+    with workbook_lock:
+        _write_to_excel(workbook_path, sheet_name, data, save_interval, positions)
+
+def _write_to_excel(workbook_path, sheet_name, data, save_interval, positions=None):
+    """
+    Выполняет запись в файл Excel. Вызывается только под блокировкой книги `workbook_path`.
     """
     try:
         try:
-            workbook = openpyxl.load_workbook('log_results.xlsx')
+            workbook = openpyxl.load_workbook(workbook_path)
         except FileNotFoundError:
-            workbook = Workbook()
+            workbook = openpyxl.Workbook()
             if 'Sheet' in workbook.sheetnames:
                 std_sheet = workbook['Sheet']
                 workbook.remove(std_sheet)
@@ -31,7 +80,7 @@ def log_message_to_excel(sheet_name, data, save_interval=1000):
             elif sheet_name == 'Подписанные файлы':
                 sheet.append(['Filename'])
             else:
-                sheet.append(['Local_uid', 'Message'])
+                sheet.append(['Local_uid', 'Message', 'Index'])
 
         for i, entry in enumerate(data, start=1):
             filename, message = entry
@@ -40,12 +89,12 @@ def log_message_to_excel(sheet_name, data, save_interval=1000):
             elif sheet_name == 'Подписанные файлы':
                 sheet.append([filename])  
             else:
-                sheet.append([filename, message])
+                sheet.append([filename, message, positions.get(filename) if positions else None])
 
             if i % save_interval == 0:
-                workbook.save('log_results.xlsx')
+                workbook.save(workbook_path)
 
-        workbook.save('log_results.xlsx')
+        workbook.save(workbook_path)
 
     except Exception as e:
         print(f"Error occurred: {e}. Data might be partially saved.")
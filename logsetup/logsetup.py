@@ -0,0 +1,151 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Dict, Optional
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DEFAULT_LOGGING_CONFIG = {
+    "file": "main.log",
+    "level": "INFO",
+    "max_bytes": 10 * 1024 * 1024,
+    "backup_count": 5,
+    "rollover_on_start": True,
+    "modules": {},
+}
+
+_lock = threading.Lock()
+_listener: Optional["_Listener"] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+class _Command:
+    """
+    Служебный элемент очереди: действие, которое слушатель выполняет в своем потоке
+    после всех записей, поставленных в очередь раньше.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.done = threading.Event()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def handle(self, record):
+        if isinstance(record, _Command):
+            try:
+                record.action()
+            finally:
+                record.done.set()
+            return
+        super().handle(record)
+
+
+def setup_logging(logging_config: Optional[dict] = None, filename: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Настраивает неблокирующее логирование через очередь.
+
+    Корневой логгер получает только `QueueHandler`: рабочий поток лишь кладет запись в очередь,
+    а запись на диск (с ротацией по размеру) выполняет фоновый `QueueListener`. Уровни задаются
+    в разделе `logging` конфигурации: общий `level` и словарь `modules` «имя логгера → уровень».
+    Повторный вызов перенастраивает логирование (старый слушатель останавливается).
+
+    :param logging_config: Раздел `logging` конфигурации (см. `DEFAULT_LOGGING_CONFIG`).
+    :param filename: Имя файла лога; переопределяет `file` из конфигурации. Пустая строка — вывод в stderr.
+    :return: Запущенный слушатель очереди.
+    """
+    global _listener, _queue_handler
+    settings = {**DEFAULT_LOGGING_CONFIG, **(logging_config or {})}
+    log_file = settings["file"] if filename is None else filename
+
+    if log_file:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=settings["max_bytes"], backupCount=settings["backup_count"],
+            encoding="utf-8", delay=True,
+        )
+        if settings["rollover_on_start"] and settings["backup_count"]:
+            handler.doRollover()
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(settings.get("format", DEFAULT_FORMAT)))
+
+    with _lock:
+        shutdown_logging()
+        root_logger = logging.getLogger()
+        for old_handler in root_logger.handlers[:]:
+            root_logger.removeHandler(old_handler)
+            old_handler.close()
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        root_logger.addHandler(_queue_handler)
+        _listener = _Listener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+
+    root_logger.setLevel(settings["level"])
+    set_levels(settings["modules"])
+    return _listener
+
+
+def set_levels(levels: Dict[str, str]):
+    """
+    Меняет уровни логгеров во время работы, например `{"tp.check_patient": "DEBUG"}`.
+
+    :param levels: Словарь «имя логгера → уровень»; пустое имя означает корневой логгер.
+    """
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
+
+
+def add_handler(handler: logging.Handler):
+    """
+    Подключает дополнительный обработчик (например, лог региона) к фоновому слушателю.
+
+    Если логирование через очередь не настроено, обработчик добавляется к корневому логгеру.
+    """
+    with _lock:
+        if _listener is None:
+            logging.getLogger().addHandler(handler)
+        else:
+            _listener.handlers = _listener.handlers + (handler,)
+
+
+def remove_handler(handler: logging.Handler):
+    """
+    Отключает обработчик, подключенный через `add_handler`.
+
+    Обработчик отключается только после того, как слушатель запишет все поставленные
+    до этого записи, поэтому хвост лога (например, лога региона) не теряется.
+    """
+    with _lock:
+        listener = _listener
+        if listener is None:
+            logging.getLogger().removeHandler(handler)
+            return
+
+        def detach():
+            listener.handlers = tuple(h for h in listener.handlers if h is not handler)
+
+        command = _Command(detach)
+        listener.queue.put_nowait(command)
+    command.done.wait(timeout=30)
+
+
+def shutdown_logging():
+    """
+    Дописывает накопленные записи и останавливает фоновый слушатель.
+    """
+    global _listener, _queue_handler
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _queue_handler = None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+atexit.register(shutdown_logging)
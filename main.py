@@ -1,19 +1,44 @@
+import argparse
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import json
 import threading
-from samplexml.xml import xml_create
-from tpdoc.tpdoc import start_generator_json
-from pfrchecksnils.crome import update_cookies_and_post
 import logging
 import os
-from signature.sign import sign_files, save_commands_to_file
+from lazyimport.lazyimport import lazy_callable
+from logsetup.logsetup import setup_logging
+from metrics import metrics
+from profiling.profiling import profile_run
+from signature.sign import DEFAULT_JAVA_PATH, DEFAULT_JAR_PATH
+from uidinput.uidinput import UidSource
+from progress.progress import ProgressChannel
+from resultsgrid.resultsgrid import ResultsModel, open_results_window, STATUS_DONE, STATUS_ERROR, STATUS_IN_PROGRESS
+from logging_excel.log import add_listener
+from cancellation.cancellation import configure_timeouts, current_token, new_batch_token
 
 
 
-logging.basicConfig(filename='main.log', filemode='w', level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', encoding="utf-8")
 logger = logging.getLogger(__name__)
 
+# Модули стадий (requests, PIL, Pymorphy3 и т.д.) загружаются при первом использовании,
+# чтобы окно появлялось сразу, а стоимость импорта платила только запущенная стадия.
+xml_create = lazy_callable("samplexml.xml", "xml_create")
+start_generator_json = lazy_callable("tpdoc.tpdoc", "start_generator_json")
+sign_files = lazy_callable("signature.sign", "sign_files")
+save_commands_to_file = lazy_callable("signature.sign", "save_commands_to_file")
+run_pipeline = lazy_callable("pipeline.pipeline", "run_pipeline")
+format_report = lazy_callable("pipeline.pipeline", "format_report")
+configure_replay = lazy_callable("replay.replay", "configure_replay")
+
+PIPELINE_STAGE_TITLES = {
+    "dedupe": "Отсев повторов",
+    "fetch": "Выгрузка",
+    "check": "Проверка",
+    "render": "Формирование XML",
+    "validate": "Проверка XML",
+    "sign": "Подпись",
+}
+
 def load_config():
     """
     Загружает конфигурацию из файла `config.json`.
@@ -25,19 +50,18 @@ def load_config():
             config = json.load(f)
         return config
     except Exception as e:
-        logging.error(f"Ошибка при загрузке конфигурации: {e}")
+        logging.error("Ошибка при загрузке конфигурации: %s", e)
         return None
     
 
-def extract_filenames(text):
+def extract_filenames(lines):
     """
-    Извлекает названия файлов из текста, проверяет их наличие в папке 'work'.
+    Извлекает названия файлов из строк ввода, проверяет их наличие в папке 'work'.
 
-    :param text: Входной текст из `local_uid_text`.
+    :param lines: Итерируемый набор строк (например, `UidSource` поля `local_uid_text` или файла).
     :return: Кортеж из списка файлов, которые существуют, и списка файлов, которые не существуют.
     """
-    lines = text.strip().split('\n')
-    filenames = [line.strip() for line in lines if line.strip()]
+    filenames = (line.strip() for line in lines if line.strip())
     work_dir = os.path.join(os.getcwd(), 'work')
     existing_files = []
     missing_files = []
@@ -51,21 +75,38 @@ def extract_filenames(text):
 
     return existing_files, missing_files
 
-def main():
+def main(argv=None):
     """
     Основная функция приложения, которая инициализирует графический интерфейс, загружает конфигурацию,
     и обрабатывает действия пользователя для загрузки, проверки и подписания документов.
+
+    Ключ `--profile` включает профилирование каждого запуска (см. раздел `profiling` конфигурации),
+    `--replay record|replay` — запись ответов шлюза и ПФР в архив или их воспроизведение (раздел `replay`).
+    Кнопка «Отмена» останавливает запущенные действия; тайм-ауты и срок запуска задаются в разделе `timeouts`.
     """
-    logger.info("Запуск основной функции main()")
+    parser = argparse.ArgumentParser(description="ГИП правка")
+    parser.add_argument("--profile", action="store_true", help="Профилировать запуски (cProfile и tracemalloc)")
+    parser.add_argument("--replay", choices=["record", "replay"],
+                        help="Записывать ответы шлюза и ПФР в архив или воспроизводить их из архива (раздел replay)")
+    args = parser.parse_args(argv)
 
     config = load_config()
+    setup_logging((config or {}).get("logging"))
+    logger.info("Запуск основной функции main()")
+
     if config is None:
         logging.error("Конфигурация не была загружена. Программа завершает работу.")
         return
+    metrics.configure_metrics(config.get("metrics"))
+    configure_timeouts(config.get("timeouts"))
+    if args.replay or config.get("replay", {}).get("mode", "off") != "off":
+        configure_replay(config.get("replay"), args.replay)
+    if args.profile:
+        config.setdefault("profiling", {})["enabled"] = True
 
     root = tk.Tk()
     root.title("ГИП правка")
-    root.geometry("770x450")
+    root.geometry("880x560")
     root.resizable(False, False)
 
     style = ttk.Style()
@@ -85,10 +126,48 @@ def main():
     local_uid_text = tk.Text(frame, height=15, width=60, font=("Arial", 12))
     local_uid_text.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5)
 
+    uid_file_path = None
+
+    def choose_uid_file():
+        """
+        Выбирает файл со списком UID вместо ввода в текстовое поле. Повторное нажатие сбрасывает выбор.
+
+        Файл не загружается в поле ввода: стадии читают его построчно, поэтому размер списка не ограничен.
+        """
+        nonlocal uid_file_path
+        local_uid_text.config(state=tk.NORMAL)
+        local_uid_text.delete("1.0", tk.END)
+        if uid_file_path:
+            uid_file_path = None
+            uid_file_button.config(text="Из файла...")
+            return
+
+        path = filedialog.askopenfilename(title="Файл со списком UID", filetypes=[("Текстовые файлы", "*.txt"), ("Все файлы", "*.*")])
+        if path:
+            uid_file_path = path
+            local_uid_text.insert("1.0", f"Список UID из файла:\n{path}")
+            local_uid_text.config(state=tk.DISABLED)
+            uid_file_button.config(text="Сбросить файл")
+            logger.info("Выбран файл UID: %s", path)
+
+    uid_file_button = ttk.Button(frame, text="Из файла...", command=choose_uid_file)
+    uid_file_button.grid(row=1, column=0, sticky=(tk.S, tk.W), pady=(0, 10))
+
+    def get_uid_source():
+        """
+        Возвращает источник UID: выбранный файл или содержимое текстового поля.
+        """
+        if uid_file_path:
+            return UidSource(path=uid_file_path)
+        return UidSource(text=local_uid_text.get("1.0", "end-1c"))
+
     progress_var = tk.IntVar()
     progress_bar = ttk.Progressbar(frame, variable=progress_var, maximum=100)
     progress_bar.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=13)
 
+    status_var = tk.StringVar()
+    ttk.Label(frame, textvariable=status_var, font=("Arial", 10), justify=tk.LEFT).grid(row=4, column=0, columnspan=2, sticky=tk.W)
+
     selected_region_config = config["regions"][region_combobox.get()]
 
     def on_region_change(event):
@@ -97,15 +176,109 @@ def main():
 
     region_combobox.bind("<<ComboboxSelected>>", on_region_change)
 
-    def update_progress_bar(current, total):
+    progress_channel = ProgressChannel()
+
+    def update_progress_view(stages):
+        """
+        Обновляет индикатор прогресса и строку состояния. Вызывается каналом прогресса в главном потоке
+        не чаще одного раза за интервал обновления.
+
+        :param stages: Список стадий `StageProgress`; индикатор показывает последнюю незавершенную стадию.
         """
-        Обновляет индикатор прогресса.
+        if not stages:
+            status_var.set("")
+            return
+        active = [stage for stage in stages if stage.finished is None]
+        current = (active or stages)[-1]
+        progress_bar['maximum'] = max(current.total, 1)
+        progress_var.set(current.done)
+        status_var.set('\n'.join(stage.format() for stage in stages))
+
+    progress_channel.attach(root, update_progress_view)
+
+    results_model = ResultsModel()
+    results_model.attach(root)
+    add_listener(results_model.on_excel_log)
+    results_window = None
+
+    def show_results():
+        """
+        Открывает таблицу результатов по каждому local_uid.
+        """
+        nonlocal results_window
+        results_window = open_results_window(root, results_model, results_window)
+
+    metrics_summary = None
+    metrics_window = None
+
+    def show_metrics():
+        """
+        Открывает таблицу замеров операций последнего запуска (`metrics.format_summary`).
+        """
+        nonlocal metrics_window
+        if metrics_window is not None and metrics_window.winfo_exists():
+            metrics_window.destroy()
+        metrics_window = tk.Toplevel(root)
+        metrics_window.title("Замеры операций")
+        summary_text = tk.Text(metrics_window, height=20, width=100, font=("Courier New", 10), wrap=tk.NONE)
+        summary_text.insert("1.0", metrics_summary or "Замеров пока нет: запустите выгрузку, проверку, подпись или обработку.")
+        summary_text.configure(state=tk.DISABLED)
+        summary_text.pack(fill=tk.BOTH, expand=True)
+
+    def metrics_completed(summary):
+        """
+        Запоминает таблицу замеров завершившегося запуска и обновляет открытое окно замеров.
+
+        :param summary: Текст таблицы (`metrics.export`).
+        """
+        nonlocal metrics_summary
+        metrics_summary = summary
+        if metrics_window is not None and metrics_window.winfo_exists():
+            show_metrics()
+
+    active_tokens = set()
+
+    def start_batch(target):
+        """
+        Запускает действие в отдельном потоке с собственным признаком отмены (см. кнопку 'Отмена')
+        и сроком `timeouts.batch_deadline`.
+        """
+        token = new_batch_token(config)
+
+        def run():
+            current_token.set(token)
+            active_tokens.add(token)
+            try:
+                target()
+            finally:
+                active_tokens.discard(token)
 
-        :param current: Текущее значение прогресса.
-        :param total: Общее количество задач.
+        threading.Thread(target=run).start()
+
+    def cancel_button_action():
+        """
+        Обрабатывает нажатие кнопки 'Отмена': останавливает запущенные действия. Начатые запросы и подписи
+        завершаются, новые UID не обрабатываются; необработанные UID конвейера сохраняются в remaining_uids.txt.
         """
-        progress_var.set(current)
-        progress_bar.update()
+        logger.info("Кнопка 'Отмена' нажата")
+        if not active_tokens:
+            status_var.set("Нет запущенных действий")
+            return
+        for token in list(active_tokens):
+            token.cancel()
+
+    def ask_mpi_mismatch_errors():
+        """
+        Спрашивает, нужно ли требовать ошибки PATIENT_MPI_MISMATCH. Вызывается в главном потоке до запуска обработки.
+        """
+        mpi_mismatch_errors = messagebox.askyesno(
+            "Подтверждение",
+            "Хотите включить проверку на наличие ошибок PATIENT_MPI_MISMATCH в данных пациента? "
+            "Если такая ошибка не найдена, файл не пройдет валидацию."
+        )
+        logger.info("Проверка на ошибки PATIENT_MPI_MISMATCH установлена в статус: %s",
+                    "Выполняется" if mpi_mismatch_errors else "Невыполняется")
+        return mpi_mismatch_errors
 
     def upload_completed(successful, total):
         """
@@ -120,7 +293,6 @@ def main():
             messagebox.showwarning("Завершено", f"Не все документы были выгружены ({successful}/{total}).")
         
         progress_var.set(0)
-        progress_bar.update()
 
     def upload_button_action():
         """
@@ -128,33 +300,36 @@ def main():
         """
         logger.info("Кнопка 'Upload' нажата")
         try:
-            progress_var.set(0)
-            total_uids = len(local_uid_text.get("1.0", "end-1c").strip().split('\n'))
-            progress_bar['maximum'] = total_uids
+            uid_source = get_uid_source()
+            total_uids = uid_source.total
+            progress_channel.clear()
+            progress_channel.begin("Выгрузка", total_uids)
             
             def run_upload():
-                successful_uploads = start_generator_json(config, region_combobox, local_uid_text, update_progress_bar)
-                upload_completed(successful_uploads, total_uids)
+                metrics_start = metrics.snapshot()
+                with profile_run(config, "upload"):
+                    successful_uploads = start_generator_json(config, region_combobox, uid_source, progress_channel.callback("Выгрузка"), total_uids)
+                progress_channel.finish("Выгрузка")
+                progress_channel.call(metrics_completed, metrics.export(metrics_start, "Замеры операций выгрузки"))
+                progress_channel.call(upload_completed, successful_uploads, total_uids)
             
-            thread = threading.Thread(target=run_upload)
-            thread.start()
+            start_batch(run_upload)
             
         except Exception as e:
-            logger.error(f"Ошибка при выгрузке документов: {e}")
+            logger.error("Ошибка при выгрузке документов: %s", e)
 
     def check_completed(successful, total):
         """
         Отображает сообщение о завершении проверки XML-файлов.
 
-        :param successful: Список успешно созданных файлов.
+        :param successful: Количество UID, для которых XML-файлы не созданы.
         :param total: Общее количество файлов.
         """
-        if len(successful) == 0:
-            messagebox.showinfo("Завершено", f"Все XML-файлы ({total - len(successful)}/{total}) успешно созданы.")
+        if successful == 0:
+            messagebox.showinfo("Завершено", f"Все XML-файлы ({total - successful}/{total}) успешно созданы.")
         else:
-            messagebox.showwarning("Завершено", f"Не все XML-файлы были успешно созданы ({total - len(successful)}/{total}).")
+            messagebox.showwarning("Завершено", f"Не все XML-файлы были успешно созданы ({total - successful}/{total}).")
         progress_var.set(0)
-        progress_bar.update()
 
     def check_button_action():
         """
@@ -162,35 +337,37 @@ def main():
         """
         logger.info("Кнопка 'Check' нажата")
         try:
-            uids = local_uid_text.get("1.0", "end-1c").strip().split('\n')
-            total_uids = len(uids)
-            progress_bar['maximum'] = total_uids
-
-            def update_progress(current, total):
-                progress_var.set(current)
-                progress_bar.update()
+            uid_source = get_uid_source()
+            total_uids = uid_source.total
+            mpi_mismatch_errors = ask_mpi_mismatch_errors()
+            progress_channel.clear()
+            progress_channel.begin("Проверка", total_uids)
 
             def run_check():
-                mpi_mismatch_errors = True
-
-                user_choice = messagebox.askyesno(
-                "Подтверждение", 
-                "Хотите включить проверку на наличие ошибок PATIENT_MPI_MISMATCH в данных пациента? "
-                "Если такая ошибка не найдена, файл не пройдет валидацию."
-                )
-                if user_choice is not None:
-                    mpi_mismatch_errors = user_choice
-                logger.info(f"Проверка на ошибки PATIENT_MPI_MISMATCH установлена в статус: {'Выполняется' if mpi_mismatch_errors else "Невыполняется"}")
+                metrics_start = metrics.snapshot()
+                with profile_run(config, "check"):
+                    successful_creations = xml_create(config, region_combobox, uid_source, root=root, progress_callback=progress_channel.callback("Проверка"), mpi_mismatch_errors=mpi_mismatch_errors, total_uids=total_uids)
+                progress_channel.finish("Проверка")
+                progress_channel.call(metrics_completed, metrics.export(metrics_start, "Замеры операций проверки"))
+                progress_channel.call(check_completed, successful_creations, total_uids)
 
-                successful_creations = xml_create(config, region_combobox, local_uid_text, root=root, progress_callback=update_progress, mpi_mismatch_errors=mpi_mismatch_errors)
+            start_batch(run_check)
 
-                check_completed(successful_creations, total_uids)
+        except Exception as e:
+            logger.error("Ошибка при создании XML: %s", e)
 
-            thread = threading.Thread(target=run_check)
-            thread.start()
+    def sign_completed(signed_files, total):
+        """
+        Отображает сообщение о завершении подписания файлов.
 
-        except Exception as e:
-            logger.error(f"Ошибка при создании XML: {e}")
+        :param signed_files: Список подписанных файлов.
+        :param total: Общее количество файлов.
+        """
+        if signed_files:
+            messagebox.showinfo("Завершено", f"Подписано файлов: {len(signed_files)} из {total}\nКоманды curl сохранены в файл: curl_commands.txt")
+        else:
+            messagebox.showwarning("Ошибка", "Подпись файлов не удалась.")
+        progress_var.set(0)
 
     def sign_button_action():
         """
@@ -199,66 +376,120 @@ def main():
         """
         logger.info("Кнопка 'Sign' нажата")
         try:
-            text = local_uid_text.get("1.0", "end-1c")
-
-            existing_files, missing_files = extract_filenames(text)
+            existing_files, missing_files = extract_filenames(get_uid_source())
 
             if missing_files:
                 missing_files_str = '\n'.join(missing_files)
-                logger.error(f"Файлы не найдены: {missing_files_str}")
+                logger.error("Файлы не найдены: %s", missing_files_str)
                 messagebox.showerror("Ошибка", f"Следующие файлы не найдены:\n{missing_files_str}")
                 
             if existing_files:
-                def update_progress(current: int, total: int):
-                    """
-                    Обновляет прогрессбар с текущим значением прогресса.
-
-                    :param current: Текущее значение прогресса.
-                    :param total: Общее количество задач.
-                    """
-                    progress_var.set(current)
-                    progress_bar.update()
-
                 def run_sign():
-                    java_path = "C:\\Java\\jdk1.8.0_181\\bin\\java.exe"
-                    jar_path = "C:\\Distr\\XMLSign_20200115\\xmlfile-sign-1.7.0.jar"
+                    java_path = config.get("signing", {}).get("java_path", DEFAULT_JAVA_PATH)
+                    jar_path = config.get("signing", {}).get("jar_path", DEFAULT_JAR_PATH)
                     properties_file = selected_region_config["properties"]
 
-                    signed_files, curl_commands = sign_files(config, region_combobox, existing_files, properties_file, java_path, jar_path, update_progress)
+                    metrics_start = metrics.snapshot()
+                    with profile_run(config, "sign"):
+                        signed_files, curl_commands = sign_files(config, region_combobox, existing_files, properties_file, java_path, jar_path, progress_channel.callback("Подпись"))
                     save_commands_to_file(curl_commands, 'curl_commands.txt')
 
-                    if signed_files:
-                        messagebox.showinfo("Завершено", f"Подписано файлов: {len(signed_files)} из {len(existing_files) + len(missing_files)}\nКоманды curl сохранены в файл: curl_commands.txt")
-                    else:
-                        messagebox.showwarning("Ошибка", "Подпись файлов не удалась.")
-
-
-                    progress_var.set(0)
-                    progress_bar.update()
+                    progress_channel.finish("Подпись")
+                    progress_channel.call(metrics_completed, metrics.export(metrics_start, "Замеры операций подписи"))
+                    progress_channel.call(sign_completed, signed_files, len(existing_files) + len(missing_files))
 
-
-                progress_var.set(0)
-                progress_bar['maximum'] = len(existing_files)
+                progress_channel.clear()
+                progress_channel.begin("Подпись", len(existing_files))
                     
-                thread = threading.Thread(target=run_sign)
-                thread.start()
+                start_batch(run_sign)
 
         except Exception as e:
-            logger.error(f"Ошибка при подписании файлов: {e}")
+            logger.error("Ошибка при подписании файлов: %s", e)
             messagebox.showerror("Ошибка", f"Ошибка при подписании файлов: {e}")
 
+    def process_all_completed(report, total):
+        """
+        Отображает итоговый отчет потоковой обработки.
+
+        :param report: Отчет конвейера.
+        :param total: Общее количество UID.
+        """
+        summary = format_report(report)
+        if report["completed"] == report["processed"] and not report.get("cancel_reason"):
+            messagebox.showinfo("Завершено", f"Подписано файлов: {report['completed']} из {total}\n\n{summary}")
+        else:
+            messagebox.showwarning("Завершено", f"Подписано файлов: {report['completed']} из {total}\n\n{summary}")
+        progress_var.set(0)
+
+    def process_all_button_action():
+        """
+        Обрабатывает нажатие кнопки 'Обработать всё': запускает потоковый конвейер
+        выгрузка → проверка → формирование XML → подпись в отдельном потоке.
+        """
+        logger.info("Кнопка 'Обработать всё' нажата")
+        try:
+            uid_source = get_uid_source()
+            total_uids = uid_source.total
+            region_name = region_combobox.get()
+            mpi_mismatch_errors = ask_mpi_mismatch_errors()
+
+            progress_channel.clear()
+            for stage in PIPELINE_STAGE_TITLES.values():
+                progress_channel.begin(stage, total_uids)
+            progress_channel.begin("Итого", total_uids)
+
+            def on_stage(stage, item):
+                progress_channel.advance(PIPELINE_STAGE_TITLES.get(stage, stage))
+                if item.failed_stage == "dedupe":
+                    # Повторы попадают в таблицу с листа 'Дубликаты UID' под нормализованным UID.
+                    return
+                if item.failed_stage:
+                    status = STATUS_ERROR
+                elif stage == "sign":
+                    status = STATUS_DONE
+                else:
+                    status = STATUS_IN_PROGRESS
+                output = item.signed_file or item.xml_file
+                if output:
+                    results_model.update(item.local_uid, position=item.index, stage=stage, status=status, output=output)
+                else:
+                    results_model.update(item.local_uid, position=item.index, stage=stage, status=status)
+
+            def run_all():
+                report = run_pipeline(config, region_name, uid_source, root, mpi_mismatch_errors, progress_channel.callback("Итого"), total_uids, stage_callback=on_stage)
+                for stage in list(PIPELINE_STAGE_TITLES.values()) + ["Итого"]:
+                    progress_channel.finish(stage)
+                progress_channel.call(metrics_completed, report["metrics_summary"])
+                progress_channel.call(process_all_completed, report, total_uids)
+
+            start_batch(run_all)
+
+        except Exception as e:
+            logger.error("Ошибка при потоковой обработке: %s", e)
 
     buttons_frame = ttk.Frame(frame)
     buttons_frame.grid(row=3, column=0, columnspan=2, pady=10)
 
     upload_button = ttk.Button(buttons_frame, text="Выгрузить", command=upload_button_action)
-    upload_button.pack(side=tk.LEFT, padx=(50, 50))
+    upload_button.pack(side=tk.LEFT, padx=(8, 8))
 
     check_button = ttk.Button(buttons_frame, text="Проверить", command=check_button_action)
-    check_button.pack(side=tk.LEFT, padx=(50, 50))
+    check_button.pack(side=tk.LEFT, padx=(8, 8))
 
     sign_button = ttk.Button(buttons_frame, text="Подписать", command=sign_button_action)
-    sign_button.pack(side=tk.LEFT, padx=(50, 50))
+    sign_button.pack(side=tk.LEFT, padx=(8, 8))
+
+    process_all_button = ttk.Button(buttons_frame, text="Обработать всё", command=process_all_button_action)
+    process_all_button.pack(side=tk.LEFT, padx=(8, 8))
+
+    results_button = ttk.Button(buttons_frame, text="Результаты", command=show_results)
+    results_button.pack(side=tk.LEFT, padx=(8, 8))
+
+    metrics_button = ttk.Button(buttons_frame, text="Замеры", command=show_metrics)
+    metrics_button.pack(side=tk.LEFT, padx=(8, 8))
+
+    cancel_button = ttk.Button(buttons_frame, text="Отмена", command=cancel_button_action)
+    cancel_button.pack(side=tk.LEFT, padx=(8, 8))
 
     root.mainloop()
 
@@ -0,0 +1,315 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "gip"
+# Верхние границы выше тайм-аутов по умолчанию (`cancellation.DEFAULT_TIMEOUTS`, подпись — 300 с),
+# чтобы p95 долгих вызовов не упирался в последнюю границу.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0, 600.0, 1800.0)
+
+DEFAULT_METRICS_CONFIG = {
+    "http_host": "127.0.0.1",
+    "http_port": 0,
+    "textfile": "metrics.prom",
+}
+
+RESULT_OK = "ok"
+RESULT_FAIL = "fail"
+RESULT_ERROR = "error"
+
+
+class Histogram:
+    """
+    Гистограмма длительностей в формате Prometheus: количество, сумма и накопительные корзины.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def minus(self, other: Optional["Histogram"]) -> "Histogram":
+        """Разница с более ранним снимком той же гистограммы."""
+        histogram = self.copy()
+        if other is not None:
+            histogram.counts = [a - b for a, b in zip(self.counts, other.counts)]
+            histogram.count -= other.count
+            histogram.sum -= other.sum
+        return histogram
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Оценка квантиля по корзинам (линейная интерполяция внутри корзины, как `histogram_quantile`).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Потокобезопасное хранилище счетчиков и гистограмм.
+
+    Счетчик — `name{result=...}`, гистограмма — `name_seconds`. Все значения накапливаются
+    за время работы процесса; итог отдельного запуска считается как разница снимков (`snapshot`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, str], int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self.help.setdefault(name, help_text)
+
+    def inc(self, name: str, result: str = RESULT_OK, amount: int = 1):
+        with self._lock:
+            key = (name, result)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, result: str = RESULT_OK):
+        """Записывает один вызов: счетчик с результатом и длительность в гистограмму."""
+        with self._lock:
+            key = (name, result)
+            self.counters[key] = self.counters.get(key, 0) + 1
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        :return: Копия текущих значений для последующего `format_summary(since=...)`.
+        """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.copy() for name, histogram in self.histograms.items()},
+            }
+
+    def render(self) -> str:
+        """
+        :return: Метрики в текстовом формате Prometheus.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        names = sorted({name for name, _ in snapshot["counters"]} | set(snapshot["histograms"]))
+        for name in names:
+            help_text = self.help.get(name, name)
+            lines.append(f"# HELP {PREFIX}_{name}_total {help_text}: количество вызовов")
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (counter_name, result), value in sorted(snapshot["counters"].items()):
+                if counter_name == name:
+                    lines.append(f'{PREFIX}_{name}_total{{result="{result}"}} {value}')
+
+            histogram = snapshot["histograms"].get(name)
+            if histogram is None:
+                continue
+            lines.append(f"# HELP {PREFIX}_{name}_seconds {help_text}: длительность")
+            lines.append(f"# TYPE {PREFIX}_{name}_seconds histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{PREFIX}_{name}_seconds_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_{name}_seconds_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{PREFIX}_{name}_seconds_sum {histogram.sum:.6f}")
+            lines.append(f"{PREFIX}_{name}_seconds_count {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+_exporter = {"textfile": None, "server": None}
+
+
+def _result_of(value) -> str:
+    # Функции проекта сообщают о неудаче через None/False, а не исключением.
+    return RESULT_FAIL if value is None or value is False else RESULT_OK
+
+
+def timed(name: str, help_text: str = "", track_result: bool = True):
+    """
+    Декоратор: считает вызовы функции (ok / fail / error) и записывает их длительность.
+
+    `fail` — функция вернула `None` или `False`, `error` — выбросила исключение.
+
+    :param name: Имя метрики, например `"sign_file"`.
+    :param help_text: Описание метрики для экспорта.
+    :param track_result: Учитывать ли возвращаемое значение; `False` для функций, которые ничего не возвращают.
+    """
+    registry.describe(name, help_text or name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                value = func(*args, **kwargs)
+            except BaseException:
+                registry.observe(name, time.perf_counter() - started, RESULT_ERROR)
+                raise
+            registry.observe(name, time.perf_counter() - started, _result_of(value) if track_result else RESULT_OK)
+            return value
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timer(name: str, help_text: str = ""):
+    """
+    Контекстный менеджер для замера участка кода, например разбора JSON внутри функции.
+    """
+    registry.describe(name, help_text or name)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.observe(name, time.perf_counter() - started, RESULT_ERROR)
+        raise
+    registry.observe(name, time.perf_counter() - started)
+
+
+def snapshot() -> dict:
+    """Снимок метрик для подсчета итогов одного запуска."""
+    return registry.snapshot()
+
+
+def format_summary(since: Optional[dict] = None) -> str:
+    """
+    Форматирует таблицу итогов: вызовы по результатам, среднее, p50, p95 и суммарное время.
+
+    :param since: Снимок, сделанный в начале запуска; без него выводятся итоги за все время работы.
+    :return: Текст таблицы.
+    """
+    current = registry.snapshot()
+    before_counters = since["counters"] if since else {}
+    before_histograms = since["histograms"] if since else {}
+
+    header = f"{'Операция':<24}{'вызовы':>8}{'ok':>8}{'fail':>8}{'error':>8}{'сред, с':>10}{'p50, с':>10}{'p95, с':>10}{'всего, с':>11}"
+    lines = [header, '-' * len(header)]
+    for name in sorted(current["histograms"]):
+        histogram = current["histograms"][name].minus(before_histograms.get(name))
+        if not histogram.count:
+            continue
+        results = {
+            result: current["counters"].get((name, result), 0) - before_counters.get((name, result), 0)
+            for result in (RESULT_OK, RESULT_FAIL, RESULT_ERROR)
+        }
+        lines.append(
+            f"{name:<24}{histogram.count:>8}{results[RESULT_OK]:>8}{results[RESULT_FAIL]:>8}{results[RESULT_ERROR]:>8}"
+            f"{histogram.sum / histogram.count:>10.3f}{histogram.quantile(0.5):>10.3f}"
+            f"{histogram.quantile(0.95):>10.3f}{histogram.sum:>11.1f}"
+        )
+    if len(lines) == 2:
+        lines.append("Нет замеров")
+    return '\n'.join(lines)
+
+
+def write_textfile(path: Optional[str] = None):
+    """
+    Атомарно записывает метрики в файл для textfile-коллектора node_exporter.
+
+    :param path: Путь к файлу; по умолчанию — `textfile` из раздела `metrics` конфигурации.
+    """
+    path = path or _exporter["textfile"]
+    if not path:
+        return
+    temp_file = path + ".tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(registry.render())
+        os.replace(temp_file, path)
+    except OSError as e:
+        logger.error("Не удалось записать метрики в %s: %s", path, e)
+
+
+def start_http_server(port: int, host: str = "127.0.0.1"):
+    """
+    Запускает HTTP-эндпоинт `/metrics` в фоновом потоке.
+
+    :param port: Порт (0 — выбрать свободный).
+    :param host: Адрес; по умолчанию только локальный.
+    :return: Запущенный сервер (`server.server_address` — фактический адрес).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("HTTP метрик: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Метрики доступны по адресу http://%s:%s/metrics", *server.server_address[:2])
+    return server
+
+
+def configure_metrics(metrics_config: Optional[dict] = None):
+    """
+    Настраивает экспорт по разделу `metrics` конфигурации (см. `DEFAULT_METRICS_CONFIG`).
+
+    `http_port` больше нуля включает HTTP-эндпоинт, `textfile` — файл, который обновляется
+    в конце каждого запуска (`export`). Пустое значение отключает соответствующий способ.
+    """
+    settings = {**DEFAULT_METRICS_CONFIG, **(metrics_config or {})}
+    _exporter["textfile"] = settings.get("textfile") or None
+    if settings.get("http_port") and _exporter["server"] is None:
+        try:
+            _exporter["server"] = start_http_server(int(settings["http_port"]), settings.get("http_host", "127.0.0.1"))
+        except OSError as e:
+            logger.error("Не удалось запустить HTTP-эндпоинт метрик: %s", e)
+
+
+def export(since: Optional[dict] = None, title: str = "Итоги запуска"):
+    """
+    Завершает запуск: пишет таблицу итогов в лог и обновляет textfile с метриками.
+
+    :param since: Снимок начала запуска (`snapshot`).
+    :param title: Заголовок таблицы в логе.
+    :return: Текст таблицы итогов.
+    """
+    summary = format_summary(since)
+    logger.info("%s:\n%s", title, summary)
+    write_textfile()
+    return summary
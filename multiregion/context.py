@@ -0,0 +1,3 @@
+import contextvars
+
+current_region = contextvars.ContextVar("current_region", default=None)
@@ -0,0 +1,230 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import threading
+import tkinter as tk
+from typing import Callable, Dict, Iterable, Optional
+from multiregion.context import current_region
+from logging_excel.log import current_workbook
+from logsetup.logsetup import setup_logging, add_handler, remove_handler
+from metrics import metrics
+from replay.replay import configure_replay
+from cancellation.cancellation import configure_timeouts, current_token, new_batch_token
+from pipeline.pipeline import run_pipeline, format_report
+from uidinput.uidinput import UidSource
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGIONS_DIRECTORY = 'regions'
+
+_factory_lock = threading.Lock()
+_factory_installed = False
+
+
+def _install_record_factory():
+    """
+    Добавляет в каждую запись лога атрибут `region` из контекстной переменной `current_region`.
+
+    Атрибут заполняется в потоке, создавшем запись, поэтому фильтры обработчиков видят регион
+    независимо от того, в каком потоке запись будет записана в файл.
+    """
+    global _factory_installed
+    with _factory_lock:
+        if _factory_installed:
+            return
+        base_factory = logging.getLogRecordFactory()
+
+        def factory(*args, **kwargs):
+            record = base_factory(*args, **kwargs)
+            record.region = current_region.get()
+            return record
+
+        logging.setLogRecordFactory(factory)
+        _factory_installed = True
+
+
+class RegionFilter(logging.Filter):
+    """
+    Пропускает только записи лога указанного региона.
+    """
+
+    def __init__(self, region_name: str):
+        super().__init__()
+        self.region_name = region_name
+
+    def filter(self, record):
+        return getattr(record, "region", None) == self.region_name
+
+
+def run_region(config, region_name, local_uids, root, mpi_mismatch_errors=True,
+               base_directory=DEFAULT_REGIONS_DIRECTORY, progress_callback=None, total=0) -> dict:
+    """
+    Обрабатывает UID одного региона в отдельном каталоге `<base_directory>/<region_name>`.
+
+    В каталоге региона создаются папки `data` и `work`, Excel-лог `log_results.xlsx`, текстовый лог
+    `region.log` и файл `curl_commands.txt`. Ошибка региона записывается в результат и не прерывает
+    обработку остальных регионов.
+
+    :param config: Конфигурационный словарь.
+    :param region_name: Имя региона из раздела `regions` конфигурации.
+    :param local_uids: Итерируемый набор локальных UID региона.
+    :param root: Корневое окно Tkinter для окна капчи.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :param base_directory: Каталог, в котором создаются каталоги регионов.
+    :param progress_callback: Функция обратного вызова, принимающая имя региона, текущий прогресс и общее количество.
+    :param total: Общее количество UID региона.
+    :return: Словарь с ключом `report` или `error`.
+    """
+    workspace = os.path.abspath(os.path.join(base_directory, region_name))
+    os.makedirs(workspace, exist_ok=True)
+
+    current_region.set(region_name)
+    current_workbook.set(os.path.join(workspace, 'log_results.xlsx'))
+
+    _install_record_factory()
+    handler = logging.FileHandler(os.path.join(workspace, 'region.log'), mode='w', encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handler.addFilter(RegionFilter(region_name))
+    add_handler(handler)
+
+    def region_progress(current, region_total):
+        if progress_callback:
+            progress_callback(region_name, current, region_total)
+
+    try:
+        logger.info("Начата обработка региона %s", region_name)
+        report = run_pipeline(
+            config, region_name, local_uids, root, mpi_mismatch_errors, region_progress, total, workspace,
+            os.path.join(workspace, 'curl_commands.txt'),
+        )
+        return {"report": report}
+    except Exception as e:
+        logger.error("Ошибка при обработке региона %s: %s", region_name, e)
+        return {"error": str(e)}
+    finally:
+        remove_handler(handler)
+        handler.close()
+
+
+def run_regions(config, region_uids: Dict[str, Iterable[str]], root, mpi_mismatch_errors=True,
+                base_directory=DEFAULT_REGIONS_DIRECTORY,
+                progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                totals: Optional[Dict[str, int]] = None) -> Dict[str, dict]:
+    """
+    Обрабатывает несколько регионов одновременно, каждый в своем потоке со своим конвейером.
+
+    У каждого региона свои `api_endpoint`, `properties`, `adress_url_curl` и настройки конвейера
+    (раздел `pipeline` региона дополняет общий), поэтому медленный регион не задерживает остальные.
+
+    :param config: Конфигурационный словарь.
+    :param region_uids: Словарь: имя региона → итерируемый набор UID.
+    :param root: Корневое окно Tkinter для окна капчи.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :param base_directory: Каталог, в котором создаются каталоги регионов.
+    :param progress_callback: Функция обратного вызова (регион, текущий прогресс, общее количество).
+    :param totals: Количество UID по регионам для индикатора прогресса.
+    :return: Словарь: имя региона → результат `run_region`.
+    """
+    results = {}
+    threads = []
+    totals = totals or {}
+
+    for region_name, local_uids in region_uids.items():
+        if region_name not in config["regions"]:
+            logger.error("Регион %s отсутствует в конфигурации", region_name)
+            results[region_name] = {"error": "Регион отсутствует в конфигурации"}
+            continue
+
+        def target(region_name=region_name, local_uids=local_uids):
+            results[region_name] = run_region(
+                config, region_name, local_uids, root, mpi_mismatch_errors,
+                base_directory, progress_callback, totals.get(region_name, 0)
+            )
+
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(target,), name=f"region-{region_name}", daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def format_results(results: Dict[str, dict]) -> str:
+    """
+    Форматирует результаты `run_regions` для вывода в консоль или лог.
+    """
+    lines = []
+    for region_name, result in results.items():
+        lines.append(f"=== {region_name} ===")
+        if "error" in result:
+            lines.append(f"Ошибка: {result['error']}")
+        else:
+            lines.append(format_report(result["report"]))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Командная строка многорегионального режима.
+
+    Пример::
+
+        python -m multiregion.multiregion Region_1=uids_region1.txt Region_2=uids_region2.txt
+
+    Остановка — Ctrl+C: начатые UID завершаются, необработанные записываются в `remaining_uids.txt`
+    каталога региона. Срок всего запуска задается в `timeouts.batch_deadline`.
+    """
+    parser = argparse.ArgumentParser(description="Одновременная обработка нескольких регионов")
+    parser.add_argument("regions", nargs="+", help="Пары <регион>=<файл с UID>")
+    parser.add_argument("--config", default="config.json", help="Путь к файлу конфигурации")
+    parser.add_argument("--output", default=DEFAULT_REGIONS_DIRECTORY, help="Каталог для результатов регионов")
+    parser.add_argument("--no-mpi-check", action="store_true", help="Не требовать ошибок PATIENT_MPI_MISMATCH")
+    parser.add_argument("--profile", action="store_true", help="Профилировать запуск (cProfile и tracemalloc)")
+    parser.add_argument("--replay", choices=["record", "replay"],
+                        help="Записывать ответы шлюза и ПФР в архив или воспроизводить их из архива (раздел replay)")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    setup_logging(config.get("logging"), filename='multiregion.log')
+    metrics.configure_metrics(config.get("metrics"))
+    configure_replay(config.get("replay"), args.replay)
+    configure_timeouts(config.get("timeouts"))
+    if args.profile:
+        config.setdefault("profiling", {})["enabled"] = True
+
+    region_uids = {}
+    for pair in args.regions:
+        region_name, _, uid_file = pair.partition("=")
+        region_uids[region_name] = UidSource(path=uid_file)
+    totals = {region_name: source.total for region_name, source in region_uids.items()}
+
+    root = tk.Tk()
+    root.withdraw()
+    results = {}
+    token = new_batch_token(config)
+
+    def work():
+        current_token.set(token)
+        try:
+            results.update(run_regions(config, region_uids, root, not args.no_mpi_check, args.output, totals=totals))
+        finally:
+            root.after(0, root.quit)
+
+    threading.Thread(target=work, daemon=True).start()
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки, завершаю начатые UID")
+        token.cancel()
+        root.mainloop()
+    print(format_results(results))
+    print(metrics.format_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,237 @@
+import json
 import requests
-from PIL import Image, ImageTk
 from io import BytesIO
 import logging
 import pickle
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional
+from lazyimport.lazyimport import lazy_import
+from metrics.metrics import timed
+from replay.replay import exchange, is_recorded, replay_mode, ReplayMissError, KIND_PFR, MODE_REPLAY
+from cancellation.cancellation import cancel_requested, report_transient_error, request_timeout
+
+# PIL нужен только для окна капчи.
+Image = lazy_import("PIL.Image")
+ImageTk = lazy_import("PIL.ImageTk")
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PFR_BASE_URL = 'https://es.pfrf.ru'
+DEFAULT_SESSION_FILE = 'session.pkl'
+HEADLESS_CAPTCHA_ATTEMPTS = 3
+# Как часто рабочий поток, ожидающий окно капчи, проверяет отмену запуска (секунды).
+CANCEL_POLL_INTERVAL = 0.2
+
+_cached_session = None
+# Сессия ПФР одна на процесс: ее используют потоки проверки всех регионов (см. `multiregion`).
+# `_session_lock` защищает создание сессии, `_captcha_lock` — прохождение капчи, чтобы при истечении
+# сессии капчу вводили один раз, а не по окну на каждый поток.
+_session_lock = threading.Lock()
+_captcha_lock = threading.Lock()
+_pfr_settings = {
+    "base_url": DEFAULT_PFR_BASE_URL,
+    "session_file": DEFAULT_SESSION_FILE,
+    "captcha_solver": None,
+}
+
+
+def configure_pfr(base_url=None, session_file=None, captcha_solver=None):
+    """
+    Переопределяет адрес сервиса проверки СНИЛС, файл сессии и способ ввода капчи.
+
+    Используется стендом производительности (`bench`) для работы с локальной заглушкой ПФР.
+    Сохраненная в памяти сессия сбрасывается.
+
+    :param base_url: Адрес сервиса вместо `https://es.pfrf.ru`.
+    :param session_file: Файл, в котором хранится сессия.
+    :param captcha_solver: Функция `captcha_solver(image_bytes) -> str`, отвечающая на капчу без окна Tk.
+    """
+    global _cached_session
+    with _session_lock:
+        if base_url is not None:
+            _pfr_settings["base_url"] = base_url.rstrip('/')
+        if session_file is not None:
+            _pfr_settings["session_file"] = session_file
+        _pfr_settings["captcha_solver"] = captcha_solver
+        _cached_session = None
+
+
+def _solve_captcha_headless(session, solver):
+    """
+    Проходит капчу без окна Tk с помощью функции `solver`.
+
+    :return: Сессия, если капча пройдена, иначе `None`.
+    """
+    captcha_url = f"{_pfr_settings['base_url']}/api/captcha/img"
+    check_url = f"{_pfr_settings['base_url']}/checkSnils"
+    for _ in range(HEADLESS_CAPTCHA_ATTEMPTS):
+        response = session.get(captcha_url, timeout=request_timeout("pfr"))
+        if response.status_code != 200:
+            logger.info("Не удалось получить изображение капчи.")
+            continue
+        captcha_check = session.post(check_url, data={'captcha-response': solver(response.content)},
+                                     timeout=request_timeout("pfr"))
+        if captcha_check.status_code == 200 and 'Проверка пользователя' not in captcha_check.text:
+            logger.info("Проверка пользователя пройдена.")
+            return session
+        logger.info("Требуется дополнительная проверка.")
+    return None
+
+class _MainThreadCall:
+    """
+    Действие с интерфейсом, выполняемое в главном потоке Tk, и его результат для рабочего потока.
+    """
+
+    def __init__(self):
+        self.result = None
+        self.close = None
+        self._done = threading.Event()
+
+    def done(self, result=None):
+        self.result = result
+        self._done.set()
+
+    def wait(self, interval: float) -> bool:
+        return self._done.wait(interval)
+
+
+def _call_on_main_thread(root, func: Callable[[_MainThreadCall], None]):
+    """
+    Выполняет `func(call)` в главном потоке Tk через `root.after` и ждет, пока она не вызовет `call.done(result)`.
+
+    Рабочий поток не трогает виджеты, а только ждет результат. Ожидание прерывает отмена текущего
+    запуска: тогда окно закрывается функцией `call.close` (если она задана), а результат — `None`.
+    """
+    call = _MainThreadCall()
+
+    def run():
+        try:
+            func(call)
+        except Exception as e:
+            logger.error("Ошибка окна капчи: %s", e)
+            call.done(None)
+
+    root.after(0, run)
+    while not call.wait(CANCEL_POLL_INTERVAL):
+        if cancel_requested():
+            if call.close is not None:
+                root.after(0, call.close)
+            return None
+    return call.result
+
+
+def _show_message(root, show: Callable[[str, str], Any], title: str, message: str):
+    """Показывает `messagebox` в главном потоке Tk и ждет, пока пользователь его закроет."""
+    _call_on_main_thread(root, lambda call: call.done(show(title, message)))
+
+
+def _ask_captcha(root, image_bytes: bytes, timeout: int) -> Optional[str]:
+    """
+    Открывает окно ввода капчи в главном потоке Tk и ждет ответа пользователя.
+
+    :return: Введенный текст или `None`, если окно закрыто, истек `timeout` (мс) или запуск отменен.
+    """
+    def build(call):
+        img = ImageTk.PhotoImage(Image.open(BytesIO(image_bytes)))
+
+        captcha_window = tk.Toplevel(root)
+        captcha_window.title("Введите капчу")
+        captcha_window.geometry("300x200")
+        captcha_window.resizable(False, False)
+
+        style = ttk.Style()
+        style.configure('TLabel', font=("Arial", 12))
+        style.configure('TButton', padding=10, relief="flat", background="#abb1bf", foreground="#000", font=("Arial", 11), borderwidth=0)
+        style.configure('TEntry', font=("Arial", 12))
+
+        frame = ttk.Frame(captcha_window, padding="5")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        label = ttk.Label(frame, image=img)
+        label.image = img
+        label.pack(pady=(0, 10))
+
+        entry = ttk.Entry(frame)
+        entry.pack(pady=(0, 5), fill=tk.X)
+
+        def finish(result):
+            if captcha_window.winfo_exists():
+                captcha_window.destroy()
+            call.done(result)
+
+        def submit_captcha():
+            captcha_response = entry.get()
+            if not captcha_response:
+                messagebox.showwarning("Ошибка", "Пожалуйста, введите капчу.")
+                return
+            finish(captcha_response)
+
+        def close_captcha_window():
+            logger.info("Окно капчи закрыто вручную, по тайм-ауту или при отмене запуска.")
+            finish(None)
+
+        submit_button = ttk.Button(frame, text="Отправить", command=submit_captcha)
+        submit_button.pack(pady=(0), fill=tk.X)
+
+        captcha_window.after(timeout, close_captcha_window)
+        captcha_window.protocol("WM_DELETE_WINDOW", close_captcha_window)
+        captcha_window.grab_set()
+        call.close = close_captcha_window
+
+    return _call_on_main_thread(root, build)
+
+
+@timed("captcha_wait", "Ожидание ввода капчи ПФР")
 def captcha(session, root, timeout=30000):
     """
-    Создает окно для ввода капчи и проверяет введенную капчу.
+    Запрашивает капчу у пользователя и проверяет введенный ответ.
+
+    Окно капчи и сообщения создаются в главном потоке Tk (`root.after`); рабочий поток только загружает
+    изображение, ждет ответа и отправляет его в ПФР.
 
     :param session: Объект сессии `requests.Session` для выполнения HTTP-запросов.
     :param root: Корневое окно Tkinter, используемое для создания окна капчи.
     :param timeout: Время (в миллисекундах) до автоматического закрытия окна капчи.
-    :return: `True`, если капча была успешно пройдена, иначе `False`.
-    """
-    captcha_url = 'https://es.pfrf.ru/api/captcha/img'
-    check_url = 'https://es.pfrf.ru/checkSnils'
-
-    def create_captcha_window():
-        response = session.get(captcha_url)
-        if response.status_code == 200:
-            image = Image.open(BytesIO(response.content))
-            img = ImageTk.PhotoImage(image)
-            
-            captcha_window = tk.Toplevel(root)
-            captcha_window.title("Введите капчу")
-            captcha_window.geometry("300x200")
-            captcha_window.resizable(False, False)
-
-            style = ttk.Style()
-            style.configure('TLabel', font=("Arial", 12))
-            style.configure('TButton', padding=10, relief="flat", background="#abb1bf", foreground="#000", font=("Arial", 11), borderwidth=0)
-            style.configure('TEntry', font=("Arial", 12))
-            
-            frame = ttk.Frame(captcha_window, padding="5")
-            frame.pack(fill=tk.BOTH, expand=True)
-
-            label = ttk.Label(frame, image=img)
-            label.image = img
-            label.pack(pady=(0, 10))
-
-            entry = ttk.Entry(frame)
-            entry.pack(pady=(0, 5), fill=tk.X) 
-
-            def submit_captcha():
-                captcha_response = entry.get()
-                if not captcha_response:
-                    messagebox.showwarning("Ошибка", "Пожалуйста, введите капчу.")
-                    return
-
-                captcha_data = {'captcha-response': captcha_response}
-                captcha_check = session.post(check_url, data=captcha_data)
-                
-                if captcha_check.status_code == 200:
-                    if 'Проверка пользователя' in captcha_check.text:
-                        logger.info("Требуется дополнительная проверка.")
-                        messagebox.showinfo("Проверка", "Требуется дополнительная проверка.")
-                        captcha_window.destroy()
-                        captcha_window.result = False
-                    else:
-                        logger.info("Проверка пользователя пройдена.")
-                        captcha_window.result = True  
-                        captcha_window.destroy()
-                else:
-                    logger.info("Ошибка при проверке капчи.")
-                    messagebox.showerror("Ошибка", "Ошибка при проверке капчи.")
-                    captcha_window.result = False 
-                    captcha_window.destroy()
-
-            submit_button = ttk.Button(frame, text="Отправить", command=submit_captcha)
-            submit_button.pack(pady=(0), fill=tk.X)
-
-            captcha_window.after(timeout, lambda: close_captcha_window(captcha_window))
-
-            captcha_window.protocol("WM_DELETE_WINDOW", lambda: close_captcha_window(captcha_window))
+    :return: Сессия, если капча пройдена; `None`, если запуск отменен (окно открывается заново, пока капча
+             не пройдена, но отмена и срок запуска проверяются перед каждым открытием).
+    """
+    if _pfr_settings["captcha_solver"] is not None:
+        return _solve_captcha_headless(session, _pfr_settings["captcha_solver"])
 
-            captcha_window.grab_set()
-            root.wait_window(captcha_window)
+    captcha_url = f"{_pfr_settings['base_url']}/api/captcha/img"
+    check_url = f"{_pfr_settings['base_url']}/checkSnils"
 
-            return captcha_window.result
-        else:
+    def try_captcha():
+        response = session.get(captcha_url, timeout=request_timeout("pfr"))
+        if response.status_code != 200:
             logger.info("Не удалось получить изображение капчи.")
-            messagebox.showerror("Ошибка", "Не удалось получить изображение капчи.")
+            _show_message(root, messagebox.showerror, "Ошибка", "Не удалось получить изображение капчи.")
             return False
 
-    def close_captcha_window(captcha_window):
-        logger.info("Окно капчи закрыто вручную или по тайм-ауту.")
-        captcha_window.result = False
-        captcha_window.destroy()
+        captcha_response = _ask_captcha(root, response.content, timeout)
+        if captcha_response is None:
+            return False
 
-    while True:
-        result = create_captcha_window()
-        if result:
+        captcha_check = session.post(check_url, data={'captcha-response': captcha_response},
+                                     timeout=request_timeout("pfr"))
+        if captcha_check.status_code == 200:
+            if 'Проверка пользователя' in captcha_check.text:
+                logger.info("Требуется дополнительная проверка.")
+                _show_message(root, messagebox.showinfo, "Проверка", "Требуется дополнительная проверка.")
+                return False
+            logger.info("Проверка пользователя пройдена.")
+            return True
+        logger.info("Ошибка при проверке капчи.")
+        _show_message(root, messagebox.showerror, "Ошибка", "Ошибка при проверке капчи.")
+        return False
+
+    while not cancel_requested():
+        if try_captcha():
             return session
+    logger.info("Ввод капчи прерван: запуск отменен.")
+    return None
 
 def save_session(session, filename):
     """
@@ -118,61 +253,140 @@ def load_session(filename):
     with open(filename, 'rb') as f:
         return pickle.load(f)
 
+def _get_session():
+    """
+    Возвращает сессию процесса: из памяти, из файла сессии или новую.
+    """
+    global _cached_session
+    with _session_lock:
+        if _cached_session is None:
+            try:
+                _cached_session = load_session(_pfr_settings["session_file"])
+                logger.info('Сессия загружена')
+            except (FileNotFoundError, EOFError):
+                logger.info("Сессия не найдена. Создаем новую.")
+                _cached_session = requests.Session()
+        return _cached_session
+
+
 def check_user(root):
     """
     Проверяет пользователя, загружает сессию или создает новую, если требуется.
 
+    После первой загрузки сессия хранится в памяти и переиспользуется следующими вызовами, в том числе
+    из других потоков и регионов. Капчу проходит один поток; остальные ждут его и после этого проверяют
+    сессию заново.
+
     :param root: Корневое окно Tkinter, используемое для отображения окна капчи.
     :return: Объект сессии `requests.Session` после проверки пользователя и прохождения капчи.
     """
-    try:
-        session = load_session('session.pkl')
-        logger.info('Сессия загружена')
-    except (FileNotFoundError, EOFError):
-        logger.info("Сессия не найдена. Создаем новую.")
-        session = requests.Session()
-
-    check_url = 'https://es.pfrf.ru/checkSnils'
-    check_response = session.get(check_url)
+    global _cached_session
+    session = _get_session()
+
+    check_url = f"{_pfr_settings['base_url']}/checkSnils"
+    check_response = session.get(check_url, timeout=request_timeout("pfr"))
     
     if 'Проверка пользователя' in check_response.text:
-        logger.info("Необходима проверка пользователя.")
-        session = captcha(session, root)
-        if session:
-            save_session(session, 'session.pkl')
-        else:
-            logger.info("Не удалось пройти капчу. Сессия не сохранена.")
+        with _captcha_lock:
+            # Пока поток ждал блокировку, капчу мог пройти другой поток.
+            check_response = session.get(check_url, timeout=request_timeout("pfr"))
+            if 'Проверка пользователя' in check_response.text:
+                logger.info("Необходима проверка пользователя.")
+                solved = captcha(session, root)
+                if solved:
+                    save_session(solved, _pfr_settings["session_file"])
+                else:
+                    logger.info("Не удалось пройти капчу. Сессия не сохранена.")
+                    with _session_lock:
+                        if _cached_session is session:
+                            _cached_session = None
+                return solved
+            logger.info("Проверка пользователя пройдена в другом потоке. Продолжаем.")
     else:
         logger.info("Проверка пользователя не требуется. Продолжаем.")
-    
     return session
 
+def _check_payload(snils_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "userData[nameLast]": snils_data["surname"],
+        "userData[nameFirst]": snils_data["name"],
+        "userData[patronymic]": snils_data["patrName"],
+        "userData[birthDate]": snils_data["birthDate"],
+        "userData[snils]": snils_data["snils"],
+        "simpleCheck": True
+    }
+
+
+def _exchange_key(payload: Dict[str, Any]) -> str:
+    """Ключ запроса проверки в архиве ответов: данные пациента без служебных полей."""
+    return json.dumps({key: value for key, value in payload.items() if key.startswith("userData")},
+                      ensure_ascii=False, sort_keys=True)
+
+
+def _is_final_response(response) -> bool:
+    """Ответ антиспама (9107) и ошибки сервера не сохраняются: при повторе запрос может пройти."""
+    if response.status_code != 200:
+        return False
+    try:
+        return response.json().get("error") != 9107
+    except ValueError:
+        return False
+
+
+def is_check_recorded(snils_data: Dict[str, Any]) -> bool:
+    """
+    Будет ли ответ на проверку выдан из архива ответов без обращения к ПФР (режим `replay`).
+
+    :param snils_data: Данные для проверки, как у `update_cookies_and_post`.
+    """
+    return is_recorded(KIND_PFR, _exchange_key(_check_payload(snils_data)))
+
+
+@timed("pfr_check", "Запрос проверки СНИЛС в ПФР")
 def update_cookies_and_post(snils_data: Dict[str, Any], root) -> bool:
     """
     Отправляет данные для проверки СНИЛС и обновляет куки.
 
+    В режимах `record`/`replay` (см. `replay.configure_replay`) окончательные ответы ПФР сохраняются
+    в архив или выдаются из него без сети и капчи. Все запросы к ПФР ограничены тайм-аутом `timeouts.pfr`;
+    истекший тайм-аут, как и другая сетевая ошибка, дает результат `False`.
+
     :param snils_data: Словарь с данными для проверки, содержащий ключи "surname", "name", "patrName", "birthDate", "snils".
     :param root: Корневое окно Tkinter, используемое для создания окна капчи.
     :return: ФИО пользователя, если проверка успешна, иначе `False`.
     """
-    session = check_user(root)
-
-    check_ss = 'https://es.pfrf.ru/api/service_checkSnils'
+    replaying = replay_mode() == MODE_REPLAY
+    check_ss = f"{_pfr_settings['base_url']}/api/service_checkSnils"
+    payload = _check_payload(snils_data)
 
-    payload = {
-        "userData[nameLast]": snils_data["surname"],
-        "userData[nameFirst]": snils_data["name"],
-        "userData[patronymic]": snils_data["patrName"],
-        "userData[birthDate]": snils_data["birthDate"],
-        "userData[snils]": snils_data["snils"],
-        "simpleCheck": True
-    }
+    try:
+        # При воспроизведении из архива сессия и капча не нужны.
+        session = None if replaying else check_user(root)
+        if session is None and not replaying:
+            logger.error("Нет сессии для проверки СНИЛС: проверка пользователя не пройдена.")
+            return False
 
-    check_response = session.post(url=check_ss, data=payload)
+        check_response = exchange(
+            KIND_PFR, _exchange_key(payload),
+            lambda: session.post(url=check_ss, data=payload, timeout=request_timeout("pfr")),
+            cacheable=_is_final_response, url=check_ss,
+        )
+    except ReplayMissError as e:
+        logger.error("%s", e)
+        return False
+    except requests.Timeout as e:
+        logger.error("Истек тайм-аут запроса к ПФР: %s", e)
+        report_transient_error("тайм-аут ПФР")
+        return False
+    except requests.RequestException as e:
+        logger.error("Ошибка соединения с ПФР: %s", e)
+        report_transient_error(f"ПФР: {e}")
+        return False
 
 
     if check_response.status_code == 200 and check_response.json().get("error") == 9107:
         logger.info("Антиспам проверка не пройдена.")
+        report_transient_error("антиспам ПФР (9107)")
     elif check_response.status_code == 200 and check_response.json().get("error") == 5624:
         logger.info("СНИЛС задан некорректно.")
     elif check_response.status_code == 200 and check_response.json().get("data", {}).get("isValid"):
@@ -180,4 +394,6 @@ def update_cookies_and_post(snils_data: Dict[str, Any], root) -> bool:
         return check_response.json().get("data", {}).get("personFIO")
     else: 
         logger.error("Ошибка запроса или неверные данные.")
+        if check_response.status_code == 429 or check_response.status_code >= 500:
+            report_transient_error(f"ПФР: HTTP {check_response.status_code}")
         return False
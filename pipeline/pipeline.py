@@ -0,0 +1,666 @@
+import contextvars
+import heapq
+import os
+import queue
+import random
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Hashable, Iterable, List, Optional, Tuple
+from tpdoc.tpdoc import fetch_document
+from tp.check_patient import check_patient_data, estimate_check_cost, COST_DUPLICATE, COST_LOCAL, COST_NAMES, COST_PFR
+from samplexml.xml import render_xml
+from xmlcheck.xmlcheck import validate_xml
+from signature.sign import sign_file, build_curl_command, DEFAULT_JAVA_PATH, DEFAULT_JAR_PATH
+from uidinput.uidinput import UidDeduplicator, find_snils_duplicates
+from docstore.docstore import load_document
+from logging_excel.log import input_positions
+from metrics import metrics
+from profiling.profiling import profile_run
+from cancellation.cancellation import CancelToken, CANCEL_REASONS, current_token, new_batch_token, take_transient_error
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = {"fetch": 4, "check": 1, "render": 2, "validate": 1, "sign": 2}
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_FETCH_INTERVAL = 1.0
+REMAINING_UIDS_FILE = 'remaining_uids.txt'
+DEFAULT_GROUP_RUN = 50
+
+_STOP = object()
+
+metrics.registry.describe("check_cost", "Документы стадии проверки по ожидаемой стоимости")
+
+
+class PipelineItem:
+    """
+    Единица работы конвейера: один локальный UID и результаты пройденных стадий.
+    """
+
+    def __init__(self, index: int, local_uid: str):
+        self.index = index
+        self.local_uid = local_uid
+        self.started = time.monotonic()
+        self.finished = None
+        self.failed_stage = None
+        # Временная ошибка, из-за которой элемент отсеян (сеть, тайм-аут, антиспам ПФР), или None.
+        self.transient_error = None
+        self.result = None
+        self.xml_file = None
+        self.signed_file = None
+        self.curl_command = None
+        self.document = None
+
+
+class LatencyStats:
+    """
+    Накопитель времени выполнения с ограниченной выборкой для расчета перцентилей.
+
+    Память не зависит от количества замеров: хранится не более `max_samples` значений.
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.max_samples = max_samples
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            if len(self._samples) < self.max_samples:
+                self._samples.append(value)
+            else:
+                position = random.randrange(self.count)
+                if position < self.max_samples:
+                    self._samples[position] = value
+
+    def summary(self) -> dict:
+        """
+        :return: Словарь с количеством замеров, средним, медианой, 95-м перцентилем и максимумом (в секундах).
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            if not samples:
+                return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            return {
+                "count": self.count,
+                "mean": self.total / self.count,
+                "p50": samples[int(0.50 * (len(samples) - 1))],
+                "p95": samples[int(0.95 * (len(samples) - 1))],
+                "max": self.max,
+            }
+
+
+class RateLimiter:
+    """
+    Ограничивает частоту вызовов: не чаще одного раза в `interval` секунд для всех потоков вместе.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if delay:
+            time.sleep(delay)
+
+
+class Stage:
+    """
+    Стадия конвейера.
+
+    :param name: Имя стадии (используется в отчете и логах).
+    :param func: Функция, принимающая `PipelineItem` и возвращающая `True`, если элемент передается дальше.
+    :param workers: Количество рабочих потоков стадии.
+    :param classify: Функция `classify(item) -> (стоимость, группа)`; если задана, входная очередь стадии
+                     выдает элементы по стоимости (см. `CostQueue`), иначе — в порядке поступления.
+    :param expensive_cost: Стоимость, начиная с которой элемент считается дорогим (см. `CostQueue`).
+    """
+
+    def __init__(self, name: str, func: Callable[[PipelineItem], bool], workers: int = 1,
+                 classify: Optional[Callable[[PipelineItem], Tuple[int, Hashable]]] = None, expensive_cost: int = 0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.classify = classify
+        self.expensive_cost = expensive_cost
+
+
+class CostQueue:
+    """
+    Входная очередь стадии, выдающая сначала дешевые элементы.
+
+    Стоимость и группа элемента определяются функцией `classify` при постановке в очередь, то есть
+    в потоках предыдущей стадии. Дешевые элементы (стоимость меньше `expensive_cost`) выдаются первыми,
+    по возрастанию стоимости и в порядке поступления. Дорогие выдаются в порядке поступления групп,
+    но подряд по группе: пока в очереди есть элементы группы предыдущего дорогого элемента, выдаются
+    они, не больше `group_run` подряд, чтобы одна группа не задерживала остальные.
+
+    Дешевые и дорогие элементы ограничены `maxsize` каждые, поэтому дешевые элементы не вытесняют
+    из очереди запас дорогих. Признак остановки выдается после всех элементов. Порядок выдачи не меняет
+    `PipelineItem.index`, по которому результаты сопоставляются с входным списком.
+
+    :param maxsize: Предел дешевых и (отдельно) дорогих элементов в очереди.
+    :param classify: Функция `classify(item) -> (стоимость, группа)`.
+    :param expensive_cost: Стоимость, начиная с которой элемент считается дорогим.
+    :param group_run: Сколько дорогих элементов одной группы выдается подряд.
+    """
+
+    def __init__(self, maxsize: int, classify: Callable[[Any], Tuple[int, Hashable]], expensive_cost: int,
+                 group_run: int = DEFAULT_GROUP_RUN):
+        self.maxsize = max(1, maxsize)
+        self.classify = classify
+        self.expensive_cost = expensive_cost
+        self.group_run = max(1, group_run)
+        self._condition = threading.Condition()
+        self._cheap = []
+        self._groups = OrderedDict()
+        self._expensive = 0
+        self._last_group = None
+        self._run = 0
+        self._stops = 0
+        self._sequence = 0
+
+    def put(self, item):
+        if item is _STOP:
+            with self._condition:
+                self._stops += 1
+                self._condition.notify_all()
+            return
+        cost, group = self.classify(item)
+        expensive = cost >= self.expensive_cost
+        with self._condition:
+            while (self._expensive if expensive else len(self._cheap)) >= self.maxsize:
+                self._condition.wait()
+            if expensive:
+                self._groups.setdefault(group, deque()).append(item)
+                self._expensive += 1
+            else:
+                heapq.heappush(self._cheap, (cost, self._sequence, item))
+                self._sequence += 1
+            self._condition.notify_all()
+
+    def _next_expensive(self):
+        group = self._last_group
+        if group in self._groups and self._run < self.group_run:
+            self._run += 1
+        else:
+            if group in self._groups:
+                self._groups.move_to_end(group)
+            group = next(iter(self._groups))
+            self._run = 1
+        items = self._groups[group]
+        item = items.popleft()
+        if not items:
+            del self._groups[group]
+        self._last_group = group
+        self._expensive -= 1
+        return item
+
+    def get(self):
+        with self._condition:
+            while True:
+                if self._cheap:
+                    item = heapq.heappop(self._cheap)[2]
+                elif self._expensive:
+                    item = self._next_expensive()
+                elif self._stops:
+                    self._stops -= 1
+                    return _STOP
+                else:
+                    self._condition.wait()
+                    continue
+                self._condition.notify_all()
+                return item
+
+
+class Pipeline:
+    """
+    Конвейер стадий, связанных ограниченными очередями.
+
+    Каждый элемент переходит на следующую стадию сразу после завершения предыдущей. Если очередь следующей
+    стадии заполнена, поток текущей стадии ждет (обратное давление), поэтому в памяти одновременно находится
+    не больше `queue_size` элементов на стадию.
+
+    После отмены запуска (`cancel_token`) новые UID не читаются, а элементы из очередей снимаются
+    без обработки и передаются в `on_item_cancelled`; начатые вызовы стадий завершаются как обычно.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = DEFAULT_QUEUE_SIZE,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 on_item_done: Optional[Callable[[PipelineItem], None]] = None,
+                 stage_callback: Optional[Callable[[str, PipelineItem], None]] = None,
+                 cancel_token: Optional[CancelToken] = None,
+                 on_item_cancelled: Optional[Callable[[PipelineItem], None]] = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.progress_callback = progress_callback
+        self.on_item_done = on_item_done
+        self.stage_callback = stage_callback
+        self.cancel_token = cancel_token or current_token.get() or CancelToken()
+        self.on_item_cancelled = on_item_cancelled
+        self.stage_stats = {stage.name: LatencyStats() for stage in stages}
+        self.latency = LatencyStats()
+        self.failed = {stage.name: 0 for stage in stages}
+        self.completed = 0
+        self.processed = 0
+        self.cancelled = 0
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _finish(self, item: PipelineItem):
+        item.finished = time.monotonic()
+        self.latency.add(item.finished - item.started)
+        with self._lock:
+            self.processed += 1
+            if item.failed_stage:
+                self.failed[item.failed_stage] += 1
+            else:
+                self.completed += 1
+            processed = self.processed
+        self._notify(self.on_item_done, item)
+        self._notify(self.progress_callback, processed, self._total)
+
+    def _cancel(self, item: PipelineItem):
+        with self._lock:
+            self.cancelled += 1
+        self._notify(self.on_item_cancelled, item)
+
+    @staticmethod
+    def _notify(callback: Optional[Callable], *args):
+        """
+        Вызывает функцию обратного вызова, если она задана. Ошибка в ней записывается в лог и не
+        останавливает рабочий поток: иначе стадия не передала бы сигнал остановки следующей
+        и `run` не завершился бы.
+        """
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error("Ошибка в функции обратного вызова %s: %s", getattr(callback, "__name__", callback), e)
+
+    def _start_stage(self, position: int, queues: List[queue.Queue]) -> List[threading.Thread]:
+        stage = self.stages[position]
+        in_queue = queues[position]
+        out_queue = queues[position + 1] if position + 1 < len(self.stages) else None
+        next_workers = self.stages[position + 1].workers if out_queue else 0
+        stats = self.stage_stats[stage.name]
+        remaining = [stage.workers]
+        remaining_lock = threading.Lock()
+
+        def process(item):
+            if self.cancel_token.cancelled:
+                self._cancel(item)
+                return
+            started = time.monotonic()
+            take_transient_error()
+            try:
+                passed = stage.func(item)
+            except Exception as e:
+                logger.error("Ошибка на стадии %s для local_uid %s: %s", stage.name, item.local_uid, e)
+                passed = False
+            stats.add(time.monotonic() - started)
+            transient_error = take_transient_error()
+            if not passed:
+                item.failed_stage = stage.name
+                item.transient_error = transient_error
+            if self.stage_callback:
+                self._notify(self.stage_callback, stage.name, item)
+
+            if not passed:
+                self._finish(item)
+            elif out_queue is not None:
+                out_queue.put(item)
+            else:
+                self._finish(item)
+
+        def worker():
+            try:
+                while True:
+                    item = in_queue.get()
+                    if item is _STOP:
+                        break
+                    try:
+                        process(item)
+                    except Exception as e:
+                        logger.error("Ошибка обработки local_uid %s на стадии %s: %s", item.local_uid, stage.name, e)
+            finally:
+                # Сигнал остановки передается дальше в любом случае, иначе `run` ждал бы потоки вечно.
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for _ in range(next_workers):
+                        out_queue.put(_STOP)
+
+        threads = []
+        for number in range(stage.workers):
+            context = contextvars.copy_context()
+            thread = threading.Thread(target=context.run, args=(worker,), name=f"{stage.name}-{number + 1}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def run(self, local_uids: Iterable[str], total: int = 0) -> dict:
+        """
+        Пропускает локальные UID через все стадии и дожидается завершения.
+
+        :param local_uids: Итерируемый набор локальных UID; пустые строки пропускаются.
+        :param total: Общее количество UID для индикатора прогресса.
+        :return: Отчет о выполнении (см. `format_report`).
+        """
+        self._total = total
+        started = time.monotonic()
+        queues = [
+            CostQueue(self.queue_size, stage.classify, stage.expensive_cost) if stage.classify
+            else queue.Queue(maxsize=self.queue_size)
+            for stage in self.stages
+        ]
+        threads = []
+        # Рабочие потоки наследуют признак отмены и по нему ограничивают тайм-ауты вызовов сроком запуска.
+        token_reset = current_token.set(self.cancel_token)
+        try:
+            for position in range(len(self.stages)):
+                threads.extend(self._start_stage(position, queues))
+        finally:
+            current_token.reset(token_reset)
+
+        for index, local_uid in enumerate(local_uids, start=1):
+            local_uid = local_uid.strip()
+            if not local_uid:
+                continue
+            item = PipelineItem(index, local_uid)
+            if self.cancel_token.cancelled:
+                self._cancel(item)
+                break
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_STOP)
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.monotonic() - started
+        return {
+            "processed": self.processed,
+            "completed": self.completed,
+            "failed": dict(self.failed),
+            "cancelled": self.cancelled,
+            "cancel_reason": self.cancel_token.reason,
+            "elapsed": elapsed,
+            "throughput": self.processed / elapsed if elapsed else 0.0,
+            "latency": self.latency.summary(),
+            "stages": {name: stats.summary() for name, stats in self.stage_stats.items()},
+        }
+
+
+def format_report(report: dict) -> str:
+    """
+    Форматирует отчет конвейера в виде текстовой таблицы.
+
+    :param report: Отчет, возвращаемый `Pipeline.run`.
+    :return: Многострочный текст отчета.
+    """
+    lines = [
+        f"Обработано: {report['processed']}, дошло до конца: {report['completed']}, "
+        f"время: {report['elapsed']:.1f} с, пропускная способность: {report['throughput']:.2f} UID/с",
+        f"{'Стадия':<10}{'Кол-во':>8}{'Отсев':>8}{'Сред, с':>10}{'p50, с':>10}{'p95, с':>10}{'Макс, с':>10}",
+    ]
+    rows = list(report["stages"].items()) + [("итого", report["latency"])]
+    for name, stats in rows:
+        failed = report["failed"].get(name, sum(report["failed"].values()))
+        lines.append(
+            f"{name:<10}{stats['count']:>8}{failed:>8}{stats['mean']:>10.3f}"
+            f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['max']:>10.3f}"
+        )
+    if report.get("snils_skipped"):
+        lines.append(
+            f"Не выгружались как дубликаты по СНИЛС ранее выгруженных документов: {report['snils_skipped']}"
+            + (f", список: {report['snils_skipped_file']}" if report.get("snils_skipped_file") else "")
+        )
+    if report.get("cancel_reason"):
+        lines.append(
+            f"Запуск остановлен ({CANCEL_REASONS.get(report['cancel_reason'], report['cancel_reason'])}), "
+            f"не обработано: {report['cancelled']}"
+            + (f", оставшиеся UID: {report['remaining_file']}" if report.get("remaining_file") else "")
+        )
+    return '\n'.join(lines)
+
+
+def get_pipeline_config(config, region_name) -> dict:
+    """
+    Возвращает настройки конвейера региона: раздел `pipeline` конфигурации,
+    дополненный разделом `pipeline` самого региона (если он задан).
+
+    :param config: Конфигурационный словарь.
+    :param region_name: Имя региона из раздела `regions` конфигурации.
+    :return: Словарь настроек конвейера с заполненным `workers`.
+    """
+    pipeline_config = config.get("pipeline", {})
+    region_pipeline_config = config["regions"][region_name].get("pipeline", {})
+    return {
+        **pipeline_config,
+        **region_pipeline_config,
+        "workers": {**DEFAULT_WORKERS, **pipeline_config.get("workers", {}), **region_pipeline_config.get("workers", {})},
+    }
+
+
+def build_stages(config, region_name, root, mpi_mismatch_errors=True, workspace=None,
+                 deduplicator: Optional[UidDeduplicator] = None) -> List[Stage]:
+    """
+    Создает стадии отсева повторов, выгрузки, проверки, формирования XML, проверки XML и подписи для указанного региона.
+
+    Стадия `dedupe` выполняется в одном потоке до любой сетевой работы: нормализует UID и отсеивает
+    повторы UID и известные заранее дубликаты по СНИЛС (см. `uidinput.UidDeduplicator`).
+    Стадия `validate` не пропускает к подписи XML, не прошедшие проверку (см. `xmlcheck.validate_xml`).
+
+    Стадия `check` по умолчанию берет документы не в порядке поступления, а по ожидаемой стоимости
+    (`tp.check_patient.estimate_check_cost`): сначала дубликаты, локальные ошибки и ответы из архива,
+    затем запросы к ПФР, сгруппированные по организации. Документ читается один раз при постановке
+    в очередь. Параметр `cost_scheduling: false` раздела `pipeline` возвращает порядок поступления.
+
+    Количество потоков каждой стадии задается в разделе `pipeline` конфигурации (см. `get_pipeline_config`),
+    пути к Java и JAR подписи — в разделе `signing`.
+
+    :param config: Конфигурационный словарь.
+    :param region_name: Имя региона из раздела `regions` конфигурации.
+    :param root: Корневое окно Tkinter, используемое для окна капчи.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :param workspace: Каталог, в котором создаются папки `data` и `work` (по умолчанию текущий).
+    :param deduplicator: Фильтр повторов; если не задан, создается новый без сведений о СНИЛС.
+    :return: Список стадий в порядке выполнения.
+    """
+    region_config = config["regions"][region_name]
+    pipeline_config = get_pipeline_config(config, region_name)
+    signing_config = config.get("signing", {})
+    workers = pipeline_config["workers"]
+
+    base_url = region_config.get("api_endpoint")
+    region_id = region_config.get("region_id")
+    properties_file = region_config["properties"]
+    address_url_curl = region_config.get("adress_url_curl")
+    java_path = signing_config.get("java_path", DEFAULT_JAVA_PATH)
+    jar_path = signing_config.get("jar_path", DEFAULT_JAR_PATH)
+
+    workspace = workspace or os.getcwd()
+    data_directory = os.path.join(workspace, 'data')
+    outdata_directory = os.path.join(workspace, 'work')
+    os.makedirs(outdata_directory, exist_ok=True)
+
+    cost_scheduling = pipeline_config.get("cost_scheduling", True)
+    rate_limiter = RateLimiter(pipeline_config.get("fetch_interval", DEFAULT_FETCH_INTERVAL))
+    deduplicator = deduplicator or UidDeduplicator()
+
+    def dedupe(item):
+        local_uid = deduplicator.check(item.local_uid)
+        if local_uid is None:
+            return False
+        item.local_uid = local_uid
+        positions = input_positions.get()
+        if positions is not None:
+            positions[local_uid] = item.index
+        return True
+
+    def fetch(item):
+        rate_limiter.wait()
+        return fetch_document(base_url, item.local_uid, data_directory) is not None
+
+    # Стоимость и группа первого документа каждого СНИЛС: следующие документы с тем же СНИЛС получают
+    # те же значения и потому выдаются после него, как и без планировщика. Иначе дешевый дубликат
+    # проверялся бы первым и считался оригиналом.
+    snils_costs = {}
+    snils_costs_lock = threading.Lock()
+
+    def classify_check(item):
+        try:
+            with metrics.timer("json_parse", "Чтение и разбор JSON документа"):
+                item.document = load_document(os.path.join(data_directory, f"{item.local_uid}.json"))
+            cost, organization_code = estimate_check_cost(item.document, mpi_mismatch_errors)
+            if cost != COST_DUPLICATE:
+                with snils_costs_lock:
+                    cost, organization_code = snils_costs.setdefault(
+                        item.document['patient']['snils'], (cost, organization_code))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # Проверка сразу завершится ошибкой и запишет ее в лог.
+            cost, organization_code = COST_LOCAL, None
+        metrics.registry.inc("check_cost", COST_NAMES[cost])
+        return cost, organization_code
+
+    def check(item):
+        document, item.document = item.document, None
+        item.result = check_patient_data(os.path.join(data_directory, f"{item.local_uid}.json"), root,
+                                         mpi_mismatch_errors, document)
+        return bool(item.result)
+
+    def render(item):
+        item.xml_file = render_xml(item.result, item.local_uid, region_id, outdata_directory)
+        positions = input_positions.get()
+        if positions is not None and item.xml_file:
+            # Проверка XML и подпись пишут в Excel-лог путь файла, а не UID.
+            positions[item.xml_file] = item.index
+        return item.xml_file is not None
+
+    def validate(item):
+        return validate_xml(item.xml_file, config)
+
+    def sign(item):
+        item.signed_file = sign_file(item.xml_file, properties_file, java_path, jar_path)
+        if item.signed_file and address_url_curl:
+            item.curl_command = build_curl_command(item.signed_file, address_url_curl)
+        return item.signed_file is not None
+
+    logger.info("Стадии конвейера для региона %s, потоки: %s", region_name, workers)
+    return [
+        Stage("dedupe", dedupe, 1),
+        Stage("fetch", fetch, workers["fetch"]),
+        Stage("check", check, workers["check"], classify_check if cost_scheduling else None, COST_PFR),
+        Stage("render", render, workers["render"]),
+        Stage("validate", validate, workers["validate"]),
+        Stage("sign", sign, workers["sign"]),
+    ]
+
+
+def run_pipeline(config, region_name, local_uids, root, mpi_mismatch_errors=True, progress_callback=None, total=0,
+                 workspace=None, curl_file='curl_commands.txt', stage_callback=None,
+                 cancel_token: Optional[CancelToken] = None):
+    """
+    Выполняет полный цикл обработки (выгрузка → проверка → формирование XML → подпись) в потоковом режиме.
+
+    Команды curl записываются в `curl_file` по мере подписания файлов, поэтому расход памяти
+    не зависит от размера пакета. Если `local_uids` можно прочитать повторно (например, `UidSource`),
+    перед запуском один раз сканируется папка `data`, и UID с уже выгруженными документами-дубликатами
+    по СНИЛС отсеиваются до выгрузки. Их количество попадает в отчет (`snils_skipped`), а сами UID —
+    в `snils_skipped_uids.txt` каталога `workspace`.
+
+    Запуск можно остановить признаком `cancel_token` (по умолчанию — признак текущего запуска или новый
+    со сроком `timeouts.batch_deadline`). Тогда уже начатые элементы завершаются, а необработанные UID,
+    в том числе еще не прочитанные из `local_uids`, записываются в `remaining_uids.txt` каталога
+    `workspace`, чтобы продолжить с них следующий запуск.
+
+    :param config: Конфигурационный словарь.
+    :param region_name: Имя региона из раздела `regions` конфигурации.
+    :param local_uids: Итерируемый набор локальных UID; читается лениво.
+    :param root: Корневое окно Tkinter, используемое для окна капчи.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :param progress_callback: Функция обратного вызова для отслеживания прогресса.
+    :param total: Общее количество UID для индикатора прогресса.
+    :param workspace: Каталог для папок `data` и `work` (по умолчанию текущий).
+    :param curl_file: Файл, в который записываются команды curl.
+    :param stage_callback: Функция `stage_callback(stage, item)`, вызываемая после обработки стадией каждого элемента.
+    :param cancel_token: Признак отмены запуска.
+    :return: Отчет конвейера (количество подписанных файлов — `completed`, таблица замеров операций
+             запуска — `metrics_summary`).
+    """
+    curl_lock = threading.Lock()
+    # После отмены в очередях остается не больше `queue_size` элементов на стадию.
+    cancelled_uids = []
+    cancel_token = cancel_token or current_token.get() or new_batch_token(config)
+    metrics_start = metrics.snapshot()
+    data_directory = os.path.join(workspace or os.getcwd(), 'data')
+    snils_duplicates = {}
+    if iter(local_uids) is not local_uids:
+        snils_duplicates = find_snils_duplicates(local_uids, data_directory)
+    deduplicator = UidDeduplicator(snils_duplicates)
+
+    # Стадия проверки выдает дешевые документы раньше дорогих, поэтому строки Excel-лога идут не в порядке
+    # ввода; номер UID во входном списке записывается в колонку 'Index'.
+    positions_reset = input_positions.set({})
+    try:
+        with open(curl_file, 'w', encoding='utf-8') as curl_output, profile_run(config, f"pipeline-{region_name}") as session:
+            def on_item_done(item):
+                if item.curl_command:
+                    with curl_lock:
+                        curl_output.write(item.curl_command + '\n')
+
+            stages = build_stages(config, region_name, root, mpi_mismatch_errors, workspace, deduplicator)
+            if session:
+                session.wrap_stages(stages)
+
+            logger.info("Запуск конвейера для региона %s", region_name)
+            pipeline = Pipeline(
+                stages,
+                queue_size=get_pipeline_config(config, region_name).get("queue_size", DEFAULT_QUEUE_SIZE),
+                progress_callback=progress_callback,
+                on_item_done=on_item_done,
+                stage_callback=stage_callback,
+                cancel_token=cancel_token,
+                on_item_cancelled=lambda item: cancelled_uids.append(item.local_uid),
+            )
+            uid_iterator = iter(local_uids)
+            report = pipeline.run(uid_iterator, total)
+        deduplicator.flush()
+        report["snils_skipped"] = len(deduplicator.snils_skipped)
+        report["snils_skipped_file"] = deduplicator.write_snils_skipped(workspace or os.getcwd())
+
+        if report["cancel_reason"]:
+            remaining_file = os.path.join(workspace or os.getcwd(), REMAINING_UIDS_FILE)
+            with open(remaining_file, 'w', encoding='utf-8') as f:
+                for local_uid in cancelled_uids:
+                    f.write(local_uid + '\n')
+                for local_uid in uid_iterator:
+                    local_uid = local_uid.strip()
+                    if local_uid:
+                        f.write(local_uid + '\n')
+                        report["cancelled"] += 1
+            report["remaining_file"] = remaining_file
+            logger.warning("Необработанные UID (%s) записаны в %s", report["cancelled"], remaining_file)
+
+        logger.info("Конвейер завершен:\n%s", format_report(report))
+        report["metrics_summary"] = metrics.export(metrics_start, f"Замеры операций конвейера региона {region_name}")
+        return report
+    finally:
+        input_positions.reset(positions_reset)
@@ -0,0 +1,317 @@
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from metrics.metrics import registry, RESULT_OK, RESULT_FAIL, RESULT_ERROR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILING_CONFIG = {
+    "enabled": False,
+    "stages": ["fetch", "check", "render", "validate", "sign"],
+    "cprofile": True,
+    "tracemalloc": True,
+    "tracemalloc_frames": 10,
+    "output_dir": "profiles",
+    "top": 30,
+}
+
+# Начиная с Python 3.12 cProfile работает через sys.monitoring: одновременно может быть
+# включен только один профилировщик, и он видит вызовы во всех потоках.
+_GLOBAL_PROFILER = sys.version_info >= (3, 12)
+
+# Сессия текущего запуска. Рабочие потоки конвейера наследуют ее через copy_context, поэтому
+# одновременные запуски (например, регионы в multiregion) не видят сессии друг друга.
+_active_session = contextvars.ContextVar("profiling_session", default=None)
+
+# tracemalloc один на процесс: его включает первая сессия, которой он нужен, а выключает последняя.
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def get_profiling_config(config) -> dict:
+    """
+    :return: Раздел `profiling` конфигурации, дополненный значениями по умолчанию.
+    """
+    return {**DEFAULT_PROFILING_CONFIG, **(config or {}).get("profiling", {})}
+
+
+class StageTiming:
+    """
+    Время стадии: количество вызовов, реальное время и процессорное время потока.
+
+    Если процессорное время много меньше реального, стадия ждет (сеть, капча, JVM), а не считает.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+
+class ProfilingSession:
+    """
+    Профилирование одного запуска: cProfile, tracemalloc и замеры подписи.
+
+    По окончании в `output_dir` сохраняются `<name>-<время>.prof` (открывается `pstats`, snakeviz и т.п.)
+    и текстовый отчет `<name>-<время>.txt`: самые затратные функции, время стадий, вызовы JVM
+    подписи и самые крупные места выделения памяти.
+
+    :param settings: Раздел `profiling` конфигурации (см. `DEFAULT_PROFILING_CONFIG`).
+    :param name: Имя запуска в именах файлов.
+    """
+
+    def __init__(self, settings: dict, name: str):
+        self.settings = settings
+        self.name = name
+        self.stages = {}
+        self.subprocesses = []
+        self.started = None
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._thread_profilers = []
+        self._thread_local = threading.local()
+        self._tracemalloc_started = False
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.settings["cprofile"] and _GLOBAL_PROFILER:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profiler = profiler
+            except ValueError:
+                logger.warning("cProfile уже используется другим запуском, профиль %s не будет собран", self.name)
+        if self.settings["tracemalloc"]:
+            self._tracemalloc_started = _acquire_tracemalloc(self.settings["tracemalloc_frames"])
+        logger.info("Профилирование запуска %s включено", self.name)
+
+    def wrap_stage(self, stage_name: str, func: Callable) -> Callable:
+        """
+        Оборачивает функцию стадии конвейера, если стадия выбрана в настройках `stages`.
+
+        Для каждой стадии учитываются реальное и процессорное время; на Python до 3.12, где cProfile
+        работает в пределах потока, вызовы стадии профилируются профилировщиком своего потока.
+        """
+        if stage_name not in self.settings["stages"]:
+            return func
+        timing = self.stages.setdefault(stage_name, StageTiming())
+
+        def profiled(item):
+            profiler = self._thread_profiler() if self.settings["cprofile"] and not _GLOBAL_PROFILER else None
+            wall, cpu = time.perf_counter(), time.thread_time()
+            if profiler:
+                profiler.enable()
+            try:
+                return func(item)
+            finally:
+                if profiler:
+                    profiler.disable()
+                with self._lock:
+                    timing.calls += 1
+                    timing.wall += time.perf_counter() - wall
+                    timing.cpu += time.thread_time() - cpu
+
+        profiled.__name__ = getattr(func, "__name__", stage_name)
+        return profiled
+
+    def wrap_stages(self, stages: list) -> list:
+        """
+        Оборачивает функции всех выбранных стадий конвейера (`pipeline.Stage`) на месте.
+
+        :return: Тот же список стадий.
+        """
+        for stage in stages:
+            stage.func = self.wrap_stage(stage.name, stage.func)
+        return stages
+
+    def _thread_profiler(self) -> cProfile.Profile:
+        profiler = getattr(self._thread_local, "profiler", None)
+        if profiler is None:
+            profiler = self._thread_local.profiler = cProfile.Profile()
+            with self._lock:
+                self._thread_profilers.append(profiler)
+        return profiler
+
+    def record_subprocess(self, command: List[str], seconds: float, returncode: Optional[int]):
+        with self._lock:
+            self.subprocesses.append((seconds, returncode, command[-2] if len(command) > 1 else ' '.join(command)))
+
+    def stop(self) -> Optional[str]:
+        """
+        Останавливает профилирование и сохраняет артефакты.
+
+        :return: Путь к текстовому отчету или `None`, если сохранить не удалось.
+        """
+        if self._profiler:
+            self._profiler.disable()
+        tracing = self.settings["tracemalloc"] and tracemalloc.is_tracing()
+        allocations = tracemalloc.take_snapshot() if tracing else None
+        traced = tracemalloc.get_traced_memory() if tracing else None
+        if self._tracemalloc_started:
+            _release_tracemalloc()
+            self._tracemalloc_started = False
+        elapsed = time.perf_counter() - self.started
+
+        output_dir = self.settings["output_dir"]
+        base = os.path.join(output_dir, f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}")
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            stats = self._collect_stats()
+            if stats:
+                stats.dump_stats(base + ".prof")
+            with open(base + ".txt", 'w', encoding='utf-8') as f:
+                f.write(self._format_report(stats, allocations, traced, elapsed))
+        except OSError as e:
+            logger.error("Не удалось сохранить результаты профилирования %s: %s", base, e)
+            return None
+        logger.info("Результаты профилирования сохранены: %s.txt", base)
+        return base + ".txt"
+
+    def _collect_stats(self) -> Optional[pstats.Stats]:
+        profilers = ([self._profiler] if self._profiler else []) + self._thread_profilers
+        stats = None
+        for profiler in profilers:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                # Профилировщик потока, в котором не было ни одного вызова.
+                continue
+        return stats
+
+    def _format_report(self, stats, allocations, traced, elapsed) -> str:
+        top = self.settings["top"]
+        out = io.StringIO()
+        out.write(f"Профиль запуска {self.name}, длительность {elapsed:.1f} с\n\n")
+
+        if self.stages:
+            out.write(f"{'Стадия':<12}{'вызовы':>8}{'реальное, с':>14}{'CPU, с':>10}{'CPU, %':>8}\n")
+            for stage_name, timing in self.stages.items():
+                share = 100 * timing.cpu / timing.wall if timing.wall else 0
+                out.write(f"{stage_name:<12}{timing.calls:>8}{timing.wall:>14.2f}{timing.cpu:>10.2f}{share:>8.0f}\n")
+            out.write("\n")
+
+        if self.subprocesses:
+            durations = sorted(seconds for seconds, _, _ in self.subprocesses)
+            failed = sum(1 for _, returncode, _ in self.subprocesses if returncode != 0)
+            out.write(f"Запуски JVM подписи: {len(durations)}, ошибок {failed}, "
+                      f"всего {sum(durations):.1f} с, медиана {durations[len(durations) // 2]:.2f} с, "
+                      f"максимум {durations[-1]:.2f} с\n")
+            for seconds, returncode, target in sorted(self.subprocesses, reverse=True)[:10]:
+                out.write(f"    {seconds:8.2f} с  код {returncode}  {target}\n")
+            out.write("\n")
+
+        if stats:
+            out.write(f"Самые затратные функции (по суммарному времени), топ {top}:\n")
+            stats.stream = out
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+        if allocations:
+            current, peak = traced
+            out.write(f"Память (tracemalloc): сейчас {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ\n")
+            out.write(f"Крупнейшие места выделения памяти, топ {top}:\n")
+            allocations = allocations.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            for statistic in allocations.statistics("traceback")[:top]:
+                out.write(f"{statistic.size / 1024:10.1f} КБ в {statistic.count} блоках\n")
+                for line in statistic.traceback.format(limit=3):
+                    out.write(f"    {line}\n")
+        return out.getvalue()
+
+
+def _acquire_tracemalloc(frames: int) -> bool:
+    """
+    Включает tracemalloc для сессии (если он еще не включен) и учитывает ее среди пользователей.
+
+    :return: `True`, если сессия учтена и должна вызвать `_release_tracemalloc`.
+    """
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            if tracemalloc.is_tracing():
+                # Включен вне профилирования (например, -X tracemalloc): не трогаем его.
+                return False
+            tracemalloc.start(frames)
+        _tracemalloc_users += 1
+        return True
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+@contextmanager
+def profile_run(config, name: str, force: bool = False):
+    """
+    Включает профилирование на время запуска, если оно разрешено в разделе `profiling` конфигурации
+    (или `force`). Без профилирования возвращает `None` и ничего не замеряет.
+
+    Пример::
+
+        with profile_run(config, "pipeline-Region_1") as session:
+            ...
+
+    :param config: Конфигурационный словарь.
+    :param name: Имя запуска в именах файлов результатов.
+    :param force: Включить независимо от настройки `enabled`.
+    """
+    settings = get_profiling_config(config)
+    if not (settings["enabled"] or force):
+        yield None
+        return
+
+    session = ProfilingSession(settings, name)
+    session.start()
+    session_reset = _active_session.set(session)
+    try:
+        yield session
+    finally:
+        _active_session.reset(session_reset)
+        session.stop()
+
+
+def run_timed(command: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """
+    `subprocess.run` с замером длительности.
+
+    Длительность попадает в метрику `sign_subprocess` и, если идет профилирование, в отчет запуска.
+
+    :param command: Команда и аргументы.
+    :param kwargs: Аргументы `subprocess.run`.
+    :return: Результат `subprocess.run`.
+    """
+    registry.describe("sign_subprocess", "Процесс JVM подписи")
+    started = time.perf_counter()
+    returncode = None
+    try:
+        result = subprocess.run(command, **kwargs)
+        returncode = result.returncode
+        return result
+    finally:
+        seconds = time.perf_counter() - started
+        result_label = RESULT_ERROR if returncode is None else RESULT_OK if returncode == 0 else RESULT_FAIL
+        registry.observe("sign_subprocess", seconds, result_label)
+        logger.debug("Процесс %s завершился за %.2f с с кодом %s", command[0], seconds, returncode)
+        session = _active_session.get()
+        if session is not None:
+            session.record_subprocess(command, seconds, returncode)
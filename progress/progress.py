@@ -0,0 +1,163 @@
+import queue
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_MS = 100
+
+
+class StageProgress:
+    """
+    Состояние прогресса одной стадии. Изменяется только в главном потоке Tk.
+    """
+
+    def __init__(self, name: str, total: int, started: float):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = started
+        self.finished = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Средняя скорость стадии, элементов в секунду."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени в секундах или `None`, если оценить нельзя."""
+        rate = self.rate
+        if not rate or not self.total or self.finished:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def format(self) -> str:
+        """
+        :return: Строка вида «Выгрузка: 120/1000 (12%), 15.2 /с, осталось 0:58».
+        """
+        text = f"{self.name}: {self.done}"
+        if self.total:
+            text += f"/{self.total} ({100 * self.done / self.total:.0f}%)"
+        text += f", {self.rate:.1f} /с"
+        if self.finished:
+            text += f", завершено за {_format_seconds(self.elapsed)}"
+        elif self.eta is not None:
+            text += f", осталось {_format_seconds(self.eta)}"
+        return text
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressChannel:
+    """
+    Канал прогресса между рабочими потоками и интерфейсом Tk.
+
+    Рабочие потоки только кладут события в очередь (`begin`, `advance`, `finish`, `call`) и никогда
+    не обращаются к виджетам. Главный поток Tk разбирает очередь через `after()` с фиксированным
+    интервалом и перерисовывает интерфейс не чаще одного раза за интервал, сколько бы событий ни пришло.
+    `call` позволяет выполнить в главном потоке любое действие с интерфейсом, например `messagebox`.
+
+    :param interval_ms: Интервал обновления интерфейса в миллисекундах.
+    """
+
+    def __init__(self, interval_ms: int = DEFAULT_INTERVAL_MS):
+        self.interval_ms = interval_ms
+        self.stages: Dict[str, StageProgress] = {}
+        self._events = queue.SimpleQueue()
+
+    def begin(self, stage: str, total: int):
+        """Начинает (или перезапускает) стадию с общим количеством `total`."""
+        self._events.put(("begin", stage, total, time.monotonic()))
+
+    def advance(self, stage: str, done: Optional[int] = None):
+        """Отмечает продвижение стадии: на единицу или до значения `done`."""
+        self._events.put(("advance", stage, done))
+
+    def finish(self, stage: str):
+        """Отмечает завершение стадии."""
+        self._events.put(("finish", stage, time.monotonic()))
+
+    def clear(self):
+        """Убирает все стадии из отображения."""
+        self._events.put(("clear",))
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Выполняет `func(*args, **kwargs)` в главном потоке Tk."""
+        self._events.put(("call", func, args, kwargs))
+
+    def callback(self, stage: str) -> Callable[[int, int], None]:
+        """
+        Возвращает функцию `progress_callback(current, total)` для существующих функций обработки,
+        которая передает прогресс в стадию `stage`.
+        """
+        def progress_callback(current, total):
+            self.advance(stage, current)
+        return progress_callback
+
+    def drain(self) -> bool:
+        """
+        Применяет все накопленные события. Вызывается только из главного потока Tk.
+
+        :return: `True`, если состояние стадий изменилось.
+        """
+        changed = False
+        calls = []
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            kind = event[0]
+            if kind == "begin":
+                _, stage, total, started = event
+                self.stages[stage] = StageProgress(stage, total, started)
+            elif kind == "advance":
+                _, stage, done = event
+                progress = self.stages.get(stage)
+                if progress is None:
+                    progress = self.stages[stage] = StageProgress(stage, 0, time.monotonic())
+                progress.done = progress.done + 1 if done is None else done
+            elif kind == "finish":
+                _, stage, finished = event
+                if stage in self.stages:
+                    self.stages[stage].finished = finished
+            elif kind == "clear":
+                self.stages.clear()
+            elif kind == "call":
+                calls.append(event[1:])
+            changed = changed or kind != "call"
+
+        for func, args, kwargs in calls:
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error("Ошибка при выполнении действия интерфейса %s: %s", func, e)
+        return changed
+
+    def attach(self, root, on_update: Callable[[List[StageProgress]], None]):
+        """
+        Запускает периодический разбор очереди в главном цикле Tk.
+
+        :param root: Корневое окно Tkinter.
+        :param on_update: Функция, получающая список стадий; вызывается только при изменениях,
+                          а для активных стадий — каждый интервал (чтобы обновлялись скорость и оценка времени).
+        """
+        def pump():
+            changed = self.drain()
+            active = any(progress.finished is None for progress in self.stages.values())
+            if changed or active:
+                on_update(list(self.stages.values()))
+            root.after(self.interval_ms, pump)
+
+        root.after(self.interval_ms, pump)
@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+from metrics.metrics import registry, RESULT_OK, RESULT_FAIL
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+MODES = (MODE_OFF, MODE_RECORD, MODE_REPLAY)
+
+KIND_GATEWAY = "gateway"
+KIND_PFR = "pfr"
+
+DEFAULT_REPLAY_CONFIG = {
+    "mode": MODE_OFF,
+    "archive": "replay.sqlite",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exchanges (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    recorded REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+_state = {"mode": MODE_OFF, "archive": None}
+
+registry.describe("replay_exchange", "Ответы из архива (fail — ответа нет в архиве)")
+
+
+class ReplayMissError(requests.exceptions.ConnectionError):
+    """В архиве нет ответа на запрос, а в режиме воспроизведения сеть не используется."""
+
+
+class RecordedResponse:
+    """
+    Ответ из архива с той частью интерфейса `requests.Response`, которой пользуются
+    `send_get_request` и `update_cookies_and_post`.
+    """
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} (из архива) для {self.url}", response=self)
+
+
+class ReplayArchive:
+    """
+    Архив HTTP-ответов в файле SQLite: ключ — вид запроса и его параметры, значение — код ответа
+    и тело, сжатое zlib.
+
+    В режиме воспроизведения весь архив один раз загружается в память (тела остаются сжатыми
+    и распаковываются при выдаче), поэтому ответы выдаются без обращения к диску и сети.
+
+    :param path: Путь к файлу архива.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory: Optional[Dict[Tuple[str, str], Tuple[int, bytes]]] = None
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA busy_timeout = 30000")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self) -> int:
+        """
+        Загружает архив в память для воспроизведения.
+
+        :return: Количество ответов в архиве.
+        """
+        rows = self._connect().execute("SELECT kind, key, status, body FROM exchanges").fetchall()
+        with self._lock:
+            self._memory = {(kind, key): (status, body) for kind, key, status, body in rows}
+        return len(rows)
+
+    def get(self, kind: str, key: str, url: str = "") -> Optional[RecordedResponse]:
+        if self._memory is not None:
+            entry = self._memory.get((kind, key))
+        else:
+            entry = self._connect().execute(
+                "SELECT status, body FROM exchanges WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        if entry is None:
+            return None
+        status, body = entry
+        return RecordedResponse(url, status, zlib.decompress(body))
+
+    def __contains__(self, entry: Tuple[str, str]) -> bool:
+        if self._memory is not None:
+            return entry in self._memory
+        return self._connect().execute(
+            "SELECT 1 FROM exchanges WHERE kind = ? AND key = ?", entry
+        ).fetchone() is not None
+
+    def put(self, kind: str, key: str, status: int, content: bytes):
+        """Сохраняет ответ; повторная запись того же запроса заменяет прежний ответ."""
+        body = zlib.compress(content, 6)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO exchanges (kind, key, status, body, recorded) VALUES (?, ?, ?, ?, ?)",
+            (kind, key, status, body, time.time()),
+        )
+        if self._memory is not None:
+            with self._lock:
+                self._memory[(kind, key)] = (status, body)
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: Словарь «вид запроса → (количество ответов, размер сжатых тел в байтах)».
+        """
+        rows = self._connect().execute(
+            "SELECT kind, COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM exchanges GROUP BY kind ORDER BY kind"
+        ).fetchall()
+        return {kind: (count, size) for kind, count, size in rows}
+
+
+def configure_replay(replay_config: Optional[dict] = None, mode: Optional[str] = None):
+    """
+    Настраивает запись и воспроизведение по разделу `replay` конфигурации (см. `DEFAULT_REPLAY_CONFIG`).
+
+    - `record` — запросы выполняются как обычно, а ответы шлюза и ПФР сохраняются в архив;
+    - `replay` — ответы выдаются из архива без обращения к сети и без капчи; запросы,
+      которых нет в архиве, считаются неудавшимися;
+    - `off` — архив не используется.
+
+    :param replay_config: Раздел `replay` конфигурации.
+    :param mode: Режим, переопределяющий `mode` из конфигурации (например, из ключа командной строки).
+    """
+    settings = {**DEFAULT_REPLAY_CONFIG, **(replay_config or {})}
+    mode = mode or settings["mode"]
+    if mode not in MODES:
+        logger.error("Неизвестный режим записи ответов: %s. Запись и воспроизведение отключены.", mode)
+        mode = MODE_OFF
+    archive = None
+    if mode != MODE_OFF:
+        try:
+            archive = ReplayArchive(settings["archive"])
+            if mode == MODE_REPLAY:
+                count = archive.load()
+                logger.info("Воспроизведение ответов из архива %s: %s ответов", settings["archive"], count)
+            else:
+                logger.info("Запись ответов шлюза и ПФР в архив %s", settings["archive"])
+        except sqlite3.Error as e:
+            logger.error("Не удалось открыть архив ответов %s: %s", settings["archive"], e)
+            mode = MODE_OFF
+    _state["archive"] = archive
+    _state["mode"] = mode
+
+
+def replay_mode() -> str:
+    return _state["mode"]
+
+
+def is_recorded(kind: str, key: str) -> bool:
+    """
+    :return: `True`, если в режиме воспроизведения ответ на запрос будет выдан из архива без сети.
+    """
+    return _state["mode"] == MODE_REPLAY and (kind, key) in _state["archive"]
+
+
+def exchange(kind: str, key: str, perform: Callable[[], requests.Response],
+             cacheable: Optional[Callable[[requests.Response], bool]] = None, url: str = ""):
+    """
+    Выполняет HTTP-запрос с учетом режима записи и воспроизведения.
+
+    :param kind: Вид запроса (`KIND_GATEWAY`, `KIND_PFR`).
+    :param key: Ключ запроса в архиве, например URL или параметры проверки.
+    :param perform: Функция, выполняющая настоящий запрос.
+    :param cacheable: Нужно ли сохранять ответ; например, ответ антиспама ПФР сохранять нельзя.
+    :param url: URL для сообщений об ошибках воспроизведенного ответа.
+    :return: Ответ сервера или ответ из архива.
+    :raises ReplayMissError: В режиме воспроизведения ответа нет в архиве.
+    """
+    mode = _state["mode"]
+    archive = _state["archive"]
+    if mode == MODE_REPLAY:
+        response = archive.get(kind, key, url)
+        registry.inc("replay_exchange", RESULT_OK if response is not None else RESULT_FAIL)
+        if response is None:
+            raise ReplayMissError(f"Нет записанного ответа ({kind}) для {key}")
+        return response
+
+    response = perform()
+    if mode == MODE_RECORD and (cacheable is None or cacheable(response)):
+        try:
+            archive.put(kind, key, response.status_code, response.content)
+        except sqlite3.Error as e:
+            logger.error("Не удалось записать ответ (%s) %s в архив: %s", kind, key, e)
+    return response
+
+
+def main(argv=None):
+    """
+    Сведения об архиве ответов.
+
+    Пример::
+
+        python -m replay.replay replay.sqlite
+    """
+    parser = argparse.ArgumentParser(description="Архив ответов шлюза и ПФР")
+    parser.add_argument("archive", nargs="?", default=DEFAULT_REPLAY_CONFIG["archive"])
+    args = parser.parse_args(argv)
+
+    stats = ReplayArchive(args.archive).stats()
+    if not stats:
+        print("Архив пуст")
+    for kind, (count, size) in stats.items():
+        print(f"{kind:<10}{count:>10} ответов {size / 2**20:>10.1f} МБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
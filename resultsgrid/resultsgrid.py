@@ -0,0 +1,366 @@
+import queue
+import logging
+import tkinter as tk
+from tkinter import ttk
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_ALL = "Все"
+STATUS_IN_PROGRESS = "В работе"
+STATUS_DONE = "Готово"
+STATUS_ERROR = "Ошибка"
+STATUS_DUPLICATE = "Дубликат"
+STATUSES = [STATUS_ALL, STATUS_IN_PROGRESS, STATUS_DONE, STATUS_ERROR, STATUS_DUPLICATE]
+
+# Листы Excel-лога, запись на которых означает успешный результат по UID.
+SUCCESS_SHEETS = {'Подписанные файлы', 'Созданные файлы и их дубли'}
+# Листы, которые не несут сведений о конкретном UID или дублируют другие листы.
+IGNORED_SHEETS = {'Все документы', 'Созданные файлы', 'Странно'}
+
+COLUMNS = (
+    ("position", "№", 60),
+    ("local_uid", "Local UID", 280),
+    ("stage", "Стадия", 90),
+    ("status", "Статус", 90),
+    ("sheet", "Лист", 160),
+    ("message", "Сообщение", 320),
+    ("output", "Файл", 260),
+)
+
+DEFAULT_INTERVAL_MS = 200
+
+
+class ResultRow:
+    """
+    Строка таблицы результатов: одно значение на колонку из `COLUMNS`.
+    """
+    __slots__ = ("position", "local_uid", "stage", "status", "sheet", "message", "output")
+
+    def __init__(self, local_uid: str):
+        self.position = ""
+        self.local_uid = local_uid
+        self.stage = ""
+        self.status = STATUS_IN_PROGRESS
+        self.sheet = ""
+        self.message = ""
+        self.output = ""
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, name) for name, _, _ in COLUMNS)
+
+
+class ResultsModel:
+    """
+    Хранилище результатов обработки по каждому local_uid.
+
+    Рабочие потоки вызывают только `update` и `on_excel_log`, которые кладут изменения в очередь.
+    Изменения применяются в главном потоке Tk в `drain`, поэтому виджеты никогда не трогаются
+    из рабочих потоков. Строки хранятся в списке в порядке появления, индекс «UID → номер строки»
+    дает обновление за O(1), количество строк по статусам ведется инкрементально, а отфильтрованное
+    представление — это список номеров строк.
+    """
+
+    def __init__(self):
+        self.rows: List[ResultRow] = []
+        self.index: Dict[str, int] = {}
+        self.outputs: Dict[str, int] = {}
+        self.counts: Dict[str, int] = dict.fromkeys(STATUSES[1:], 0)
+        self.status_filter = STATUS_ALL
+        self.search = ""
+        self.visible: Optional[List[int]] = None
+        self.on_change = None
+        self._updates = queue.SimpleQueue()
+
+    def update(self, local_uid: str, **fields):
+        """
+        Обновляет (или создает) строку `local_uid`. Можно вызывать из любого потока.
+
+        :param local_uid: Локальный UID.
+        :param fields: Значения колонок: `position` (номер UID во входном списке), `stage`, `status`, `sheet`,
+                       `message`, `output`.
+        """
+        self._updates.put((local_uid, None, fields))
+
+    def on_excel_log(self, sheet_name, data):
+        """
+        Слушатель Excel-лога (см. `logging_excel.log.add_listener`): переносит лист и сообщение в строку UID.
+
+        Записи о проверке XML и подписи ведутся по пути файла, поэтому они сопоставляются со строкой по имени
+        XML-файла и применяются только к уже известным строкам.
+        """
+        if sheet_name in IGNORED_SHEETS:
+            return
+        status = STATUS_DONE if sheet_name in SUCCESS_SHEETS else STATUS_ERROR
+        for entry in data:
+            if not entry:
+                continue
+            key = str(entry[0])
+            message = "" if len(entry) < 2 or entry[1] is None else str(entry[1])
+            fields = {"sheet": sheet_name, "message": message}
+            if sheet_name == 'json':
+                fields["stage"] = "fetch"
+                if message != "Успешное создание":
+                    fields["status"] = STATUS_ERROR
+            elif sheet_name == 'Созданные файлы и их дубли':
+                fields.update(stage="check", status=STATUS_DONE, output=message.rsplit(' ', 1)[-1])
+            elif sheet_name in ('Подписанные файлы', 'Ошибка подписи', 'Ошибка XML'):
+                fields.update(stage="validate" if sheet_name == 'Ошибка XML' else "sign", status=status)
+                if sheet_name == 'Подписанные файлы':
+                    fields["output"] = key
+                self._updates.put((None, _output_name(key), fields))
+                continue
+            elif sheet_name == 'Дубликаты UID':
+                fields.update(stage="dedupe", status=STATUS_DUPLICATE)
+            else:
+                fields.update(stage="check", status=status)
+            self._updates.put((key, None, fields))
+
+    def clear(self):
+        """Удаляет все строки. Вызывается только из главного потока Tk."""
+        self.rows.clear()
+        self.index.clear()
+        self.outputs.clear()
+        self.counts = dict.fromkeys(STATUSES[1:], 0)
+        self._refilter()
+
+    def drain(self) -> bool:
+        """
+        Применяет накопленные изменения. Вызывается только из главного потока Tk.
+
+        :return: `True`, если таблица изменилась.
+        """
+        changed = False
+        while True:
+            try:
+                local_uid, output_name, fields = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            if local_uid is None:
+                row_number = self.outputs.get(output_name)
+                if row_number is None:
+                    continue
+            else:
+                row_number = self.index.get(local_uid)
+                if row_number is None:
+                    row_number = self.index[local_uid] = len(self.rows)
+                    self.rows.append(ResultRow(local_uid))
+                    self.counts[STATUS_IN_PROGRESS] += 1
+
+            row = self.rows[row_number]
+            status = fields.get("status")
+            if status and status != row.status:
+                self.counts[row.status] -= 1
+                self.counts[status] = self.counts.get(status, 0) + 1
+            output = fields.get("output")
+            if output:
+                self.outputs[_output_name(output)] = row_number
+            for name, value in fields.items():
+                setattr(row, name, value)
+            changed = True
+
+        if changed and self.visible is not None:
+            # Статусы меняются у существующих строк, поэтому фильтр пересчитывается целиком,
+            # но не чаще одного раза за интервал обновления.
+            self._refilter()
+        return changed
+
+    def set_filter(self, status: str = None, search: str = None):
+        """
+        Устанавливает фильтр по статусу и по подстроке UID или сообщения.
+        """
+        if status is not None:
+            self.status_filter = status
+        if search is not None:
+            self.search = search.strip().lower()
+        self._refilter()
+
+    def _refilter(self):
+        status, search = self.status_filter, self.search
+        if status == STATUS_ALL and not search:
+            self.visible = None
+            return
+        self.visible = [
+            number for number, row in enumerate(self.rows)
+            if (status == STATUS_ALL or row.status == status)
+            and (not search or search in row.local_uid.lower() or search in row.message.lower())
+        ]
+
+    def __len__(self):
+        return len(self.rows) if self.visible is None else len(self.visible)
+
+    def row(self, position: int) -> ResultRow:
+        """Возвращает строку по позиции в отфильтрованном представлении."""
+        return self.rows[position if self.visible is None else self.visible[position]]
+
+    def attach(self, root, interval_ms: int = DEFAULT_INTERVAL_MS):
+        """
+        Запускает периодическое применение изменений в главном цикле Tk.
+        После изменений вызывается `on_change` (перерисовка открытой таблицы), если он задан.
+
+        :param root: Корневое окно Tkinter.
+        :param interval_ms: Интервал опроса в миллисекундах.
+        """
+        def pump():
+            if self.drain() and self.on_change:
+                self.on_change()
+            root.after(interval_ms, pump)
+
+        root.after(interval_ms, pump)
+
+
+def _output_name(path: str) -> str:
+    """
+    Приводит путь к XML-файлу или подписанному файлу к имени исходного XML-файла.
+    """
+    name = path.replace('\\', '/').rsplit('/', 1)[-1]
+    return name.replace("-singed.xml", ".xml")
+
+
+class ResultsGrid(ttk.Frame):
+    """
+    Виртуализированная таблица результатов.
+
+    `ttk.Treeview` содержит ровно столько строк, сколько помещается на экране; прокрутка меняет
+    только смещение окна в `ResultsModel`, и видимые строки перезаполняются значениями. Поэтому
+    стоимость перерисовки не зависит от числа UID, а фильтр по статусу применяется мгновенно.
+
+    :param master: Родительский виджет.
+    :param model: Модель результатов.
+    :param height: Количество видимых строк.
+    """
+
+    def __init__(self, master, model: ResultsModel, height: int = 25):
+        super().__init__(master)
+        self.model = model
+        self.height = height
+        self.offset = 0
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(toolbar, text="Статус:").pack(side=tk.LEFT)
+        self.status_combobox = ttk.Combobox(toolbar, state="readonly", values=STATUSES, width=12)
+        self.status_combobox.set(model.status_filter)
+        self.status_combobox.pack(side=tk.LEFT, padx=5)
+        self.status_combobox.bind("<<ComboboxSelected>>", self._on_filter)
+        ttk.Label(toolbar, text="Поиск:").pack(side=tk.LEFT, padx=(10, 0))
+        self.search_var = tk.StringVar(value=model.search)
+        search_entry = ttk.Entry(toolbar, textvariable=self.search_var, width=30)
+        search_entry.pack(side=tk.LEFT, padx=5)
+        search_entry.bind("<Return>", self._on_filter)
+        ttk.Button(toolbar, text="Очистить", command=self._on_clear).pack(side=tk.RIGHT)
+        self.counts_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.counts_var).pack(side=tk.RIGHT, padx=10)
+
+        body = ttk.Frame(self)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(body, columns=[name for name, _, _ in COLUMNS], show="headings",
+                                 height=height, selectmode="browse")
+        for name, title, width in COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, stretch=name == "message")
+        for number in range(height):
+            self.tree.insert("", tk.END, iid=str(number))
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(3))
+        self.tree.bind("<Up>", lambda event: self._on_key(-1))
+        self.tree.bind("<Down>", lambda event: self._on_key(1))
+        self.tree.bind("<Prior>", lambda event: self._on_key(-height))
+        self.tree.bind("<Next>", lambda event: self._on_key(height))
+        self.tree.bind("<Control-c>", self._copy_selection)
+
+        self.refresh()
+
+    def _max_offset(self) -> int:
+        return max(0, len(self.model) - self.height)
+
+    def scroll(self, delta: int):
+        """Сдвигает окно таблицы на `delta` строк."""
+        offset = min(max(0, self.offset + delta), self._max_offset())
+        if offset != self.offset:
+            self.offset = offset
+            self.refresh()
+
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self.offset = min(max(0, int(float(args[0]) * len(self.model))), self._max_offset())
+            self.refresh()
+        elif action == "scroll":
+            count, unit = int(args[0]), args[1]
+            self.scroll(count * (self.height if unit == "pages" else 1))
+
+    def _on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _on_key(self, delta: int):
+        self.scroll(delta)
+        return "break"
+
+    def _on_filter(self, event=None):
+        self.model.set_filter(self.status_combobox.get(), self.search_var.get())
+        self.offset = 0
+        self.refresh()
+
+    def _on_clear(self):
+        self.model.clear()
+        self.offset = 0
+        self.refresh()
+
+    def _copy_selection(self, event=None):
+        selection = self.tree.selection()
+        if selection:
+            self.clipboard_clear()
+            self.clipboard_append('\t'.join(str(value) for value in self.tree.item(selection[0], "values")))
+
+    def refresh(self):
+        """
+        Перезаполняет видимые строки. Вызывается только из главного потока Tk.
+        """
+        total = len(self.model)
+        self.offset = min(self.offset, self._max_offset())
+        for number in range(self.height):
+            position = self.offset + number
+            values = self.model.row(position).values() if position < total else ("",) * len(COLUMNS)
+            self.tree.item(str(number), values=values)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.height) / total))
+        else:
+            self.scrollbar.set(0, 1)
+        self.counts_var.set(f"Показано {total} из {len(self.model.rows)}"
+                            + ''.join(f", {status.lower()}: {count}" for status, count in self.model.counts.items() if count))
+
+
+def open_results_window(root, model: ResultsModel, window: Optional[tk.Toplevel] = None) -> tk.Toplevel:
+    """
+    Открывает окно с таблицей результатов или поднимает уже открытое.
+
+    :param root: Корневое окно Tkinter.
+    :param model: Модель результатов, подключенная через `ResultsModel.attach`.
+    :param window: Ранее открытое окно (если есть).
+    :return: Окно таблицы.
+    """
+    if window is not None and window.winfo_exists():
+        window.lift()
+        return window
+
+    window = tk.Toplevel(root)
+    window.title("Результаты обработки")
+    window.geometry("1200x620")
+    grid = ResultsGrid(window, model)
+    grid.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    model.on_change = grid.refresh
+
+    def on_close():
+        model.on_change = None
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", on_close)
+    return window
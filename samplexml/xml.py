@@ -1,66 +1,45 @@
 import os
 import uuid
 from datetime import datetime
+from xml.sax.saxutils import escape
 from unidecode import unidecode
 import logging
 from tp.check_patient import check_patient_data
-import openpyxl
-from openpyxl import Workbook
 from logging_excel.log import log_message_to_excel
+from metrics.metrics import timed
+from uidinput.uidinput import UidDeduplicator
+from cancellation.cancellation import cancel_requested
 
 logger = logging.getLogger(__name__)
 
-def xml_create(config, region_combobox, local_uid_text, root, progress_callback=None, mpi_mismatch_errors=True):
+def escape_value(value):
    """
-    Генерирует XML-файлы для пациентов на основе конфигурации и данных.
-
-    Выбирает регион из конфигурации и создает XML-файлы для каждого локального UID из текста. Файлы сохраняются 
-    в папку `work`. В случае успешного создания XML файла результат добавляется в Excel-лог. При ошибках 
-    запись добавляется в лог и файл не создается.
-
-    :param config: Конфигурационный файл с настройками.
-    :param region_combobox: Виджет для выбора региона.
-    :param local_uid_text: Виджет с текстом, содержащим локальные UID.
-    :param root: Корневой элемент для обработки данных.
-    :param progress_callback: Функция обратного вызова для отслеживания прогресса (необязательно).
-    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при валидации (по умолчанию True).
-    :return: Список локальных UID, для которых возникли ошибки.
+    Экранирует значение для подстановки в текст элемента или атрибут XML.
    """
-   logger.info("Начало выполнения функции xml_create")
-   try:
-      selected_region = region_combobox.get()
-      selected_region_config = config["regions"][selected_region]
-      region_id = selected_region_config.get("region_id")
+   return escape(str(value), {'"': "&quot;"})
 
-      logger.info(f"Выбранный регион: {selected_region}")
-
-      current_directory = os.getcwd()
-      outdata_directory = os.path.join(current_directory, 'work')
-      if not os.path.exists(outdata_directory):
-            os.makedirs(outdata_directory)
 
+def build_xml(result, region_id):
+   """
+    Формирует текст XML-сообщения PRPA_IN201302RU02 по проверенным данным пациента.
 
-      local_uids = local_uid_text.get("1.0", "end-1c").strip().split('\n')
-      total_uids = len(local_uids)
-      error_local_uids = []
-      successful_count = 0
-      
-      for index, local_uid in enumerate(local_uids, start=1):
-         if local_uid.strip():   
-            logger.info(f"Локальный UID: {local_uid}")
-            if result:= check_patient_data(f"data/{local_uid}.json", root, mpi_mismatch_errors):
-
-               logger.info(f"Проверенные данные пациента: {result}")
+    Значения экранируются (`&`, `<`, `>`, кавычки), поэтому, например, название организации
+    с `&` не делает сообщение некорректным.
 
-               current_datetime = datetime.now()
-               formatted_datetime = current_datetime.strftime("%Y%m%d%H%M%S")
+    :param result: Словарь с проверенными данными пациента, возвращаемый `check_patient_data`.
+    :param region_id: Идентификатор РМИС региона (`region_id` из конфигурации).
+    :return: Текст XML-сообщения.
+   """
+   values = {key: escape_value(value) for key, value in result.items()}
+   current_datetime = datetime.now()
+   formatted_datetime = current_datetime.strftime("%Y%m%d%H%M%S")
 
-               XML = f"""<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" xmlns:a="http://www.w3.org/2005/08/addressing" xmlns:ds="http://www.w3.org/2000/09/xmldsig#" xmlns:urn="urn:hl7-org:v3" xmlns:wsa="http://www.w3.org/2005/08/addressing" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd" xmlns:wsu="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd">
+   XML = f"""<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" xmlns:a="http://www.w3.org/2005/08/addressing" xmlns:ds="http://www.w3.org/2000/09/xmldsig#" xmlns:urn="urn:hl7-org:v3" xmlns:wsa="http://www.w3.org/2005/08/addressing" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd" xmlns:wsu="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd">
          <soap:Header>
             <transportHeader wsu:Id="Id-8D835103-150B-4736-8351-03150B673691" xmlns="http://egisz.rosminzdrav.ru">
                <authInfo>
                <!--Идентификатор РМИС, ниже указан для хмао, для других регионов менять соотвественно-->
-                  <clientEntityId>{region_id}</clientEntityId>
+                  <clientEntityId>{escape_value(region_id)}</clientEntityId>
                </authInfo>
             </transportHeader>
             <!--менять все гуиды начиная с этого-->
@@ -75,7 +54,7 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
          <soap:Body wsu:Id="BodyId-{uuid.uuid4()}">
             <PRPA_IN201302RU02 ITSVersion="XML_1.0" xsi:schemaLocation="urn:hl7-org:v3 ../../../../../../iemk-integration/iemk-integration-ws-api/src/main/resources/integration/schema/HL7V3/NE2008/multicacheschemas/PRPA_IN201302RU02.xsd" xmlns="urn:hl7-org:v3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
       <!--заканчивая этим ниже-->      
-            <id extension="{result['localId']}" root="{result['organizationCode']}"/>
+            <id extension="{values['localId']}" root="{values['organizationCode']}"/>
       <!--указать текущие датувремя в формате ггггммддччммсс-->      
                <creationTime value="{formatted_datetime}"/>
                <interactionId extension="PRPA_IN201302RU02" root="1.2.643.5.1.13.2.7.3"/>
@@ -101,9 +80,9 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
                      <asAgent classCode="ASSIGNED">
                         <representedOrganization classCode="ORG" determinerCode="INSTANCE">
                         <!--указать оид, который выяснили скриптом-->      
-                           <id root="{result['organizationCode']}"/>
+                           <id root="{values['organizationCode']}"/>
                            <!--указать наименование мо, которое выяснили скриптом-->      
-                           <name>{result['organizationDisplayName']}</name>
+                           <name>{values['organizationDisplayName']}</name>
                         </representedOrganization>
                      </asAgent>
                   </device>
@@ -116,24 +95,24 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
                         <subject1 typeCode="SBJ">
                            <patient classCode="PAT">
                            <!--значение extension - указать снилс пациента, root - оид мо  -->      
-                              <id extension="{result['localId']}" root="{result['organizationCode']}"/>
+                              <id extension="{values['localId']}" root="{values['organizationCode']}"/>
                               <statusCode code="active"/>
                               <patientPerson>
                                  <name>
                                  <!--фио пациента-->      
-                                    <family>{result['surname']}</family>
-                                    <given>{result['name']}</given>
-                                    <given>{result['patrName']}</given>
+                                    <family>{values['surname']}</family>
+                                    <given>{values['name']}</given>
+                                    <given>{values['patrName']}</given>
                                  </name>
                                  <telecom value="mailto:qwerty@mail.ru"/>
                                  <!--пол пациента-->
-                                 <administrativeGenderCode code="{result['gender']}" codeSystem="1.2.643.5.1.13.2.1.1.156"/>
+                                 <administrativeGenderCode code="{values['gender']}" codeSystem="1.2.643.5.1.13.2.1.1.156"/>
                                  <!--др пациента-->
-                                 <birthTime value="{result['birthDate'].replace("-", "")}"/>
+                                 <birthTime value="{values['birthDate'].replace("-", "")}"/>
                                  <!--СНИЛС указываем тот, который был предоставлен пользователем-->
                                  <asOtherIDs classCode="IDENT">
                                     <documentType code="3" codeSystem="1.2.643.5.1.13.2.7.1.62"/>
-                                    <documentNumber number="{result['snils']}"/>
+                                    <documentNumber number="{values['snils']}"/>
                                     <scopingOrganization classCode="ORG" determinerCode="INSTANCE">
                                        <id nullFlavor="NI"/>
                                     </scopingOrganization>
@@ -141,9 +120,9 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
                               </patientPerson>
                               <providerOrganization classCode="ORG" determinerCode="INSTANCE">
                               <!--указать оид, который выяснили скриптом-->      
-                                 <id root="{result['organizationCode']}"/>
+                                 <id root="{values['organizationCode']}"/>
                                  <!--указать наименование мо, которое выяснили скриптом-->
-                                 <name>{result['organizationDisplayName']}</name>
+                                 <name>{values['organizationDisplayName']}</name>
                                  <contactParty classCode="CON">
                                     <telecom value="tel:+7-987-456-123"/>
                                  </contactParty>
@@ -153,10 +132,10 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
                         <custodian typeCode="CST">
                            <assignedEntity classCode="ASSIGNED">
                            <!--указать оид, который выяснили скриптом-->      
-                              <id root="{result['organizationCode']}"/>
+                              <id root="{values['organizationCode']}"/>
                               <assignedOrganization classCode="ORG" determinerCode="INSTANCE">
                               <!--указать наименование мо, которое выяснили скриптом-->
-                                 <name>{result['organizationDisplayName']}</name>
+                                 <name>{values['organizationDisplayName']}</name>
                               </assignedOrganization>
                            </assignedEntity>
                         </custodian>
@@ -166,34 +145,109 @@ def xml_create(config, region_combobox, local_uid_text, root, progress_callback=
             </PRPA_IN201302RU02>
          </soap:Body>
       </soap:Envelope>"""
-               
-               
-               patr_name = result.get('patrName', "")
-               first_char = patr_name[0] if patr_name else ""
-
-               complete_name = os.path.join(outdata_directory, f"{unidecode(result.get('surname', f'{local_uid}')+result.get('name', "")[0]+first_char, 'ru').replace(" ", '-').replace("'", "")}.xml")
-               
-               
-               try:
-                  with open(complete_name, "w", encoding="utf-8") as file:
-                     file.write(XML)
-                     logger.info(f"Сгенерирован XML: {unidecode(result.get('surname', f'{local_uid}')+result.get('name', "")[0]+first_char, 'ru').replace(" ", '-').replace("'", "")}.xml")
-                     successful_count += 1
-               except Exception as e:
-                     logger.error("Ошибка генерации XML: %s" % e)
-                     log_message_to_excel('Странно', [(local_uid, f"XML не сгенерирован хотя прошел проверку {unidecode(result.get('surname', f'{local_uid}')+result.get('name', "")[0]+first_char, 'ru').replace(" ", '-').replace("'", "")}.xml")])
-
-               logger.info("Создание XML завершено")
-            else:
-               error_local_uids.append(local_uid)
 
-               if progress_callback:
-                    progress_callback(index, total_uids)
+   return XML
 
-      return error_local_uids
-   
+
+def get_xml_filename(result, local_uid):
+   """
+    Формирует имя XML-файла пациента: фамилия и инициалы в латинской транслитерации.
+
+    :param result: Словарь с проверенными данными пациента.
+    :param local_uid: Локальный UID, используемый вместо фамилии, если она отсутствует.
+    :return: Имя XML-файла.
+   """
+   patr_name = result.get('patrName', "")
+   first_char = patr_name[0] if patr_name else ""
+   return f"{unidecode(result.get('surname', f'{local_uid}')+result.get('name', "")[0]+first_char, 'ru').replace(" ", '-').replace("'", "")}.xml"
+
+
+@timed("xml_render", "Формирование и запись XML")
+def render_xml(result, local_uid, region_id, outdata_directory):
+   """
+    Формирует XML-файл пациента и сохраняет его в папку `outdata_directory`.
+
+    :param result: Словарь с проверенными данными пациента, возвращаемый `check_patient_data`.
+    :param local_uid: Локальный UID документа.
+    :param region_id: Идентификатор РМИС региона.
+    :param outdata_directory: Папка, в которую сохраняется XML-файл.
+    :return: Путь к созданному XML-файлу или `None`, если файл не удалось записать.
+   """
+   XML = build_xml(result, region_id)
+   xml_filename = get_xml_filename(result, local_uid)
+   complete_name = os.path.join(outdata_directory, xml_filename)
+
+   try:
+      with open(complete_name, "w", encoding="utf-8") as file:
+         file.write(XML)
+      logger.info("Сгенерирован XML: %s", xml_filename)
+      return complete_name
    except Exception as e:
-      logger.error(f"Ошибка в функции xml_create: {e}")
-      return []
+      logger.error("Ошибка генерации XML: %s", e)
+      log_message_to_excel('Странно', [(local_uid, f"XML не сгенерирован хотя прошел проверку {xml_filename}")])
+      return None
+
+
+@timed("xml_create", "Проверка и формирование XML по списку UID")
+def xml_create(config, region_combobox, local_uids, root, progress_callback=None, mpi_mismatch_errors=True, total_uids=0):
+   """
+    Генерирует XML-файлы для пациентов на основе конфигурации и данных.
+
+    Выбирает регион из конфигурации и создает XML-файлы для каждого локального UID из текста. Файлы сохраняются 
+    в папку `work`. В случае успешного создания XML файла результат добавляется в Excel-лог. При ошибках 
+    запись добавляется в лог и файл не создается. После отмены запуска оставшиеся UID не обрабатываются.
+
+    :param config: Конфигурационный файл с настройками.
+    :param region_combobox: Виджет для выбора региона.
+    :param local_uids: Итерируемый набор локальных UID (например, `uidinput.UidSource`); читается лениво.
+    :param root: Корневой элемент для обработки данных.
+    :param progress_callback: Функция обратного вызова для отслеживания прогресса (необязательно).
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при валидации (по умолчанию True).
+    :param total_uids: Общее количество UID для индикатора прогресса.
+    :return: Количество локальных UID, для которых возникли ошибки.
+   """
+   logger.info("Начало выполнения функции xml_create")
+   try:
+      selected_region = region_combobox.get()
+      selected_region_config = config["regions"][selected_region]
+      region_id = selected_region_config.get("region_id")
+
+      logger.info("Выбранный регион: %s", selected_region)
+
+      current_directory = os.getcwd()
+      outdata_directory = os.path.join(current_directory, 'work')
+      if not os.path.exists(outdata_directory):
+            os.makedirs(outdata_directory)
 
 
+      error_count = 0
+      deduplicator = UidDeduplicator()
+      successful_count = 0
+      
+      for index, local_uid in enumerate(local_uids, start=1):
+         if cancel_requested():
+            logger.warning("Проверка остановлена: обработано %s из %s UID", index - 1, total_uids)
+            break
+         local_uid = deduplicator.check(local_uid)
+         if local_uid:
+            logger.debug("Локальный UID: %s", local_uid)
+            if result:= check_patient_data(f"data/{local_uid}.json", root, mpi_mismatch_errors):
+
+               logger.debug("Проверенные данные пациента: %s", result)
+
+               if render_xml(result, local_uid, region_id, outdata_directory):
+                  successful_count += 1
+
+               logger.debug("Создание XML завершено")
+            else:
+               error_count += 1
+
+         if progress_callback:
+            progress_callback(index, total_uids)
+
+      deduplicator.flush()
+      return error_count
+   
+   except Exception as e:
+      logger.error("Ошибка в функции xml_create: %s", e)
+      return 0
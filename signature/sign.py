@@ -1,18 +1,27 @@
 import os
-import subprocess
 import logging
-import openpyxl
-from openpyxl import Workbook
+import subprocess
 from typing import List, Optional, Callable
 from logging_excel.log import log_message_to_excel
+from metrics.metrics import timed
+from profiling.profiling import run_timed
+from xmlcheck.xmlcheck import validate_xml
+from cancellation.cancellation import call_timeout, cancel_requested
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_JAVA_PATH = "C:\\Java\\jdk1.8.0_181\\bin\\java.exe"
+DEFAULT_JAR_PATH = "C:\\Distr\\XMLSign_20200115\\xmlfile-sign-1.7.0.jar"
+
 
+@timed("sign_file", "Подпись XML (запуск JVM)")
 def sign_file(file_to_sign: str, properties_file: str, java_path: str, jar_path: str) -> Optional[str]:
     """
     Подписывает указанный XML файл и проверяет успешность подписи.
 
+    Процесс JVM, не завершившийся за `timeouts.sign` секунд (или до срока запуска), останавливается,
+    а файл считается неподписанным.
+
     :param file_to_sign: Путь к XML файлу, который нужно подписать.
     :param properties_file: Путь к файлу настроек.
     :param java_path: Путь к исполняемому файлу Java.
@@ -30,25 +39,45 @@ def sign_file(file_to_sign: str, properties_file: str, java_path: str, jar_path:
             'SOAP12', properties_file, file_to_sign, signed_file
         ]
 
-        logger.info(f"Выполняется команда: {' '.join(command)}")
+        logger.debug("Выполняется команда: %s", command)
 
-        result = subprocess.run(command, capture_output=True, text=True)
+        result = run_timed(command, capture_output=True, text=True, timeout=call_timeout("sign"))
 
         if result.returncode == 0 and "Signature valid" in result.stdout:
-            logger.info(f"Файл успешно подписан: {signed_file}")
+            logger.info("Файл успешно подписан: %s", signed_file)
             log_message_to_excel('Подписанные файлы', [(f'{signed_file}', None)])
             return signed_file
         else:
-            logger.error(f"Ошибка при подписании файла {file_to_sign}: {result.stderr}")
-            logger.error(f"Вывод команды: {result.stdout}")
+            logger.error("Ошибка при подписании файла %s: %s", file_to_sign, result.stderr)
+            logger.error("Вывод команды: %s", result.stdout)
             log_message_to_excel('Ошибка подписи', [(file_to_sign, result.stderr)])
             return None
 
+    except subprocess.TimeoutExpired as e:
+        logger.error("Подпись файла %s не завершилась за %.1f с, процесс остановлен", file_to_sign, e.timeout)
+        log_message_to_excel('Ошибка подписи', [(file_to_sign, f"Тайм-аут подписи ({e.timeout:.1f} с)")])
+        return None
     except Exception as e:
-        logger.error(f"Исключение при подписании файла {file_to_sign}: {e}")
+        logger.error("Исключение при подписании файла %s: %s", file_to_sign, e)
         return None
 
 
+def build_curl_command(signed_file: str, address_url_curl: str) -> str:
+    """
+    Формирует команду curl для отправки подписанного файла.
+
+    :param signed_file: Путь к подписанному XML файлу.
+    :param address_url_curl: Адрес, на который отправляется файл (`adress_url_curl` региона).
+    :return: Команда curl.
+    """
+    signed_file_name = os.path.basename(signed_file)
+    return (
+        f'curl -X POST -H "Content-Type: text/xml;charset=UTF-8" '
+        f'-H \'SOAPAction: "urn:hl7-org:v3:PRPA_IN201302"\' '
+        f'--data-binary @{signed_file_name} -k {address_url_curl}'
+    )
+
+
 def sign_files(config, region_combobox,
     files_to_sign: List[str], 
     properties_file: str, 
@@ -58,6 +87,9 @@ def sign_files(config, region_combobox,
 ) -> List[str]:
     """
     Подписывает несколько файлов и возвращает список команд curl.
+
+    Перед подписью каждый файл проверяется (`xmlcheck.validate_xml`); некорректные файлы не подписываются.
+    После отмены запуска оставшиеся файлы не подписываются.
     :param config: Конфигурационный файл с настройками.
     :param region_combobox: Виджет для выбора региона.
     :param files_to_sign: Список путей к XML файлам для подписи.
@@ -81,22 +113,22 @@ def sign_files(config, region_combobox,
         return False
     
     for index, file in enumerate(files_to_sign, start=1):
+        if cancel_requested():
+            logger.warning("Подпись остановлена: обработано %s из %s файлов", index - 1, total_files)
+            break
         try:
-            signed_file = sign_file(file, properties_file, java_path, jar_path)
+            if not validate_xml(file, config):
+                signed_file = None
+            else:
+                signed_file = sign_file(file, properties_file, java_path, jar_path)
             if signed_file:
                 signed_files.append(signed_file)
-                signed_file_name = os.path.basename(signed_file)
-                curl_command = (
-                    f'curl -X POST -H "Content-Type: text/xml;charset=UTF-8" '
-                    f'-H \'SOAPAction: "urn:hl7-org:v3:PRPA_IN201302"\' '
-                    f'--data-binary @{signed_file_name} -k {address_url_curl}'
-                )
-                curl_commands.append(curl_command)
+                curl_commands.append(build_curl_command(signed_file, address_url_curl))
             else:
-                logger.error(f"Не удалось подписать файл: {file}")
+                logger.error("Не удалось подписать файл: %s", file)
 
         except Exception as e:
-            logger.error(f"Ошибка при подписи файла {file}: {e}")
+            logger.error("Ошибка при подписи файла %s: %s", file, e)
     
         if progress_callback:
             progress_callback(index, total_files)
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from jobqueue import jobqueue
+from pipeline.pipeline import Stage
+
+
+class AbandonedLeaseTest(unittest.TestCase):
+    """Задание аварийно завершившегося обработчика выдается живому обработчику после истечения аренды."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._directory = tempfile.TemporaryDirectory()
+        os.chdir(self._directory.name)
+        self.job_queue = jobqueue.JobQueue(os.path.join(self._directory.name, "jobs.sqlite"), lease_seconds=1)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._directory.cleanup()
+
+    def test_live_worker_picks_up_abandoned_job(self):
+        self.job_queue.enqueue("b1", "Region_1", ["uid-1", "uid-2"])
+        # Обработчик взял задание и «упал»: аренда не продлевается и не завершается.
+        abandoned = self.job_queue.lease("crashed", "Region_1", 1)
+        self.assertEqual([local_uid for _, local_uid in abandoned], ["uid-1"])
+
+        processed = []
+
+        def fake_build_stages(config, region_name, root, mpi_mismatch_errors=True, workspace=None, deduplicator=None):
+            def work(item):
+                processed.append(item.local_uid)
+                return True
+            return [Stage("work", work, 1)]
+
+        config = {"regions": {"Region_1": {}}}
+        started = time.monotonic()
+        with mock.patch.object(jobqueue, "build_stages", fake_build_stages):
+            report = jobqueue.run_worker(config, self.job_queue, "Region_1", None, "live", poll_interval=0.2)
+
+        self.assertEqual(sorted(processed), ["uid-1", "uid-2"])
+        self.assertEqual(report["completed"], 2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+        progress = self.job_queue.progress("b1")
+        self.assertEqual(progress["by_status"], {"done": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,36 @@
-import requests
-import json
 import logging
 import re
 import base64
-from pfrchecksnils.crome import update_cookies_and_post
+from pfrchecksnils.crome import is_check_recorded, update_cookies_and_post
 from logging_excel.log import log_message_to_excel
 from floor.floor import classify_gender
-import openpyxl
-from openpyxl import Workbook
+from multiregion.context import current_region
+from metrics.metrics import timed, timer
+from docstore.docstore import load_document
 import os
+import threading
+import contextvars
+from typing import Optional, Tuple
 from unidecode import unidecode
 
 logger = logging.getLogger(__name__)
-used_snils = []
+used_snils = set()
 snils_results = {}
+_snils_lock = threading.Lock()
+_region_snils = {}
+
+# Ожидаемая стоимость проверки документа (см. `estimate_check_cost`): чем меньше, тем раньше документ
+# выдается стадией проверки конвейера.
+COST_DUPLICATE = 0
+COST_LOCAL = 1
+COST_RECORDED = 2
+COST_PFR = 3
+COST_NAMES = {
+    COST_DUPLICATE: "duplicate",
+    COST_LOCAL: "local",
+    COST_RECORDED: "recorded",
+    COST_PFR: "pfr",
+}
 
 def decode_base64_to_text(encoded_str: str) -> str:
     """
@@ -62,43 +79,181 @@ def extract_oid_name(content):
     return oid, name
 
 
-def check_patient_data(json_filename, root, mpi_mismatch_errors):
+class SnilsRegistry:
+    """
+    Проверенные СНИЛС и итоги их проверки в памяти процесса.
+
+    Первый документ с данным СНИЛС «занимает» его (`claim`), следующие считаются дубликатами
+    и получают итог проверки первого. Обработчики общей очереди заданий используют вместо него
+    реестр в базе очереди (см. `jobqueue.SharedSnilsRegistry`) с теми же методами.
+
+    :param used: Набор занятых СНИЛС.
+    :param results: Словарь «СНИЛС → (лист Excel, сообщение)».
+    """
+
+    def __init__(self, used: Optional[set] = None, results: Optional[dict] = None):
+        self.used = set() if used is None else used
+        self.results = {} if results is None else results
+        self.owners = {}
+
+    def __contains__(self, snils) -> bool:
+        with _snils_lock:
+            return snils in self.used
+
+    def claim(self, snils: str, local_uid: str) -> Tuple[bool, Optional[tuple]]:
+        """
+        Занимает СНИЛС для документа `local_uid`. Повторная проверка того же документа (например,
+        повторная попытка в режиме наблюдения за папкой) дубликатом не считается.
+
+        :return: Кортеж (дубликат ли документ, итог проверки оригинала или `None`, если он еще неизвестен).
+        """
+        with _snils_lock:
+            if snils in self.used and self.owners.get(snils) != local_uid:
+                return True, self.results.get(snils)
+            self.used.add(snils)
+            self.owners[snils] = local_uid
+            return False, None
+
+    def record(self, snils: str, sheet_name: str, message: str):
+        """
+        Запоминает итог проверки СНИЛС, который получат его дубликаты.
+        """
+        with _snils_lock:
+            self.results[snils] = (sheet_name, message)
+
+
+_default_registry = SnilsRegistry(used_snils, snils_results)
+
+# Реестр СНИЛС, общий для нескольких процессов (задает обработчик очереди заданий);
+# рабочие потоки конвейера наследуют его через copy_context.
+shared_snils_registry = contextvars.ContextVar("shared_snils_registry", default=None)
+
+
+def _snils_registry():
+    """
+    Возвращает реестр использованных СНИЛС и результатов их проверки для текущего региона.
+
+    Если задан `shared_snils_registry`, используется он. Иначе без активного региона (`current_region`)
+    используются глобальные `used_snils` и `snils_results`, а при параллельной обработке нескольких
+    регионов у каждого региона свой реестр.
+    """
+    shared = shared_snils_registry.get()
+    if shared is not None:
+        return shared
+    region = current_region.get()
+    if region is None:
+        return _default_registry
+    with _snils_lock:
+        return _region_snils.setdefault(region, SnilsRegistry())
+
+
+def _find_mpi_mismatch_errors(data):
+    """
+    :return: Ошибки PATIENT_MPI_MISMATCH документа, при отсутствии которых документ не проходит проверку.
+    """
+    return [error for error in data.get('errors', []) if error['code'] == 'PATIENT_MPI_MISMATCH' and ('Имя пациента' in error['message'] or 'Дата рождения' in error['message'] or 'снилс' in error['message'].lower()) or 'Пол пациента' in error['message']]
+
+
+def pfr_check_data(data):
+    """
+    Формирует данные пациента для проверки СНИЛС в ПФР (`update_cookies_and_post`).
+
+    :param data: Документ пациента.
+    :return: Словарь с ключами "surname", "name", "patrName", "birthDate" (ДД.ММ.ГГГГ), "snils".
+    """
+    birth_date = data['patient']['birthDate']
+    reversed_birth_date = '.'.join(birth_date.split('-')[::-1])
+    return {
+        "surname": data['patient']['surname'],
+        "name": data['patient']['name'],
+        "patrName": data['patient'].get('patrName', ''),
+        "birthDate": reversed_birth_date,
+        "snils": data['patient']['snils']
+    }
+
+
+def estimate_check_cost(data, mpi_mismatch_errors):
+    """
+    Оценивает стоимость проверки документа по локальным данным, без обращения к сети.
+
+    Условия повторяют порядок `check_patient_data`: дубликат уже проверенного СНИЛС и документ,
+    не проходящий локальные проверки (нет нужных ошибок PATIENT_MPI_MISMATCH, пробелы в ФИО, нет
+    организации ни в метаданных, ни в теле документа), решаются без ПФР; ответ ПФР может быть
+    в архиве воспроизведения; остальным нужен запрос к ПФР. Проверка пола не оценивается.
+
+    :param data: Документ пациента.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH.
+    :return: Кортеж (стоимость `COST_*`, код организации или `None`, если организация не найдена).
+    """
+    patient = data['patient']
+    duplicate = patient['snils'] in _snils_registry()
+
+    organization = data.get('organization') or {}
+    if 'code' in organization and 'displayName' in organization:
+        organization_code = organization['code']
+    else:
+        decoded = decode_base64_to_text(data.get('docContent', {}).get('data', ''))
+        organization_code, organization_name = extract_oid_name(decoded or '')
+        if organization_name is None:
+            organization_code = None
+
+    if duplicate:
+        return COST_DUPLICATE, organization_code
+    if mpi_mismatch_errors and not _find_mpi_mismatch_errors(data):
+        return COST_LOCAL, organization_code
+    if check_for_whitespace(patient['name']) or check_for_whitespace(patient['surname']) \
+            or check_for_whitespace(patient.get('patrName', '')):
+        return COST_LOCAL, organization_code
+    if organization_code is None:
+        return COST_LOCAL, organization_code
+    if is_check_recorded(pfr_check_data(data)):
+        return COST_RECORDED, organization_code
+    return COST_PFR, organization_code
+
+
+@timed("check_patient", "Проверка данных пациента")
+def check_patient_data(json_filename, root, mpi_mismatch_errors, data=None):
     """
     Проверяет данные пациента в JSON-файле и возвращает результат проверки.
 
-    Функция открывает JSON-файл, проверяет наличие ошибок в данных пациента, включая проверку на
+    Функция читает документ (из хранилища `docstore` или JSON-файла старого формата), проверяет наличие ошибок в данных пациента, включая проверку на
     наличие ошибки `PATIENT_MPI_MISMATCH` в случае, если этот параметр активирован. Результаты
     проверок логируются и записываются в Excel.
 
-    :param json_filename: Имя JSON-файла (local_uid), содержащего данные пациента.
+    :param json_filename: Путь вида `data/<local_uid>.json` к документу с данными пациента.
     :param root: Корневое окно Tkinter, используемое для создания окна капчи.
     :param mpi_mismatch_errors: Логическое значение, указывающее, нужно ли учитывать ошибки 
                                 `PATIENT_MPI_MISMATCH` при валидации данных пациента.
+    :param data: Уже прочитанный документ (например, планировщиком стадии проверки); если не задан,
+                 документ читается по пути `json_filename`.
     :return: Словарь с результатами проверки, если все проверки пройдены успешно; `None` в противном случае.
     """
-    logger.info("Запущена функция check_patient_data")
+    logger.debug("Запущена функция check_patient_data: %s", json_filename)
     try:
         local_uid = os.path.splitext(os.path.basename(json_filename))[0]
-        try:
-            with open(json_filename, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-        except FileNotFoundError:
-            logger.error(f"Файл '{json_filename}' не найден.")
-            log_message_to_excel('Все документы', [(local_uid, 'Файл не найден')])
-            log_message_to_excel('Отсутсвует', [(local_uid, 'Файл не найден')])
-            return None
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка при декодировании JSON в файле '{json_filename}': {str(e)}")
-            log_message_to_excel('Все документы', [(local_uid, 'Ошибка при декодировании JSON')])
-            log_message_to_excel('Отсутсвует', [(local_uid, 'Файл не найден')])
-            return None
+        if data is None:
+            try:
+                with timer("json_parse", "Чтение и разбор JSON документа"):
+                    data = load_document(json_filename)
+            except FileNotFoundError:
+                logger.error("Файл '%s' не найден.", json_filename)
+                log_message_to_excel('Все документы', [(local_uid, 'Файл не найден')])
+                log_message_to_excel('Отсутсвует', [(local_uid, 'Файл не найден')])
+                return None
+            except ValueError as e:
+                logger.error("Ошибка при декодировании JSON в файле '%s': %s", json_filename, e)
+                log_message_to_excel('Все документы', [(local_uid, 'Ошибка при декодировании JSON')])
+                log_message_to_excel('Отсутсвует', [(local_uid, 'Файл не найден')])
+                return None
         
     
-        global used_snils, snils_results
+        registry = _snils_registry()
         new_snils = data['patient']['snils']
 
-        if new_snils in used_snils:
-            original_result = snils_results.get(new_snils)
+        # Реестр держит блокировку только на время обновления: запись в Excel долгая, а `estimate_check_cost`
+        # обращается к реестру из потоков выгрузки.
+        duplicate, original_result = registry.claim(new_snils, local_uid)
+        if duplicate:
             if original_result:
                 sheet_name, original_message = original_result
                 duplicate_message = f"Найден дубликат по номеру СНИЛС. Сообщение оригинала: {original_message}"
@@ -110,18 +265,16 @@ def check_patient_data(json_filename, root, mpi_mismatch_errors):
                 log_message_to_excel('Все документы', [(local_uid, duplicate_message)])
                 logger.error(duplicate_message)
             return None
-        else:
-            used_snils.append(new_snils)
 
         if mpi_mismatch_errors:
-            mpi_mismatch_errors_list = [error for error in data.get('errors', []) if error['code'] == 'PATIENT_MPI_MISMATCH' and ('Имя пациента' in error['message'] or 'Дата рождения' in error['message'] or 'снилс' in error['message'].lower()) or 'Пол пациента' in error['message']]
+            mpi_mismatch_errors_list = _find_mpi_mismatch_errors(data)
 
             if not mpi_mismatch_errors_list:
                 result_message = "Соответствующих ошибок PATIENT_MPI_MISMATCH c именем пациента или датой рождения или снилс или полом не обнаружено."
                 logger.info(result_message)
                 log_message_to_excel('PATIENT_MPI_MISMATCH нет', [(local_uid, result_message)])
                 log_message_to_excel('Все документы', [(local_uid, result_message)])
-                snils_results[new_snils] = ('PATIENT_MPI_MISMATCH нет', result_message)
+                registry.record(new_snils, 'PATIENT_MPI_MISMATCH нет', result_message)
                 return None 
 
         if check_for_whitespace(data['patient']['name']) or check_for_whitespace(data['patient']['surname']):
@@ -129,7 +282,7 @@ def check_patient_data(json_filename, root, mpi_mismatch_errors):
             logger.error(result_message)
             log_message_to_excel('Пробелы в ФИО', [(local_uid, result_message)])
             log_message_to_excel('Все документы', [(local_uid, result_message)])
-            snils_results[new_snils] = ('Пробелы в ФИО', result_message)
+            registry.record(new_snils, 'Пробелы в ФИО', result_message)
             return None
 
         if 'patrName' in data['patient']:
@@ -138,20 +291,21 @@ def check_patient_data(json_filename, root, mpi_mismatch_errors):
                 logger.error(result_message)
                 log_message_to_excel('Пробелы в ФИО', [(local_uid, result_message)])
                 log_message_to_excel('Все документы', [(local_uid, result_message)])
-                snils_results[new_snils] = ('Пробелы в ФИО', result_message)
+                registry.record(new_snils, 'Пробелы в ФИО', result_message)
                 return None
         else:
-            logger.info("Отчество отсутствует.")
+            logger.debug("Отчество отсутствует.")
 
         gender_error = any(error['code'] == 'PATIENT_MPI_MISMATCH' and 'Пол пациента' in error['message'] for error in data.get('errors', []))
         if gender_error:
-            logger.debug(f"Пол пациента в метаданных {data['patient']['surname']} {data['patient']['name']} {data['patient'].get('patrName', '')}: {'Муж' if data['patient']['gender']['code']=='1' else 'Жен'}")
+            logger.debug("Пол пациента в метаданных %s %s %s: %s", data['patient']['surname'], data['patient']['name'],
+                         data['patient'].get('patrName', ''), 'Муж' if data['patient']['gender']['code'] == '1' else 'Жен')
             if not data['patient']['gender']['code'] == classify_gender(data['patient']['surname'], data['patient']['name'], data['patient'].get('patrName', '')):
                 result_message = "Пол пациента не соответствует требуемому. Смотрите логи."
                 logger.error(result_message)
                 log_message_to_excel('Пол пациента', [(local_uid, result_message)])
                 log_message_to_excel('Все документы', [(local_uid, result_message)])
-                snils_results[new_snils] = ('Пол пациента', result_message)
+                registry.record(new_snils, 'Пол пациента', result_message)
                 return None
 
         if 'organization' not in data or 'code' not in data['organization'] or 'displayName' not in data['organization']:
@@ -167,29 +321,18 @@ def check_patient_data(json_filename, root, mpi_mismatch_errors):
                 logger.error(result_message)
                 log_message_to_excel('Ошибка нет организации', [(local_uid, result_message)])
                 log_message_to_excel('Все документы', [(local_uid, result_message)])
-                snils_results[new_snils] = ('Ошибка нет организации', result_message)
+                registry.record(new_snils, 'Ошибка нет организации', result_message)
                 return None
             else:
-                logger.info("Код организации и отображаемое имя организации в теле документа найдены.")
+                logger.debug("Код организации и отображаемое имя организации в теле документа найдены.")
 
         else:
-            logger.info("Код организации и отображаемое имя организации в spring-cloud-gateway найдены.")
+            logger.debug("Код организации и отображаемое имя организации в spring-cloud-gateway найдены.")
             organization_code = data['organization']['code']
             organization_displayName = data['organization']['displayName']
         
 
-        birth_date = data['patient']['birthDate']
-        reversed_birth_date = '.'.join(birth_date.split('-')[::-1]) 
-
-
-
-        patient_data = {
-            "surname": data['patient']['surname'],
-            "name": data['patient']['name'],
-            "patrName": data['patient'].get('patrName', ''),
-            "birthDate": reversed_birth_date,
-            "snils": data['patient']['snils']
-        }
+        patient_data = pfr_check_data(data)
 
         
         if json_pfr_data:= update_cookies_and_post(patient_data, root):
@@ -215,22 +358,22 @@ def check_patient_data(json_filename, root, mpi_mismatch_errors):
                 log_message_to_excel('Созданные файлы', [(xml_filename, None)])
                 log_message_to_excel('Созданные файлы и их дубли', [(local_uid, f"Отправлен на формирование XML {xml_filename}")])
                 log_message_to_excel('Все документы', [(local_uid, f"Отправлен на формирование XML {xml_filename}")])
-                snils_results[new_snils] = ('Созданные файлы и их дубли', xml_filename)
+                registry.record(new_snils, 'Созданные файлы и их дубли', xml_filename)
                 return result
             else:
                 result_message = "Отчество на ПФР и поле отчества из spring-cloud-gateway не совпадают."
                 logger.error(result_message)
                 log_message_to_excel('Ошибки ПФР', [(local_uid, result_message)])
                 log_message_to_excel('Все документы', [(local_uid, result_message)])
-                snils_results[new_snils] = ('Ошибки ПФР', result_message)
+                registry.record(new_snils, 'Ошибки ПФР', result_message)
                 return None
 
         result_message = "Пациент не прошел проверку на пфр либо запрос к cheksnils пфр не удался."
         logger.error(result_message)
         log_message_to_excel('Ошибки ПФР', [(local_uid, result_message)])
         log_message_to_excel('Все документы', [(local_uid, result_message)])
-        snils_results[new_snils] = ('Ошибки ПФР', result_message)
+        registry.record(new_snils, 'Ошибки ПФР', result_message)
         return None
 
     except Exception as e:
-        logger.error(f"Ошибка при проверке данных: {e}")
\ No newline at end of file
+        logger.error("Ошибка при проверке данных: %s", e)
\ No newline at end of file
@@ -1,49 +1,66 @@
 import requests
-import json
 import os
 from urllib.parse import urlparse
-import time
 import logging
-import openpyxl
-from openpyxl import Workbook
 from logging_excel.log import log_message_to_excel
+from metrics.metrics import timed
+from uidinput.uidinput import UidDeduplicator, find_snils_duplicates
+from docstore.docstore import get_store, split_document_path
+from replay.replay import exchange, KIND_GATEWAY
+from cancellation.cancellation import cancel_requested, pause, report_transient_error, request_timeout
 logger = logging.getLogger(__name__)
 
+_http_session = requests.Session()
+
+
+
+@timed("gateway_fetch", "Запрос документа к spring-cloud-gateway")
+def _is_transient(error: requests.exceptions.RequestException) -> bool:
+    """Сетевая ошибка, тайм-аут, перегрузка или ошибка сервера: повторный запрос может пройти."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
 
 
 def send_get_request(url):
     """
     Отправляет GET-запрос по указанному URL и возвращает ответ в формате JSON.
 
+    Запросы выполняются через общую сессию, поэтому соединение со шлюзом переиспользуется.
+    В режимах `record`/`replay` (см. `replay.configure_replay`) успешные ответы сохраняются в архив
+    или выдаются из него без обращения к шлюзу. Ожидание ответа ограничено тайм-аутом `timeouts.gateway`
+    (и сроком текущего запуска, см. `cancellation.call_timeout`).
+
     :param url: URL-адрес для отправки запроса.
     :return: Ответ в формате JSON, если запрос выполнен успешно; `None` в случае ошибки.
     """
     try:
-        response = requests.get(url)
+        response = exchange(KIND_GATEWAY, url, lambda: _http_session.get(url, timeout=request_timeout("gateway")),
+                            cacheable=lambda response: response.status_code == 200, url=url)
         response.raise_for_status()
         log_message_to_excel('json', [(generate_filename(url).replace('.json', ''), 'Успешное создание')])
         return response.json()
     except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при подключении к {url}: {e}")
+        logger.error("Ошибка при подключении к %s: %s", url, e)
+        if _is_transient(e):
+            report_transient_error(f"шлюз: {e}")
         log_message_to_excel('json', [(generate_filename(url).replace('.json', ''), 'Ошибка создания')])
         return None
 
-def save_to_json(data, filename):
-    """
-    Сохраняет данные в JSON-файл в папке 'data'.
-
-    :param data: Данные, которые нужно сохранить в файл.
-    :param filename: Имя файла для сохранения данных.
+def save_to_json(data, filename, data_directory=None):
     """
-    data_directory = os.path.join(os.getcwd(), 'data')
+    Сохраняет документ в хранилище папки 'data' (см. `docstore.DocumentStore`).
 
-    if not os.path.exists(data_directory):
-        os.makedirs(data_directory)
+    Документ сжимается и хранится один раз на содержимое; прочитать его можно по пути
+    `data/<filename>` через `docstore.load_document`.
 
-    file_path = os.path.join(data_directory, filename)
-
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    :param data: Данные, которые нужно сохранить.
+    :param filename: Имя файла документа (`<local_uid>.json`).
+    :param data_directory: Папка для сохранения (по умолчанию 'data' в текущем каталоге).
+    """
+    local_uid = split_document_path(filename)[1]
+    get_store(data_directory).put(local_uid, data)
 
 def generate_filename(url):
     """
@@ -58,37 +75,63 @@ def generate_filename(url):
     filename = filename.split('/')[-1] + '.json'
     return filename
 
-def start_generator_json(config, region_combobox, local_uid_text, progress_callback=None):
+def fetch_document(base_url, local_uid, data_directory=None):
+    """
+    Выгружает документ по одному локальному UID и сохраняет его в папку 'data'.
+
+    :param base_url: Базовый адрес API-эндпоинта региона.
+    :param local_uid: Локальный UID документа (без пробелов по краям).
+    :param data_directory: Папка для сохранения (по умолчанию 'data' в текущем каталоге).
+    :return: Имя сохраненного JSON-файла, если документ получен; `None` в случае ошибки.
+    """
+    url = os.path.join(base_url, local_uid)
+    json_data = send_get_request(url)
+    if json_data:
+        filename = generate_filename(url)
+        save_to_json(json_data, filename, data_directory)
+        return filename
+    return None
+
+def start_generator_json(config, region_combobox, local_uids, progress_callback=None, total_urls=0):
     """
     Генерирует JSON-файлы для локальных UID на основе конфигурации и сохраняет их на диск.
 
     :param config: Конфигурационный словарь, содержащий информацию о регионах и API-эндпоинтах.
     :param region_combobox: Виджет выбора региона, который предоставляет выбранный регион.
-    :param local_uid_text: Виджет текста, содержащий локальные UID, по одному на строку.
+    :param local_uids: Итерируемый набор локальных UID (например, `uidinput.UidSource`); читается лениво.
     :param progress_callback: Необязательная функция обратного вызова для отслеживания прогресса.
+    :param total_urls: Общее количество UID для индикатора прогресса.
     :return: Количество успешно обработанных и сохраненных JSON-файлов.
+
+    Повторы UID и UID, документы которых уже выгружены и дублируют другой документ пакета по СНИЛС,
+    повторно не выгружаются; такие дубликаты по СНИЛС перечисляются в `snils_skipped_uids.txt`. После отмены запуска (см. `cancellation.CancelToken`) новые UID не выгружаются.
     """
     selected_region = region_combobox.get()
     selected_region_config = config["regions"][selected_region]
     base_url = selected_region_config.get("api_endpoint")
-    local_uids = local_uid_text.get("1.0", "end-1c").strip().split('\n')
-    total_urls = len(local_uids)
+    snils_duplicates = {}
+    if iter(local_uids) is not local_uids:
+        snils_duplicates = find_snils_duplicates(local_uids, os.path.join(os.getcwd(), 'data'))
+    deduplicator = UidDeduplicator(snils_duplicates)
 
     successful_uploads = 0
 
     for index, local_uid in enumerate(local_uids, start=1):
-        if local_uid.strip():
-            url = os.path.join(base_url, local_uid.strip())
-            json_data = send_get_request(url)
-            if json_data:
-                filename = generate_filename(url)
-                save_to_json(json_data, filename)
+        if cancel_requested():
+            logger.warning("Выгрузка остановлена: обработано %s из %s UID", index - 1, total_urls)
+            break
+        local_uid = deduplicator.check(local_uid)
+        if local_uid:
+            filename = fetch_document(base_url, local_uid)
+            if filename:
                 successful_uploads += 1
-                logger.info(f"Данные local_uid: {local_uid} сохранены в {filename}. Обработка {index} из {total_urls}")
+                logger.info("Данные local_uid: %s сохранены в %s. Обработка %s из %s", local_uid, filename, index, total_urls)
                 
                 if progress_callback:
                     progress_callback(index, total_urls)
                     
-                time.sleep(1)
+                pause(1)
 
+    deduplicator.flush()
+    deduplicator.write_snils_skipped(os.getcwd())
     return successful_uploads
@@ -0,0 +1,242 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+from logging_excel.log import log_message_to_excel
+from docstore.docstore import get_store
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+SNILS_SKIPPED_FILE = 'snils_skipped_uids.txt'
+_INVISIBLE_CHARS = '\ufeff\u200b\u00a0'
+
+
+def count_lines(path: str) -> int:
+    """
+    Быстро подсчитывает количество строк в файле, читая его блоками по 1 МБ без декодирования.
+
+    Последняя строка без завершающего перевода строки тоже учитывается.
+
+    :param path: Путь к файлу.
+    :return: Количество строк.
+    """
+    lines = 0
+    last_byte = b'\n'
+    with open(path, 'rb') as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            lines += chunk.count(b'\n')
+            last_byte = chunk[-1:]
+    if last_byte != b'\n':
+        lines += 1
+    return lines
+
+
+def iter_uids(path: str) -> Iterator[str]:
+    """
+    Лениво читает локальные UID из файла, по одному на строку.
+
+    Файл не загружается в память целиком; пустые строки пропускаются. Строки возвращаются как есть
+    (без перевода строки), как и у `iter_text_lines`: нормализует их `UidDeduplicator.check`, который
+    и записывает в лог UID с пробелами.
+
+    :param path: Путь к файлу со списком UID.
+    :return: Генератор строк с UID.
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.strip():
+                yield line
+
+
+def iter_text_lines(text: str) -> Iterator[str]:
+    """
+    Возвращает строки текста (например, содержимого поля `local_uid_text`) без построения списка.
+
+    :param text: Многострочный текст.
+    :return: Генератор строк без символа перевода строки.
+    """
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+class UidSource:
+    """
+    Источник UID для стадий обработки: файл или текст из поля ввода.
+
+    Каждый вызов `iter(...)` начинает чтение заново, поэтому один источник можно передать
+    нескольким стадиям по очереди. `total` — количество строк для индикатора прогресса.
+
+    :param path: Путь к файлу со списком UID.
+    :param text: Текст со списком UID (используется, если `path` не задан).
+    """
+
+    def __init__(self, path: str = None, text: str = None):
+        self.path = path
+        self.text = (text or "").strip()
+        if path:
+            self.total = count_lines(path)
+            logger.info("Файл UID %s: строк %s", path, self.total)
+        else:
+            self.total = self.text.count('\n') + 1 if self.text else 0
+
+    def __iter__(self) -> Iterator[str]:
+        if self.path:
+            return iter_uids(self.path)
+        return iter_text_lines(self.text)
+
+
+def normalize_uid(raw: str) -> str:
+    """
+    Приводит локальный UID к каноническому виду: убирает пробелы, неразрывные пробелы,
+    BOM и символы нулевой ширины по краям.
+
+    :param raw: Строка из списка UID.
+    :return: Нормализованный UID (пустая строка, если UID отсутствует).
+    """
+    return raw.strip().strip(_INVISIBLE_CHARS).strip()
+
+
+class UidDeduplicator:
+    """
+    Отсеивает повторы UID до любой сетевой работы.
+
+    Повторы и UID с лишними пробелами записываются в лог; повторы также накапливаются
+    и записываются на лист 'Дубликаты UID' Excel-лога пачками по `flush_interval` (и при `flush`),
+    чтобы не открывать книгу на каждую запись.
+
+    UID, отсеянные по `snils_duplicates`, решены по ранее сохраненным документам: если СНИЛС документа
+    с тех пор изменился, решение устарело. Поэтому такие UID дополнительно собираются в `snils_skipped`,
+    и `write_snils_skipped` записывает их в файл, с которого их можно обработать повторно.
+
+    :param snils_duplicates: Словарь «UID-дубликат по СНИЛС → UID оригинала» (см. `find_snils_duplicates`).
+    :param flush_interval: Количество накопленных повторов, после которого они записываются в Excel.
+    :param track_repeats: Отсеивать ли повторы UID. Обработчик очереди заданий его отключает: повторы
+                          отсеивает сама очередь, а задание с истекшей арендой может вернуться к тому же обработчику.
+    """
+
+    def __init__(self, snils_duplicates: Optional[Dict[str, str]] = None, flush_interval: int = 1000,
+                 track_repeats: bool = True):
+        self.snils_duplicates = snils_duplicates or {}
+        self.flush_interval = flush_interval
+        self.track_repeats = track_repeats
+        self.snils_skipped = []
+        self.seen = set()
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def check(self, raw: str) -> Optional[str]:
+        """
+        Проверяет очередной UID.
+
+        :param raw: Строка из списка UID.
+        :return: Нормализованный UID, если его нужно обрабатывать; `None` для пустых строк и повторов.
+        """
+        local_uid = normalize_uid(raw)
+        if not local_uid:
+            return None
+        if local_uid != raw:
+            logger.info("UID %r содержал пробелы или невидимые символы, нормализован в %s", raw, local_uid)
+
+        message = None
+        with self._lock:
+            if self.track_repeats and local_uid in self.seen:
+                message = "Повтор local_uid в списке, обработан один раз"
+            else:
+                if self.track_repeats:
+                    self.seen.add(local_uid)
+                original = self.snils_duplicates.get(local_uid)
+                if original:
+                    message = (f"Найден дубликат по номеру СНИЛС по ранее выгруженным документам, UID не выгружался. "
+                               f"Оригинал: {original}")
+                    self.snils_skipped.append(local_uid)
+            if message:
+                self._pending.append((local_uid, message))
+                flush = len(self._pending) >= self.flush_interval
+        if message:
+            logger.warning("%s: %s", local_uid, message)
+            if flush:
+                self.flush()
+            return None
+        return local_uid
+
+    def flush(self):
+        """
+        Записывает накопленные повторы на листы 'Дубликаты UID' и 'Все документы'.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            log_message_to_excel('Дубликаты UID', pending)
+            log_message_to_excel('Все документы', pending)
+
+    def write_snils_skipped(self, directory: str) -> Optional[str]:
+        """
+        Записывает UID, отсеянные по СНИЛС ранее выгруженных документов, в `snils_skipped_uids.txt`.
+
+        :param directory: Каталог файла.
+        :return: Путь к файлу или `None`, если таких UID нет.
+        """
+        with self._lock:
+            skipped = list(self.snils_skipped)
+        if not skipped:
+            return None
+        path = os.path.join(directory, SNILS_SKIPPED_FILE)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(local_uid + '\n' for local_uid in skipped)
+        logger.warning("UID, пропущенные как дубликаты по СНИЛС ранее выгруженных документов (%s), записаны в %s; "
+                       "если СНИЛС документов изменился, обработайте их повторно", len(skipped), path)
+        return path
+
+
+def group_by_snils(data_directory: str) -> Dict[str, str]:
+    """
+    Возвращает СНИЛС каждого документа хранилища (`docstore`) по его индексу, без чтения самих документов.
+
+    Файлы старого формата `<local_uid>.json` не учитываются: их нужно один раз перенести в хранилище
+    (`python -m docstore.docstore migrate data`).
+
+    :param data_directory: Папка с документами.
+    :return: Словарь «local_uid → СНИЛС»; документы без СНИЛС пропускаются.
+    """
+    if not os.path.isdir(data_directory):
+        return {}
+    return get_store(data_directory).snils_by_uid()
+
+
+def find_snils_duplicates(local_uids: Iterable[str], data_directory: str) -> Dict[str, str]:
+    """
+    Находит UID пакета, документы которых уже выгружены и имеют одинаковый СНИЛС.
+
+    Оригиналом считается первый по порядку ввода UID с данным СНИЛС; остальные UID группы
+    возвращаются как дубликаты и не отправляются на выгрузку, проверку ПФР и подпись. Решение
+    основано на сохраненных документах, поэтому каждый такой UID записывается в лог
+    (см. `UidDeduplicator.write_snils_skipped`).
+
+    :param local_uids: Итерируемый набор UID в порядке ввода.
+    :param data_directory: Папка с выгруженными документами.
+    :return: Словарь «UID-дубликат → UID оригинала».
+    """
+    snils_by_uid = group_by_snils(data_directory)
+    if not snils_by_uid:
+        return {}
+    originals = {}
+    duplicates = {}
+    for raw in local_uids:
+        local_uid = normalize_uid(raw)
+        snils = snils_by_uid.get(local_uid)
+        if not snils:
+            continue
+        original = originals.setdefault(snils, local_uid)
+        if original != local_uid:
+            duplicates[local_uid] = original
+    if duplicates:
+        logger.info("По СНИЛС найдено дубликатов среди выгруженных документов: %s", len(duplicates))
+    return duplicates
@@ -0,0 +1,322 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import tkinter as tk
+from typing import List
+from uidinput.uidinput import UidDeduplicator, normalize_uid
+from logsetup.logsetup import setup_logging
+from metrics import metrics
+from replay.replay import configure_replay
+from cancellation.cancellation import configure_timeouts
+from profiling.profiling import profile_run
+from pipeline.pipeline import Pipeline, build_stages, format_report, get_pipeline_config, DEFAULT_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCHER_CONFIG = {
+    "inbox": "inbox",
+    "pattern_suffix": ".txt",
+    "poll_interval": 1.0,
+    "state_file": "watcher_state.json",
+    "processed_file": "processed_uids.txt",
+    "pending_file": "pending_uids.txt",
+    "curl_file": "curl_commands.txt",
+    "retry_stages": ["fetch", "check"],
+    "retry_delay": 60,
+    "max_attempts": 3,
+}
+
+
+class InboxWatcher:
+    """
+    Отслеживает папку с файлами списков UID и возвращает только новые строки.
+
+    Для каждого файла запоминается позиция, до которой он прочитан, поэтому дописываемый файл
+    читается с места остановки. Незавершенная последняя строка (без перевода строки) ждет следующего
+    опроса. Позиции сохраняются в `state_file`, обработанные UID — в `processed_file`, так что после
+    перезапуска повторной обработки не происходит.
+
+    Принятые, но еще не обработанные UID записываются в `pending_file` до сохранения позиций. После
+    сбоя или остановки посреди работы они выдаются первым вызовом `scan` заново, поэтому UID,
+    строки которых уже прочитаны, не теряются.
+
+    :param inbox: Папка входящих файлов.
+    :param state_file: Файл с позициями чтения.
+    :param processed_file: Файл со списком обработанных UID (по одному на строку).
+    :param suffix: Расширение файлов со списками UID.
+    :param pending_file: Файл принятых в работу UID (по одному на строку).
+    """
+
+    def __init__(self, inbox: str, state_file: str, processed_file: str, suffix: str = ".txt",
+                 pending_file: str = DEFAULT_WATCHER_CONFIG["pending_file"]):
+        self.inbox = inbox
+        self.state_file = state_file
+        self.processed_file = processed_file
+        self.pending_file = pending_file
+        self.suffix = suffix
+        self.offsets = {}
+        self.seen = set()
+        self._lock = threading.Lock()
+        os.makedirs(inbox, exist_ok=True)
+
+        if os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.offsets = json.load(f)
+        if os.path.exists(processed_file):
+            with open(processed_file, 'r', encoding='utf-8') as f:
+                self.seen.update(line.strip() for line in f if line.strip())
+        self._recovered = self._load_pending()
+        logger.info("Папка %s: ранее обработано UID: %s, не завершено до остановки: %s",
+                    inbox, len(self.seen) - len(self._recovered), len(self._recovered))
+
+    def _load_pending(self) -> List[str]:
+        """
+        Читает `pending_file` и оставляет в нем только UID, не попавшие в `processed_file`.
+
+        :return: Незавершенные UID в порядке приема.
+        """
+        if not os.path.exists(self.pending_file):
+            return []
+        unfinished = []
+        with open(self.pending_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                local_uid = line.strip()
+                if local_uid and local_uid not in self.seen:
+                    self.seen.add(local_uid)
+                    unfinished.append(local_uid)
+        temp_file = self.pending_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.writelines(local_uid + '\n' for local_uid in unfinished)
+        os.replace(temp_file, self.pending_file)
+        return unfinished
+
+    def _save_offsets(self):
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.offsets, f)
+        os.replace(temp_file, self.state_file)
+
+    def scan(self) -> List[str]:
+        """
+        Читает новые строки из всех файлов папки.
+
+        :return: Список новых UID без повторов, в порядке появления; при первом вызове в начале
+                 списка — UID, не завершенные до остановки.
+        """
+        new_uids, self._recovered = self._recovered, []
+        changed = False
+        for entry in sorted(os.scandir(self.inbox), key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.endswith(self.suffix):
+                continue
+            offset = self.offsets.get(entry.name, 0)
+            size = entry.stat().st_size
+            if size < offset:
+                logger.info("Файл %s был перезаписан, чтение с начала", entry.name)
+                offset = 0
+            if size == offset:
+                continue
+
+            with open(entry.path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            complete = chunk.rfind(b'\n') + 1
+            if complete == 0:
+                continue
+            self.offsets[entry.name] = offset + complete
+            changed = True
+
+            for line in chunk[:complete].decode('utf-8-sig' if offset == 0 else 'utf-8', errors='replace').splitlines():
+                local_uid = normalize_uid(line)
+                if not local_uid:
+                    continue
+                with self._lock:
+                    if local_uid in self.seen:
+                        logger.info("UID %s из %s уже обработан или в работе, пропуск", local_uid, entry.name)
+                        continue
+                    self.seen.add(local_uid)
+                new_uids.append(local_uid)
+
+        if changed:
+            # Сначала UID записываются как принятые, и только затем сдвигаются позиции чтения.
+            with self._lock:
+                with open(self.pending_file, 'a', encoding='utf-8') as f:
+                    f.writelines(local_uid + '\n' for local_uid in new_uids)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._save_offsets()
+        return new_uids
+
+    def mark_processed(self, local_uid: str):
+        """
+        Записывает UID в файл обработанных.
+        """
+        with self._lock:
+            with open(self.processed_file, 'a', encoding='utf-8') as f:
+                f.write(local_uid + '\n')
+
+
+def run_watcher(config, region_name, root, stop_event: threading.Event, mpi_mismatch_errors=True) -> dict:
+    """
+    Постоянно обрабатывает новые UID из папки входящих файлов до установки `stop_event`.
+
+    Один конвейер работает все время, поэтому соединения, сессия ПФР и анализатор пола остаются
+    прогретыми: UID проходит стадии через секунды после появления в файле. Настройки берутся из
+    раздела `watcher` конфигурации (см. `DEFAULT_WATCHER_CONFIG`).
+
+    UID, отсеянный на одной из стадий `retry_stages` (по умолчанию выгрузка и проверка) из-за временной
+    ошибки — недоступности шлюза или ПФР, тайм-аута, антиспама ПФР (9107), см. `PipelineItem.transient_error`, —
+    через `retry_delay` секунд обрабатывается повторно, всего не больше `max_attempts` раз. Только после
+    этого он записывается в обработанные. UID, отсеянный проверкой данных, сразу считается обработанным.
+
+    :param config: Конфигурационный словарь.
+    :param region_name: Имя региона.
+    :param root: Корневое окно Tkinter для окна капчи.
+    :param stop_event: Событие остановки; после него обрабатываются уже принятые UID.
+    :param mpi_mismatch_errors: Учитывать ли ошибки PATIENT_MPI_MISMATCH при проверке.
+    :return: Отчет конвейера.
+    """
+    watcher_config = {**DEFAULT_WATCHER_CONFIG, **config.get("watcher", {})}
+    inbox_watcher = InboxWatcher(
+        watcher_config["inbox"], watcher_config["state_file"],
+        watcher_config["processed_file"], watcher_config["pattern_suffix"],
+        watcher_config["pending_file"],
+    )
+    pending = queue.Queue()
+    # Повторы UID отсеивает сам InboxWatcher; повторная попытка того же UID не должна считаться повтором.
+    deduplicator = UidDeduplicator(flush_interval=1, track_repeats=False)
+    curl_lock = threading.Lock()
+    attempts = {}
+    attempts_lock = threading.Lock()
+    retries = []
+    retries_lock = threading.Lock()
+
+    def poll():
+        while not stop_event.is_set():
+            try:
+                for local_uid in inbox_watcher.scan():
+                    pending.put(local_uid)
+            except Exception as e:
+                logger.error("Ошибка при чтении папки %s: %s", watcher_config['inbox'], e)
+            now = time.monotonic()
+            with retries_lock:
+                due = [local_uid for retry_at, local_uid in retries if retry_at <= now]
+                retries[:] = [(retry_at, local_uid) for retry_at, local_uid in retries if retry_at > now]
+            for local_uid in due:
+                pending.put(local_uid)
+            stop_event.wait(watcher_config["poll_interval"])
+
+    def uid_stream():
+        while True:
+            try:
+                yield pending.get(timeout=0.5)
+            except queue.Empty:
+                if stop_event.is_set() and pending.empty():
+                    return
+
+    def on_item_done(item):
+        if item.transient_error and item.failed_stage in watcher_config["retry_stages"]:
+            with attempts_lock:
+                attempt = attempts.get(item.local_uid, 1)
+                retry = attempt < watcher_config["max_attempts"]
+                if retry:
+                    attempts[item.local_uid] = attempt + 1
+            if retry:
+                logger.warning("UID %s отсеян на стадии %s: %s (попытка %s из %s), повтор через %s с",
+                               item.local_uid, item.failed_stage, item.transient_error, attempt,
+                               watcher_config["max_attempts"], watcher_config["retry_delay"])
+                with retries_lock:
+                    retries.append((time.monotonic() + watcher_config["retry_delay"], item.local_uid))
+                return
+        with attempts_lock:
+            attempts.pop(item.local_uid, None)
+        inbox_watcher.mark_processed(item.local_uid)
+        if item.curl_command:
+            with curl_lock:
+                with open(watcher_config["curl_file"], 'a', encoding='utf-8') as f:
+                    f.write(item.curl_command + '\n')
+        if item.failed_stage:
+            logger.info("UID %s обработан за %.1f с, отсеян на стадии %s",
+                        item.local_uid, item.finished - item.started, item.failed_stage)
+        else:
+            logger.info("UID %s обработан за %.1f с", item.local_uid, item.finished - item.started)
+
+    logger.info("Наблюдение за папкой %s для региона %s", watcher_config['inbox'], region_name)
+    threading.Thread(target=poll, name="inbox-poll", daemon=True).start()
+    with profile_run(config, f"watcher-{region_name}") as session:
+        stages = build_stages(config, region_name, root, mpi_mismatch_errors, deduplicator=deduplicator)
+        if session:
+            session.wrap_stages(stages)
+        pipeline = Pipeline(
+            stages,
+            queue_size=get_pipeline_config(config, region_name).get("queue_size", DEFAULT_QUEUE_SIZE),
+            on_item_done=on_item_done,
+        )
+        report = pipeline.run(uid_stream())
+    logger.info("Наблюдение остановлено:\n%s", format_report(report))
+    return report
+
+
+def main(argv=None):
+    """
+    Командная строка режима наблюдения за папкой.
+
+    Пример::
+
+        python -m watcher.watcher --region Region_1
+
+    Остановка — Ctrl+C; уже принятые UID будут обработаны до конца.
+    """
+    parser = argparse.ArgumentParser(description="Непрерывная обработка UID из папки входящих файлов")
+    parser.add_argument("--region", required=True)
+    parser.add_argument("--config", default="config.json", help="Путь к файлу конфигурации")
+    parser.add_argument("--no-mpi-check", action="store_true", help="Не требовать ошибок PATIENT_MPI_MISMATCH")
+    parser.add_argument("--profile", action="store_true", help="Профилировать работу (cProfile и tracemalloc)")
+    parser.add_argument("--replay", choices=["record", "replay"],
+                        help="Записывать ответы шлюза и ПФР в архив или воспроизводить их из архива (раздел replay)")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    setup_logging({**config.get("logging", {}), "rollover_on_start": False}, filename='watcher.log')
+    metrics.configure_metrics(config.get("metrics"))
+    configure_replay(config.get("replay"), args.replay)
+    configure_timeouts(config.get("timeouts"))
+    if args.profile:
+        config.setdefault("profiling", {})["enabled"] = True
+
+    root = tk.Tk()
+    root.withdraw()
+    stop_event = threading.Event()
+    result = {}
+
+    def work():
+        try:
+            result["report"] = run_watcher(config, args.region, root, stop_event, not args.no_mpi_check)
+        finally:
+            root.after(0, root.quit)
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+
+    def check_interrupt():
+        root.after(200, check_interrupt)
+
+    root.after(200, check_interrupt)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки, завершаю принятые UID")
+        stop_event.set()
+        root.mainloop()
+    if "report" in result:
+        print(format_report(result["report"]))
+    print(metrics.format_summary())
+    metrics.write_textfile()
+
+
+if __name__ == "__main__":
+    main()
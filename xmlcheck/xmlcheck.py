@@ -0,0 +1,97 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+
+from logging_excel.log import log_message_to_excel
+from metrics.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+INVALID_XML_SHEET = 'Ошибка XML'
+
+NAMESPACES = {
+    "soap": "http://www.w3.org/2003/05/soap-envelope",
+    "a": "http://www.w3.org/2005/08/addressing",
+    "hl7": "urn:hl7-org:v3",
+}
+
+WSU_ID = "{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd}Id"
+
+# Элементы конверта SOAP 1.2, без которых файл нельзя подписать (SOAP12 + WS-Security):
+# (путь от конверта, нужен ли атрибут wsu:Id — на него ссылается подпись, описание).
+STRUCTURE_RULES: List[Tuple[str, bool, str]] = [
+    ("soap:Header", False, "заголовок SOAP"),
+    ("soap:Header/a:Action", True, "действие WS-Addressing"),
+    ("soap:Header/a:MessageID", True, "идентификатор сообщения"),
+    ("soap:Header/a:To", True, "адрес получателя"),
+    ("soap:Body", True, "тело SOAP"),
+    ("soap:Body/hl7:PRPA_IN201302RU02", False, "сообщение PRPA_IN201302RU02"),
+]
+
+_validator: Optional["XmlValidator"] = None
+_validator_lock = threading.Lock()
+
+
+class XmlValidator:
+    """
+    Проверка XML-сообщений перед подписью.
+
+    Проверяется, что файл является корректным XML, корневой элемент — `soap:Envelope`, и в нем есть
+    элементы из `STRUCTURE_RULES`, на которые ссылается подпись. Содержимое полей пациента не
+    проверяется: схема сообщения с программой не поставляется.
+    """
+
+    def check(self, xml_file: str) -> Optional[str]:
+        """
+        Проверяет файл.
+
+        :param xml_file: Путь к XML-файлу.
+        :return: Описание первой найденной ошибки или `None`, если файл корректен.
+        """
+        try:
+            tree = ET.parse(xml_file)
+        except OSError as e:
+            return f"файл не прочитан: {e}"
+        except ET.ParseError as e:
+            return f"некорректный XML: {e}"
+
+        envelope = tree.getroot()
+        if envelope.tag != f"{{{NAMESPACES['soap']}}}Envelope":
+            return f"корневой элемент {envelope.tag}, ожидается soap:Envelope"
+
+        for path, needs_id, description in STRUCTURE_RULES:
+            element = envelope.find(path, NAMESPACES)
+            if element is None:
+                return f"отсутствует {description} ({path})"
+            if needs_id and not element.get(WSU_ID):
+                return f"нет атрибута wsu:Id: {description} ({path})"
+        return None
+
+
+def get_validator() -> XmlValidator:
+    """Возвращает общий для процесса проверяющий объект."""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = XmlValidator()
+    return _validator
+
+
+@timed("xml_validate", "Проверка XML перед подписью")
+def validate_xml(xml_file: str, config=None) -> bool:
+    """
+    Проверяет XML-файл перед подписью и записывает ошибку в лог и на лист 'Ошибка XML'.
+
+    :param xml_file: Путь к XML-файлу.
+    :param config: Конфигурационный словарь.
+    :return: `True`, если файл можно подписывать.
+    """
+    error = get_validator().check(xml_file)
+    if error is None:
+        logger.debug("XML прошел проверку: %s", xml_file)
+        return True
+    message = f"XML не прошел проверку и не будет подписан: {error}"
+    logger.error("%s: %s", xml_file, message)
+    log_message_to_excel(INVALID_XML_SHEET, [(xml_file, message)])
+    return False